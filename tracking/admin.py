@@ -1,4 +1,6 @@
 from django.contrib import admin
+from django.db.models import Prefetch
+from django.utils.html import format_html
 
 from tracking.models import *
 
@@ -71,6 +73,18 @@ class ContestantCheckInAdmin(admin.ModelAdmin):
     ]
 
 
+class CheckInPhotoVariantInline(admin.TabularInline):
+    model = CheckInPhotoVariant
+    extra = 0
+    readonly_fields = [
+        'kind',
+        'image',
+        'width',
+        'height',
+        'created_at'
+    ]
+
+
 @admin.register(CheckInPhoto)
 class CheckInPhotoAdmin(admin.ModelAdmin):
     readonly_fields = [
@@ -82,6 +96,34 @@ class CheckInPhotoAdmin(admin.ModelAdmin):
 
     list_display = [
         'id',
+        'thumbnail',
         'updated_at',
         'created_at'
     ]
+
+    inlines = [
+        CheckInPhotoVariantInline
+    ]
+
+    def get_queryset(self, request):
+        # Only the small variant is needed for the list view, never the original
+        thumbnails = CheckInPhotoVariant.objects.filter(kind='thumbnail')
+        return super().get_queryset(request).prefetch_related(
+            Prefetch('variants', queryset=thumbnails, to_attr='thumbnails')
+        )
+
+    @admin.display(description='Thumbnail')
+    def thumbnail(self, obj: CheckInPhoto):
+        if not obj.thumbnails:
+            return '-'
+        variant = obj.thumbnails[0]
+        return format_html('<img src="{}" width="{}" height="{}">', variant.image.url, variant.width, variant.height)
+
+
+@admin.register(CommandTreeSync)
+class CommandTreeSyncAdmin(admin.ModelAdmin):
+    list_display = [
+        'application_id',
+        'tree_hash',
+        'updated_at'
+    ]
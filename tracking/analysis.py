@@ -1,18 +1,17 @@
 import io
 
-from tracking.models import *
+import matplotlib
+# Charts are only ever rendered to files, never shown
+matplotlib.use('Agg')
+
+from tracking.reports import (
+    PERSONAL_PROGRESS_COLUMNS, CONTEST_PROGRESS_COLUMNS, LEADERBOARD_SIZE, get_personal_progress_data,
+    get_contest_progress_data
+)
 import pandas as pd
 import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
-from PIL import Image
-
-
-def normalize_weight(row):
-    if row['units'] == 'kg':
-        return row['weight'] * 2.205
-    else:
-        return row['weight']
 
 
 def weight_stats(dataframe, contestant) -> io.BytesIO:
@@ -26,9 +25,9 @@ def weight_stats(dataframe, contestant) -> io.BytesIO:
     #get individual contestant stats
     player = dataframe.loc[dataframe['name'].eq(contestant)]
     player = player.sort_values(by='weigh_in', ascending=True)
-    player['weekly_drop'] = (player.groupby(['name'])['weight_n']
+    player['weekly_drop'] = (player.groupby(['name'])['weight']
                           .diff()
-                          .fillna(player['weight_n'])
+                          .fillna(player['weight'])
                           )
     
     #aggregated weight loss/gain
@@ -37,7 +36,7 @@ def weight_stats(dataframe, contestant) -> io.BytesIO:
     #graph individual contestants stats
     plt.figure(figsize=(15, 9))
     sns.set_style("whitegrid")
-    sns.pointplot(x='weigh_in', y='weight_n', data=player, estimator=np.mean, markers='*', hue='name')
+    sns.pointplot(x='weigh_in', y='weight', data=player, estimator=np.mean, markers='*', hue='name')
 
     plt.xlabel('Weigh-in Date')
     plt.xticks(rotation=45)
@@ -45,37 +44,101 @@ def weight_stats(dataframe, contestant) -> io.BytesIO:
 
     img_buffer = io.BytesIO()
     plt.savefig(img_buffer, format='png')
+    # Figures are otherwise kept alive by pyplot, which adds up in a long-lived render worker
+    plt.close()
     return img_buffer
 
 
-def generate_personal_progress_report(contestant_id, channel_id) -> io.BytesIO:
-    contestant = Contestant.objects.get(discord_id=contestant_id, contest__channel_id=channel_id)
-
+def render_personal_progress_report(name, columns) -> bytes:
+    """
+    Renders the chart from the loaded columns (see `get_personal_progress_data`), so it can run in the chart process
+    pool without touching the DB.
+    """
     # Generate dataframe
-    contestant_check_ins = []
-
-    for contestant_check_in in ContestantCheckIn.objects.filter(contestant=contestant).all():
-        contestant_check_ins.append({
-            'weight': contestant_check_in.weight,
-            'units': contestant_check_in.units,
-            'name': contestant_check_in.contestant.name,
-            'weigh_in': contestant_check_in.check_in.starting
-        })
+    df = pd.DataFrame(columns, columns=PERSONAL_PROGRESS_COLUMNS)
+    df['weigh_in'] = pd.to_datetime(df['weigh_in']).dt.date
 
-    df = pd.DataFrame(contestant_check_ins)
-    
-    df['weigh_in']= df['weigh_in'].astype('datetime64')
-    df['weigh_in'] = df['weigh_in'].dt.date
-    df.sort_values(by='weigh_in', ascending=True)
-    df['weight_n'] = df.apply(normalize_weight, axis=1)
-    
     # Do weigh_stats logic
-    img_buffer = weight_stats(df, contestant.name)
-    img_buffer.seek(0)
+    img_buffer = weight_stats(df, name)
 
     # Output image
-    return img_buffer
+    return img_buffer.getvalue()
+
+
+def generate_personal_progress_report(contestant_id, channel_id) -> io.BytesIO:
+    name, columns = get_personal_progress_data(contestant_id, channel_id)
+    return io.BytesIO(render_personal_progress_report(name, columns))
+
+
+def contest_standings(columns: dict) -> (pd.DataFrame, pd.DataFrame):
+    """
+    Function to calculate every contestant's standing at once
+
+    columns: weigh-ins as columns, see `CONTEST_PROGRESS_COLUMNS`
+
+    Returns the standings (one row per contestant, sorted by rank) and the percentage change of each contestant
+    (rows) at each check-in (columns). Check-ins a contestant missed are NaN.
+    """
+    df = pd.DataFrame(columns, columns=CONTEST_PROGRESS_COLUMNS)
+
+    weights = df.drop_duplicates(['contestant_id', 'weigh_in'], keep='last').pivot(
+        index='contestant_id', columns='weigh_in', values='weight'
+    )
+    names = df.drop_duplicates('contestant_id').set_index('contestant_id')['name'].reindex(weights.index)
+
+    # First and latest logged weight for each contestant, skipping check-ins they missed
+    values = weights.to_numpy()
+    logged = ~np.isnan(values)
+    rows = np.arange(values.shape[0])
+    first = values[rows, logged.argmax(axis=1)]
+    latest = values[rows, values.shape[1] - 1 - logged[:, ::-1].argmax(axis=1)]
+
+    # Relative to the first weight, unless it's 0 (there's no percentage change from nothing)
+    base = np.where(first > 0, first, np.nan)
+    percent_change = (values - base[:, None]) / base[:, None] * 100
+    standings = pd.DataFrame({
+        'name': names.to_numpy(),
+        'starting_weight': first,
+        'latest_weight': latest,
+        'change': latest - first,
+        'percent_change': (latest - first) / base * 100,
+        'check_ins': logged.sum(axis=1),
+    }, index=weights.index)
+    # Biggest percentage loss ranks first
+    standings['rank'] = standings['percent_change'].rank(method='min', na_option='bottom').astype(int)
+    standings = standings.sort_values(['rank', 'name'])
+
+    progress = pd.DataFrame(percent_change, index=weights.index, columns=weights.columns)
+    return standings, progress
+
+
+def render_contest_progress_report(contest_name, columns) -> (bytes, list):
+    """
+    Renders the contest chart (top contestants only, so it stays readable for big contests) and returns it along
+    with the leaderboard rows.
+    """
+    standings, progress = contest_standings(columns)
+    leaders = standings.head(LEADERBOARD_SIZE)
+
+    plt.figure(figsize=(15, 9))
+    sns.set_style("whitegrid")
+    top = progress.loc[leaders.index]
+    lines = plt.plot(list(top.columns), top.to_numpy().T, marker='*')
+    plt.legend(lines, leaders['name'])
+    plt.title(contest_name)
+    plt.xlabel('Weigh-in Date')
+    plt.xticks(rotation=45)
+    plt.ylabel('Change (%)')
+
+    img_buffer = io.BytesIO()
+    plt.savefig(img_buffer, format='png')
+    plt.close()
+
+    leaderboard = leaders[['rank', 'name', 'change', 'percent_change']].to_dict('records')
+    return img_buffer.getvalue(), leaderboard
 
 
-def generate_contest_progress_report(contest_id) -> Image:
-    pass
+def generate_contest_progress_report(channel_id) -> (io.BytesIO, list):
+    contest_name, columns = get_contest_progress_data(channel_id)
+    image, leaderboard = render_contest_progress_report(contest_name, columns)
+    return io.BytesIO(image), leaderboard
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+from tracking.startup import startup_timer
 
 
 class TrackingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tracking'
+
+    def ready(self):
+        from tracking import signals  # noqa: F401
+        from tracking.instrumentation import install_query_counter
+        connection_created.connect(install_query_counter, dispatch_uid='tracking_query_counter')
+        startup_timer.mark('django setup')
@@ -0,0 +1,58 @@
+from django.db import connection
+from django.utils import timezone
+
+from tracking.models import Contest, CheckIn, Contestant, ContestantCheckIn
+
+
+def hot_queries(contest: Contest) -> dict:
+    """
+    The lookups the bot makes constantly, each with the names the index expected to serve it can show up as in a
+    query plan.
+    """
+    running = CheckIn.objects.filter(contest=contest, thread_id__isnull=False, finished=False).earliest('starting')
+    contestant = contest.contestants.earliest('id')
+    return {
+        'weigh-in routing by thread': (
+            CheckIn.objects.filter(thread_id=running.thread_id, finished=False),
+            ('checkin_active_thread_idx',)
+        ),
+        'startable check-in': (
+            contest.check_ins.filter(
+                finished=False,
+                thread_id__isnull=True,
+                starting__lte=timezone.now().date()
+            ).order_by('starting'),
+            ('checkin_unfinished_idx',)
+        ),
+        'running check-in': (
+            contest.check_ins.filter(
+                finished=False,
+                thread_id__isnull=False,
+                started_at__isnull=False
+            ).order_by('starting'),
+            ('checkin_unfinished_idx',)
+        ),
+        'contest by channel': (
+            Contest.objects.filter(channel_id=contest.channel_id),
+            ('contest_channel_idx',)
+        ),
+        'contestant by user and contest': (
+            Contestant.objects.filter(discord_id=contestant.discord_id, contest_id=contest.id),
+            ('contestant_discord_contest_idx',)
+        ),
+        'weigh-in by contestant and check-in': (
+            ContestantCheckIn.objects.filter(contestant=contestant, check_in=running),
+            # SQLite backs unique constraints with an automatic index rather than a named one
+            ('unique_contestant_check_in', 'sqlite_autoindex_tracking_contestantcheckin')
+        ),
+    }
+
+
+def uses_index(plan: str, indexes: tuple) -> bool:
+    return any(index in plan for index in indexes)
+
+
+def analyze():
+    # Refresh planner statistics after seeding, otherwise the plans don't reflect the row counts
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
@@ -0,0 +1,86 @@
+import datetime
+import random
+from typing import List
+
+from django.utils import timezone
+
+from tracking.constants import weight_in_grams
+from tracking.logic import build_check_in_schedule
+from tracking.models import Contest, CheckIn, Contestant, ContestantCheckIn
+from tracking.stats import rebuild_contestant_stats
+
+
+def seed_contests(
+        num_contests: int,
+        contestants_per_contest: int,
+        num_check_ins: int,
+        *,
+        check_in_period: int = 7,
+        weigh_in_rate: float = 0.8,
+        seed: int = 0
+) -> List[Contest]:
+    """
+    Seeds synthetic contests half way through their schedule: past check-ins are finished, today's is running in a
+    thread, and the rest haven't started. Contestants weighed in to past and running check-ins at `weigh_in_rate`.
+    """
+    rng = random.Random(seed)
+    today = timezone.now().date()
+    starting = today - datetime.timedelta(days=check_in_period * (num_check_ins // 2))
+    final_check_in = starting + datetime.timedelta(days=check_in_period * num_check_ins)
+
+    contests = Contest.objects.bulk_create([
+        Contest(
+            name=f'bench-{i}',
+            starting=starting,
+            check_in_period=check_in_period,
+            final_check_in=final_check_in,
+            channel_id=str(10 ** 17 + i)
+        )
+        for i in range(num_contests)
+    ])
+
+    dates = build_check_in_schedule(starting, final_check_in, check_in_period)
+    check_ins = []
+    for contest in contests:
+        for date in dates:
+            check_ins.append(CheckIn(
+                contest=contest,
+                starting=date,
+                started_at=timezone.now() if date <= today else None,
+                thread_id=str(10 ** 18 + len(check_ins)) if date <= today else None,
+                finished=date < today
+            ))
+    check_ins = CheckIn.objects.bulk_create(check_ins, batch_size=5000)
+
+    contestants = Contestant.objects.bulk_create([
+        Contestant(contest=contest, name=f'contestant-{i}', discord_id=str(10 ** 16 + i))
+        for contest in contests
+        for i in range(contestants_per_contest)
+    ], batch_size=5000)
+
+    started = {}
+    for check_in in check_ins:
+        if check_in.started_at is not None:
+            started.setdefault(check_in.contest_id, []).append(check_in)
+
+    contestant_check_ins = []
+    for contestant in contestants:
+        weight = rng.uniform(130, 300)
+        for check_in in started.get(contestant.contest_id, []):
+            weight += rng.uniform(-3, 1.5)
+            if rng.random() < weigh_in_rate:
+                contestant_check_ins.append(ContestantCheckIn(
+                    contestant=contestant,
+                    check_in=check_in,
+                    weight=round(weight, 1),
+                    units='lbs',
+                    weight_grams=weight_in_grams(round(weight, 1), 'lbs')
+                ))
+    ContestantCheckIn.objects.bulk_create(contestant_check_ins, batch_size=5000)
+
+    # `bulk_create` skips the incremental stats updates, build them in chunks (keeps the `IN` lists short)
+    contestant_ids = [contestant.id for contestant in contestants]
+    for i in range(0, len(contestant_ids), 5000):
+        rebuild_contestant_stats(contestant_ids[i:i + 5000])
+
+    return contests
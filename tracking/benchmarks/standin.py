@@ -0,0 +1,94 @@
+import asyncio
+import itertools
+from typing import Optional
+
+_snowflakes = itertools.count(9 * 10 ** 17)
+
+
+class StandInMessage:
+    def __init__(self, content: Optional[str], file=None):
+        self.id = next(_snowflakes)
+        self.content = content
+        self.file = file
+
+
+class StandInMessageable:
+    """
+    Just enough of `discord.abc.Messageable` for the bot: every call sleeps for `latency` seconds, standing in for the
+    round-trip to Discord, and the sent messages are kept around for inspection.
+    """
+
+    def __init__(self, id: int, latency: float = 0.0):
+        self.id = id
+        self.latency = latency
+        self.sent = []
+
+    async def send(self, content: Optional[str] = None, *, file=None, **kwargs) -> StandInMessage:
+        await asyncio.sleep(self.latency)
+        message = StandInMessage(content, file)
+        self.sent.append(message)
+        return message
+
+
+class StandInThread(StandInMessageable):
+    pass
+
+
+class StandInChannel(StandInMessageable):
+    async def create_thread(self, *, name: str, **kwargs) -> StandInThread:
+        await asyncio.sleep(self.latency)
+        return StandInThread(next(_snowflakes), self.latency)
+
+
+class StandInBot:
+    """
+    Stands in for `WeighbotClient` wherever the scheduler and `logic` only need channels. Every channel is visible,
+    on the one shard, and the gateway is always ready.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.ready_shards = {0}
+        self.leased_shards = {0}
+        self.gateway_ready = asyncio.Event()
+        self.gateway_ready.set()
+        self.shard_ready_listeners = set()
+        self._channels = {}
+
+    def get_channel(self, channel_id: int) -> StandInChannel:
+        if channel_id not in self._channels:
+            self._channels[channel_id] = StandInChannel(channel_id, self.latency)
+        return self._channels[channel_id]
+
+    def owning_shard(self, channel_id: int) -> int:
+        return 0
+
+
+class StandInUser:
+    def __init__(self, id: int, name: str):
+        self.id = id
+        self.name = name
+
+
+class StandInResponse:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.deferred = False
+
+    async def defer(self, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.deferred = True
+
+    async def send_message(self, content: Optional[str] = None, **kwargs):
+        await asyncio.sleep(self.latency)
+
+
+class StandInInteraction:
+    """Just enough of `discord.Interaction` to run a slash command's checks and callback."""
+
+    def __init__(self, channel_id: int, user_id: int, user_name: str = 'bench', latency: float = 0.0):
+        self.channel_id = channel_id
+        self.user = StandInUser(user_id, user_name)
+        self.extras = {}
+        self.response = StandInResponse(latency)
+        self.followup = StandInMessageable(next(_snowflakes), latency)
@@ -0,0 +1,281 @@
+import asyncio
+import contextlib
+import dataclasses
+import datetime
+import itertools
+import math
+import random
+import time
+from typing import Dict, List, NamedTuple, Tuple
+
+import discord
+from asgiref.sync import async_to_sync, sync_to_async
+from django.utils import timezone
+
+from tracking.benchmarks.seed import seed_contests
+from tracking.benchmarks.standin import StandInBot, StandInInteraction
+from tracking.bot import client, personal_progress, weigh_in
+from tracking.constants import CHECK_IN_DURATION, Units
+from tracking.instrumentation import count_queries
+from tracking.logic import initialize_contest
+from tracking.models import Contest, CheckIn, Contestant
+from tracking.routing import routing_cache
+from tracking.scheduler import CheckInScheduler
+
+# Contests and contestants per contest for each scale, every contest runs over `NUM_CHECK_INS` weekly check-ins
+SCALES = {
+    '10': (1, 10),
+    '1k': (20, 50),
+    '50k': (500, 100),
+}
+NUM_CHECK_INS = 52
+
+
+def percentile(samples: List[float], q: float) -> float:
+    # Nearest-rank, so the result is always one of the samples
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+
+@dataclasses.dataclass
+class Result:
+    seconds: List[float] = dataclasses.field(default_factory=list)
+    queries: List[int] = dataclasses.field(default_factory=list)
+
+    def summary(self) -> dict:
+        return {
+            'iterations': len(self.seconds),
+            'p50_ms': round(percentile(self.seconds, 50) * 1000, 2),
+            'p95_ms': round(percentile(self.seconds, 95) * 1000, 2),
+            'queries': max(self.queries),
+        }
+
+
+@contextlib.contextmanager
+def measure(result: Result):
+    with count_queries() as queries:
+        start = time.perf_counter()
+        yield
+        result.seconds.append(time.perf_counter() - start)
+    result.queries.append(queries.count)
+
+
+async def invoke(command: discord.app_commands.Command, interaction: StandInInteraction, **params):
+    """
+    Runs a slash command the way the command tree does: the tree-wide check, the command's own checks, then the
+    callback.
+    """
+    if not await client.tree.interaction_check(interaction):
+        return
+    for check in command.checks:
+        if not await discord.utils.maybe_coroutine(check, interaction):
+            return
+    await command.callback(interaction, **params)
+
+
+class Target(NamedTuple):
+    contestant_id: int
+    user_id: int
+    channel_id: int
+    thread_id: int
+    weighed_in: bool
+
+
+def load_targets(contests: List[Contest]) -> List[Target]:
+    """Every contestant of `contests`, with the contest's channel and the thread of its running check-in."""
+    threads = dict(
+        CheckIn.objects.filter(contest__in=contests, finished=False, thread_id__isnull=False)
+        .values_list('contest_id', 'thread_id')
+    )
+    contestants = Contestant.objects.filter(contest__in=contests).values_list(
+        'id', 'discord_id', 'contest_id', 'contest__channel_id', 'stats__id'
+    )
+    return [
+        Target(contestant_id, int(discord_id), int(channel_id), int(threads[contest_id]), stats_id is not None)
+        for contestant_id, discord_id, contest_id, channel_id, stats_id in contestants
+    ]
+
+
+def make_due(contest_ids: List[int]):
+    """
+    Backdates the running check-ins of the contests so they're due to close, and brings their next check-in forward
+    to today (or adds one) so it's due to open right after.
+    """
+    CheckIn.objects.filter(contest_id__in=contest_ids, finished=False, thread_id__isnull=False).update(
+        started_at=timezone.now() - CHECK_IN_DURATION
+    )
+    today = timezone.now().date()
+    upcoming = {}
+    for check_in_id, contest_id in CheckIn.objects.filter(
+        contest_id__in=contest_ids, finished=False, thread_id__isnull=True
+    ).order_by('starting').values_list('id', 'contest_id'):
+        upcoming.setdefault(contest_id, check_in_id)
+    CheckIn.objects.filter(id__in=upcoming.values()).update(starting=today)
+    # Contests stepped more often than they have check-ins left get extra ones, so every tick has work to do
+    CheckIn.objects.bulk_create([
+        CheckIn(contest_id=contest_id, starting=today) for contest_id in contest_ids if contest_id not in upcoming
+    ])
+
+
+def create_contest(i: int) -> Contest:
+    # Starts in the future, so the scheduler leaves it alone
+    starting = timezone.now().date() + datetime.timedelta(days=7)
+    return Contest.objects.create(
+        name=f'bench-new-{i}',
+        starting=starting,
+        check_in_period=7,
+        final_check_in=starting + datetime.timedelta(days=7 * NUM_CHECK_INS),
+        channel_id=str(2 * 10 ** 17 + i)
+    )
+
+
+async def _run(
+        targets: List[Target],
+        contest_ids: List[int],
+        *,
+        iterations: int,
+        batch: int,
+        burst: int,
+        latency: float,
+        rng: random.Random
+) -> Dict[str, Result]:
+    results = {name: Result() for name in (
+        'weigh_in', 'weigh_in_burst', 'personal_progress', 'scheduler_close', 'scheduler_open', 'scheduler_resync',
+        'initialize_contest'
+    )}
+
+    async def weigh(target: Target):
+        interaction = StandInInteraction(target.thread_id, target.user_id, latency=latency)
+        await invoke(weigh_in, interaction, weight=round(rng.uniform(130, 300), 1), units=Units.lbs, image=None)
+        reply = interaction.followup.sent[-1].content
+        if not reply.startswith(interaction.user.name):
+            raise RuntimeError(f'weigh_in failed: {reply}')
+
+    async def report(target: Target):
+        # Always render, the cache would otherwise answer most of the iterations
+        await client.chart_cache.invalidate(target.contestant_id)
+        interaction = StandInInteraction(target.channel_id, target.user_id, latency=latency)
+        await invoke(personal_progress, interaction)
+        if interaction.followup.sent[-1].file is None:
+            raise RuntimeError(f'personal_progress failed: {interaction.followup.sent[-1].content}')
+
+    # Warm up the routing cache and the chart workers, the first calls would otherwise dominate the p95
+    client.charts.start()
+    await weigh(targets[0])
+    await report(targets[0])
+
+    for _ in range(iterations):
+        target = rng.choice(targets)
+        with measure(results['weigh_in']):
+            await weigh(target)
+
+    # Everyone weighing in at once, like when a check-in opens
+    for _ in range(iterations):
+        burst_targets = rng.sample(targets, min(burst, len(targets)))
+        with measure(results['weigh_in_burst']):
+            await asyncio.gather(*(weigh(target) for target in burst_targets))
+
+    reportable = [target for target in targets if target.weighed_in] or targets[:1]
+    for _ in range(iterations):
+        target = rng.choice(reportable)
+        with measure(results['personal_progress']):
+            await report(target)
+
+    scheduler = CheckInScheduler(StandInBot(latency))
+    await scheduler.rebuild()
+    contests = itertools.cycle(contest_ids)
+    for _ in range(iterations):
+        due = [next(contests) for _ in range(min(batch, len(contest_ids)))]
+        await sync_to_async(make_due, thread_sensitive=True)(due)
+        for contest_id in due:
+            scheduler.schedule(contest_id)
+        with measure(results['scheduler_close']):
+            await scheduler.tick()
+        with measure(results['scheduler_open']):
+            await scheduler.tick()
+
+    for _ in range(iterations):
+        scheduler.resync()
+        with measure(results['scheduler_resync']):
+            await scheduler.tick()
+
+    for i in range(iterations):
+        contest = await sync_to_async(create_contest, thread_sensitive=True)(i)
+        with measure(results['initialize_contest']):
+            await initialize_contest(contest)
+
+    return results
+
+
+def run_benchmarks(
+        contests: List[Contest],
+        *,
+        iterations: int = 50,
+        batch: int = 10,
+        burst: int = 100,
+        latency: float = 0.0,
+        seed: int = 0
+) -> Dict[str, dict]:
+    """
+    Times the bot's hot paths end to end over already seeded `contests`, against a stand-in Discord that answers
+    every call after `latency` seconds:
+
+    - `weigh_in` and `personal_progress`: the slash commands, checks included, for random contestants. Charts are
+      rendered by the real chart workers, with the cache invalidated before every call.
+    - `weigh_in_burst`: `burst` different contestants weighing in at once.
+    - `scheduler_close`/`scheduler_open`: a tick closing, then one opening, the check-ins of `batch` contests.
+    - `scheduler_resync`: a tick rebuilding the schedule from the DB.
+    - `initialize_contest`: creating the check-ins of a new contest.
+
+    Returns p50/p95 in milliseconds and the most DB round-trips a single iteration made, per benchmark.
+    """
+    routing_cache.clear()
+    targets = load_targets(contests)
+    try:
+        results = async_to_sync(_run)(
+            targets,
+            [contest.id for contest in contests],
+            iterations=iterations,
+            batch=batch,
+            burst=burst,
+            latency=latency,
+            rng=random.Random(seed)
+        )
+    finally:
+        client.charts.stop()
+        routing_cache.clear()
+    return {name: result.summary() for name, result in results.items()}
+
+
+def run_scale(scale: str, **options) -> Dict[str, dict]:
+    num_contests, contestants_per_contest = SCALES[scale]
+    contests = seed_contests(num_contests, contestants_per_contest, NUM_CHECK_INS)
+    return run_benchmarks(contests, **options)
+
+
+def compare(
+        results: Dict[str, Dict[str, dict]],
+        baseline: Dict[str, Dict[str, dict]],
+        tolerance: float
+) -> Tuple[List[str], List[str]]:
+    """
+    Compares `results` against `baseline` (both keyed by scale, then benchmark). Returns the regressions, i.e. any
+    extra query, and separately the benchmarks whose p95 got more than `tolerance` (a fraction) slower. Timings depend
+    on the machine the baseline was recorded on, so those are only worth a warning.
+    """
+    regressions = []
+    slowdowns = []
+    for scale, benchmarks in results.items():
+        for name, summary in benchmarks.items():
+            expected = baseline.get(scale, {}).get(name)
+            if expected is None:
+                continue
+            if summary['queries'] > expected['queries']:
+                regressions.append(
+                    f'{scale}/{name}: {summary["queries"]} queries, baseline {expected["queries"]}'
+                )
+            if summary['p95_ms'] > expected['p95_ms'] * (1 + tolerance):
+                slowdowns.append(
+                    f'{scale}/{name}: p95 {summary["p95_ms"]}ms, baseline {expected["p95_ms"]}ms'
+                )
+    return regressions, slowdowns
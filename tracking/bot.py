@@ -1,29 +1,180 @@
+import asyncio
+import functools
+import hashlib
+import io
+import json
 import logging
+import time
 from typing import Optional
 
 import discord
 from discord import app_commands
 from asgiref.sync import sync_to_async
-from tracking.analysis import generate_personal_progress_report
 
-from tracking.constants import Units
-from tracking.errors import ChannelNotFound, ContestantNotFound, NoContestRunning, ContestantAlreadyJoined
-from tracking.logic import log_weight, join_contestant_to_contest
+from tracking.constants import MAX_WEIGHT, MIN_WEIGHT, Units
+from tracking.db import prepare_connections
+from tracking.charts import ChartCache, ChartRenderer
+from tracking.errors import (
+    ChannelNotFound, ContestantNotFound, NoContestRunning, ContestantAlreadyJoined, ChartRendererBusy,
+    ChartRenderTimeout, InvalidWeight
+)
+from tracking.logic import (
+    log_weight, join_contestant_to_contest, get_contestant_data_version, get_command_tree_hash, save_command_tree_hash
+)
+from tracking.reports import get_personal_progress_data, get_contest_progress_data, get_contest_leaderboard
 from tracking.checks import origin_is_active_check_in
+from tracking.metrics import (
+    COMMAND_DB_QUERIES, COMMAND_DB_SECONDS, COMMAND_ERRORS, COMMAND_SECONDS, DISCORD_REQUEST_SECONDS, measure
+)
+from tracking.models import Contest, Contestant
+from tracking.startup import startup_timer
+from tracking.uploads import PhotoUpload, PhotoUploadQueue
 
 logger = logging.getLogger(__name__)
 
 
-class WeighbotClient(discord.Client):
+def instrument_command(func, name: str):
+    @functools.wraps(func)
+    async def callback(interaction: discord.Interaction, *args, **kwargs):
+        # discord.py runs every interaction in its own task, name it so profiles and lag reports say which command it is
+        task = asyncio.current_task()
+        if task is not None:
+            task.set_name(f'command:{name}')
+        try:
+            with measure(COMMAND_SECONDS, COMMAND_DB_QUERIES, COMMAND_DB_SECONDS, command=name):
+                return await func(interaction, *args, **kwargs)
+        except Exception:
+            COMMAND_ERRORS.inc(command=name)
+            raise
+    return callback
+
+
+def instrument_http(http: discord.http.HTTPClient):
+    # Every REST call the client makes goes through `request`, labelled by the route's template (not the filled in
+    # URL) to keep the number of series bounded
+    request = http.request
+
+    async def timed_request(route: discord.http.Route, **kwargs):
+        status = 'error'
+        start = time.perf_counter()
+        try:
+            response = await request(route, **kwargs)
+            status = 'ok'
+            return response
+        except discord.HTTPException as e:
+            status = str(e.status)
+            raise
+        finally:
+            DISCORD_REQUEST_SECONDS.observe(
+                time.perf_counter() - start, method=route.method, route=route.path, status=status
+            )
+
+    http.request = timed_request
+
+
+class WeighbotCommandTree(discord.app_commands.CommandTree):
+    def command(self, **kwargs):
+        # Every command handler is timed, along with its DB round-trips (see `tracking.metrics`)
+        register = super().command(**kwargs)
+        return lambda func: register(instrument_command(func, kwargs.get('name', func.__name__)))
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        # Runs before every command; the bot has no request cycle to recycle its DB connection for us
+        await prepare_connections()
+        return True
+
+
+def command_tree_hash(tree: discord.app_commands.CommandTree) -> str:
+    # The same payloads `CommandTree.sync` uploads, so any change Discord would see changes the hash
+    payload = sorted((command.to_dict() for command in tree.get_commands()), key=lambda command: command['name'])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+class WeighbotClient(discord.AutoShardedClient):
     def __init__(self, *, intents, **options):
         super(WeighbotClient, self).__init__(intents=intents, **options)
-        self.tree = discord.app_commands.CommandTree(self)
+        instrument_http(self.http)
+        self.tree = WeighbotCommandTree(self)
+        self.photo_uploads = PhotoUploadQueue(self)
+        self.charts = ChartRenderer()
+        self.chart_cache = ChartCache()
+        # Shards of this process that are connected with their guilds (and so channels) cached. `gateway_ready` is set
+        # while any of them is, anything that needs `get_channel` (i.e. the check-in scheduler) should wait on it
+        # rather than assume the client is up, then check `owning_shard` for the channels it touches.
+        self.ready_shards = set()
+        self.gateway_ready = asyncio.Event()
+        # Called whenever a shard (re)connects, e.g. to pick up the check-ins of its channels right away
+        self.shard_ready_listeners = set()
+        # Shards this process holds the check-in scheduler lease of (see `run_bot`), only their channels are scheduled
+        self.leased_shards = set()
+        self._started = False
+        # Set by `run_bot --sync-commands` to upload the command tree even if it looks unchanged
+        self.force_command_sync = False
 
     async def setup_hook(self):
+        startup_timer.mark('login')
+        self.photo_uploads.start()
+        self.charts.start()
+        await self.sync_commands()
+        startup_timer.mark('tree sync')
+
+    async def sync_commands(self):
+        # Commands are global, so when sharded across processes only the one with shard 0 uploads them
+        if self.shard_ids and 0 not in self.shard_ids:
+            return
+
+        # Syncing is a global, rate limited upload that can take seconds, so only do it when the commands changed
+        tree_hash = command_tree_hash(self.tree)
+        if not self.force_command_sync and await get_command_tree_hash(self.application_id) == tree_hash:
+            logger.info('Command tree unchanged (%s), skipping sync', tree_hash[:12])
+            return
+
         await self.tree.sync()
+        await save_command_tree_hash(self.application_id, tree_hash)
+        logger.info('Synced command tree (%s)', tree_hash[:12])
+
+    def owning_shard(self, channel_id: int) -> Optional[int]:
+        """
+        The shard of this process the channel's guild belongs to. None if the channel isn't cached, i.e. another process
+        (or nobody) owns it.
+        """
+        channel = self.get_channel(int(channel_id))
+        guild = getattr(channel, 'guild', None)
+        return None if guild is None else guild.shard_id
 
     async def on_ready(self):
+        # Only dispatched once every shard of the process is up for the first time, readiness is tracked per shard
         logger.info('Bot is ready')
+        if not self._started:
+            self._started = True
+            startup_timer.mark('gateway ready')
+            logger.info('Startup took %s', startup_timer.summary())
+
+    def _shard_up(self, shard_id: int):
+        self.ready_shards.add(shard_id)
+        self.gateway_ready.set()
+        for listener in list(self.shard_ready_listeners):
+            listener()
+
+    async def on_shard_ready(self, shard_id: int):
+        logger.info('Shard %s is ready', shard_id)
+        self._shard_up(shard_id)
+
+    async def on_shard_resumed(self, shard_id: int):
+        logger.info('Shard %s resumed its gateway session', shard_id)
+        self._shard_up(shard_id)
+
+    async def on_shard_disconnect(self, shard_id: int):
+        if shard_id in self.ready_shards:
+            logger.warning('Shard %s disconnected, pausing its check-ins until it reconnects', shard_id)
+        self.ready_shards.discard(shard_id)
+        if not self.ready_shards:
+            self.gateway_ready.clear()
+
+
+def format_percent_change(percent_change: Optional[float]) -> str:
+    # None for contestants who started at 0, see `get_contest_leaderboard`
+    return 'n/a' if percent_change is None else f'{percent_change:+.1f}%'
 
 
 intents = discord.Intents.default()
@@ -66,18 +217,34 @@ async def join_contest(interaction: discord.Interaction):
 @app_commands.check(origin_is_active_check_in)
 async def weigh_in(
     interaction: discord.Interaction,
-    weight: float,
+    weight: app_commands.Range[float, MIN_WEIGHT, MAX_WEIGHT],
     units: Units = Units.lbs,
     image: Optional[discord.Attachment] = None
 ):
+    # Acknowledge right away, everything after this can take as long as it needs
+    await interaction.response.defer(thinking=True)
+
     try:
-        overall, latest = await log_weight(interaction.channel_id, interaction.user.id, weight, units.value, image)
+        contestant_check_in, overall, latest = await log_weight(
+            interaction.channel_id, interaction.user.id, weight, units.value, interaction.extras.get('active_check_in')
+        )
     except ChannelNotFound:
-        await interaction.response.send_message('There is no check-in currently running in this channel or thread.')
+        await interaction.followup.send('There is no check-in currently running in this channel or thread.')
         return
     except ContestantNotFound:
-        await interaction.response.send_message('You are not enrolled in a contest currently.')
+        await interaction.followup.send('You are not enrolled in a contest currently.')
         return
+    except InvalidWeight:
+        await interaction.followup.send(f'Your weight should be between {MIN_WEIGHT} and {MAX_WEIGHT}.')
+        return
+    except Exception:
+        # Already deferred, so the user would otherwise be left with "thinking..." forever
+        logger.exception('Error logging weight')
+        await interaction.followup.send('Sorry, your weigh-in could not be saved, please try again!')
+        return
+
+    # Any charts rendered before this weigh-in are out of date now
+    await client.chart_cache.invalidate(contestant_check_in.contestant_id)
 
     user_name = interaction.user.name
     if overall and latest:
@@ -86,35 +253,86 @@ async def weigh_in(
         overall_str = f'{since_start_comparison} {abs(overall):.1f}lbs overall'
         latest_str = f'{since_last_comparison} {abs(latest):.1f}lbs since the last check-in'
         message = f'{user_name}, you are {overall_str} and {latest_str}.'
-        await interaction.response.send_message(message)
     else:
-        await interaction.response.send_message(f'{user_name}, your starting weight is {weight}')
+        message = f'{user_name}, your starting weight is {weight}'
 
+    if image is not None:
+        queued = client.photo_uploads.submit(PhotoUpload(
+            contestant_check_in=contestant_check_in,
+            attachment=image,
+            thread_id=interaction.channel_id,
+            user_id=interaction.user.id
+        ))
+        if not queued:
+            message = f'{message} Your photo could not be saved right now, please try again later.'
 
-# TODO: Make the below stubs functional once the analytics functions are ready
+    await interaction.followup.send(message)
 
 
 @client.tree.command(
-    description='Non-functional at the moment.'
+    description='Functional only in channels where you have joined a contest. Graphs your progress.'
 )
 async def personal_progress(
     interaction: discord.Interaction,
 ):
+    await interaction.response.defer(thinking=True)
+
     user_id = interaction.user.id
     channel_id = interaction.channel_id
     try:
-        image = await sync_to_async(generate_personal_progress_report, thread_sensitive=True)(user_id, channel_id)
-        image_file = discord.File(image, 'personal_progress.png')
-        await interaction.response.send_message('Your current progress!', file=image_file)
+        contestant_id, version = await get_contestant_data_version(channel_id, user_id)
+        cache_key = client.chart_cache.key('personal_progress', contestant_id, version)
+        image = await client.chart_cache.get(cache_key)
+        if image is None:
+            name, columns = await sync_to_async(get_personal_progress_data, thread_sensitive=True)(
+                user_id, channel_id
+            )
+            if not columns['weigh_in']:
+                await interaction.followup.send("You haven't weighed in yet!")
+                return
+            image = await client.charts.render('tracking.analysis.render_personal_progress_report', name, columns)
+            await client.chart_cache.put(cache_key, image)
+        image_file = discord.File(io.BytesIO(image), 'personal_progress.png')
+        await interaction.followup.send('Your current progress!', file=image_file)
+    except (ContestantNotFound, Contestant.DoesNotExist):
+        await interaction.followup.send('You are not enrolled in a contest in this channel.')
+    except (ChartRendererBusy, ChartRenderTimeout):
+        await interaction.followup.send('The graph machine is busy right now, please try again in a minute!')
     except Exception:
         logger.exception('Error during personal-progress generation')
-        await interaction.response.send_message('Sorry, there was an issue generating your graph!')
+        await interaction.followup.send('Sorry, there was an issue generating your graph!')
 
 
 @client.tree.command(
-    description='Non-functional at the moment.'
+    description='Functional only in channels where there is an active contest. Shows the contest standings.'
 )
 async def contest_progress(
     interaction: discord.Interaction,
 ):
-    await interaction.response.send_message('The current contest progress!')
+    await interaction.response.defer(thinking=True)
+
+    try:
+        contest_name, columns = await sync_to_async(get_contest_progress_data, thread_sensitive=True)(
+            interaction.channel_id
+        )
+        if not columns['contestant_id']:
+            await interaction.followup.send('Nobody has weighed in yet!')
+            return
+        image, _ = await client.charts.render(
+            'tracking.analysis.render_contest_progress_report', contest_name, columns
+        )
+        # Ranked from the contestants' stats rather than the chart data, so it's one small query
+        leaderboard = await sync_to_async(get_contest_leaderboard, thread_sensitive=True)(interaction.channel_id)
+        lines = [
+            f'{row["rank"]}. {row["name"]}: {format_percent_change(row["percent_change"])} ({row["change"]:+.1f}lbs)'
+            for row in leaderboard
+        ]
+        image_file = discord.File(io.BytesIO(image), 'contest_progress.png')
+        await interaction.followup.send('The current contest progress!\n' + '\n'.join(lines), file=image_file)
+    except Contest.DoesNotExist:
+        await interaction.followup.send('There is no contest running in this channel.')
+    except (ChartRendererBusy, ChartRenderTimeout):
+        await interaction.followup.send('The graph machine is busy right now, please try again in a minute!')
+    except Exception:
+        logger.exception('Error during contest-progress generation')
+        await interaction.followup.send('Sorry, there was an issue generating the contest graph!')
@@ -0,0 +1,228 @@
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import logging
+import multiprocessing
+import time
+from pathlib import Path
+from typing import Optional
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from tracking.errors import ChartRendererBusy, ChartRenderTimeout
+from tracking.metrics import CHART_RENDER_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def _warm_up_worker():
+    # Runs once per worker process, so every render after the first skips the (slow) analysis stack imports
+    import django
+    django.setup()
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot
+    import pandas
+    import seaborn
+    import tracking.analysis
+
+
+def _ping():
+    return True
+
+
+def _call(path: str, *args):
+    return import_string(path)(*args)
+
+
+def _release_soon(loop: asyncio.AbstractEventLoop, slots: asyncio.Semaphore):
+    # Future callbacks run in the pool's management thread
+    try:
+        loop.call_soon_threadsafe(slots.release)
+    except RuntimeError:
+        # The loop is closed, and the slots with it
+        pass
+
+
+class ChartRenderer:
+    """
+    Renders charts in a dedicated process pool, keeping matplotlib off the bot's event loop and away from the
+    thread-sensitive executor every ORM call goes through.
+
+    At most `max_workers` charts render at once and at most `max_pending` wait behind them, anything past that is
+    rejected with `ChartRendererBusy`. Renders that take longer than `timeout` seconds raise `ChartRenderTimeout`, but
+    a worker can't be interrupted, so they keep their slot until they actually finish.
+    """
+
+    def __init__(self, *, max_workers: int = None, max_pending: int = None, timeout: float = None):
+        self.max_workers = max_workers or settings.CHART_RENDER_WORKERS
+        self.max_pending = settings.CHART_RENDER_QUEUE_SIZE if max_pending is None else max_pending
+        self.timeout = timeout or settings.CHART_RENDER_TIMEOUT
+        self._pool = None
+        self._slots = None
+        self._waiting = 0
+
+    def start(self):
+        if self._pool is not None:
+            return
+        # Spawned rather than forked, forking the bot's process would copy its event loop and executor threads
+        self._pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_warm_up_worker
+        )
+        self._slots = asyncio.Semaphore(self.max_workers)
+        # Get a worker spun up and warm before the first chart is requested
+        self._pool.submit(_ping)
+
+    def stop(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def render(self, path: str, *args) -> bytes:
+        """
+        Calls the function at the dotted `path` in a worker. Functions are passed by name so the caller never has to
+        import the analysis stack itself.
+        """
+        self.start()
+        if self._slots.locked() and self._waiting >= self.max_pending:
+            raise ChartRendererBusy('Too many charts are being rendered')
+
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+
+        status = 'error'
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            future = self._pool.submit(_call, path, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # Released once the worker is done rather than when we stop waiting, otherwise renders would queue up in the
+        # pool behind a timed out one with nothing limiting them
+        slots = self._slots
+        future.add_done_callback(lambda _: _release_soon(loop, slots))
+        try:
+            image = await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+            status = 'ok'
+            return image
+        except asyncio.TimeoutError:
+            status = 'timeout'
+            logger.warning('Chart render %s timed out after %ss', path, self.timeout)
+            raise ChartRenderTimeout(f'Rendering took longer than {self.timeout}s')
+        finally:
+            CHART_RENDER_SECONDS.observe(time.perf_counter() - start, chart=path.rsplit('.', 1)[-1], status=status)
+
+
+class ChartCache:
+    """
+    LRU cache of rendered chart bytes, capped at `max_bytes` in memory. When `directory` is set, charts are also
+    written there as a second tier that survives restarts, pruned oldest-first past `max_disk_bytes`.
+
+    Keys embed the contestant's data version (see `logic.get_contestant_data_version`), so stale charts are never
+    served. `invalidate` just frees the space early once a contestant logs something new.
+
+    The disk tier is only ever touched from a worker thread, pruning a large directory would otherwise block the loop.
+    """
+
+    def __init__(self, *, max_bytes: int = None, directory: str = None, max_disk_bytes: int = None):
+        self.max_bytes = settings.CHART_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        directory = directory or settings.CHART_CACHE_DIR
+        self.directory = Path(directory) if directory else None
+        self.max_disk_bytes = max_disk_bytes or settings.CHART_CACHE_DISK_MAX_BYTES
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._pruning = False
+
+    @staticmethod
+    def key(kind: str, contestant_id: int, version, *params) -> str:
+        digest = hashlib.sha1(repr((kind, version, params)).encode()).hexdigest()
+        return f'{contestant_id}-{digest}'
+
+    async def get(self, key: str) -> Optional[bytes]:
+        data = self._entries.get(key)
+        if data is not None:
+            self._entries.move_to_end(key)
+            return data
+
+        if self.directory is None:
+            return None
+        try:
+            data = await asyncio.to_thread((self.directory / f'{key}.png').read_bytes)
+        except OSError:
+            return None
+        self._put_memory(key, data)
+        return data
+
+    async def put(self, key: str, data: bytes):
+        self._put_memory(key, data)
+        if self.directory is None:
+            return
+        try:
+            await asyncio.to_thread(self._write_disk, key, data)
+        except OSError:
+            logger.exception('Failed writing chart %s to the disk cache', key)
+            return
+
+        # One prune at a time, a burst of renders would otherwise each scan the whole directory. Anything written
+        # meanwhile is caught by the next one.
+        if self._pruning:
+            return
+        self._pruning = True
+        try:
+            await asyncio.to_thread(self._prune_disk)
+        except OSError:
+            logger.exception('Failed pruning the chart disk cache')
+        finally:
+            self._pruning = False
+
+    async def invalidate(self, contestant_id: int):
+        prefix = f'{contestant_id}-'
+        for key in [key for key in self._entries if key.startswith(prefix)]:
+            self._size -= len(self._entries.pop(key))
+        if self.directory is not None:
+            await asyncio.to_thread(self._invalidate_disk, prefix)
+
+    def _put_memory(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._size -= len(self._entries.pop(key))
+        self._entries[key] = data
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _write_disk(self, key: str, data: bytes):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        (self.directory / f'{key}.png').write_bytes(data)
+
+    def _invalidate_disk(self, prefix: str):
+        for path in self.directory.glob(f'{prefix}*.png'):
+            path.unlink(missing_ok=True)
+
+    def _prune_disk(self):
+        files = []
+        for path in self.directory.glob('*.png'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # Invalidated since the glob
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        files.sort(key=lambda file: file[0])
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            total -= size
+            path.unlink(missing_ok=True)
@@ -1,11 +1,13 @@
 import discord
 
-from tracking.models import CheckIn
+from tracking.routing import routing_cache
 
 
 async def origin_is_active_check_in(interaction: discord.Interaction):
-    check_in_active = await CheckIn.objects.filter(thread_id=interaction.channel_id, finished=False).aexists()
-    if check_in_active:
+    active_check_in = await routing_cache.get_active_check_in(interaction.channel_id)
+    if active_check_in is not None:
+        # Handed over to the command, so it doesn't have to look the check-in up again
+        interaction.extras['active_check_in'] = active_check_in
         return True
     await interaction.response.send_message(
         'Use an active check-in thread to share your weigh-in',
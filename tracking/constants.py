@@ -1,6 +1,33 @@
+import datetime
 from enum import Enum
 
 
+# How long a check-in thread stays open once it has been started
+CHECK_IN_DURATION = datetime.timedelta(days=1)
+
+KG_TO_LBS = 2.205
+
+# Weights are stored canonically as whole grams (`ContestantCheckIn.weight_grams`). A pound is defined through
+# KG_TO_LBS so converted weights agree with what the bot has always reported.
+GRAMS_PER_KG = 1000
+GRAMS_PER_LB = GRAMS_PER_KG / KG_TO_LBS
+
+
+# Weights accepted from a weigh-in, in whichever units it's in. The canonical grams can't be negative.
+MIN_WEIGHT = 1
+MAX_WEIGHT = 2000
+
+
 class Units(Enum):
     lbs = 'lbs'
     kg = 'kg'
+
+
+def weight_in_grams(weight: float, units: str) -> int:
+    if units == Units.kg.value:
+        return round(weight * GRAMS_PER_KG)
+    return round(weight * GRAMS_PER_LB)
+
+
+def grams_in_lbs(grams: int) -> float:
+    return grams / GRAMS_PER_LB
@@ -0,0 +1,95 @@
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionMetrics:
+    """
+    Connection stats for the bot process. All ORM calls go through the single thread-sensitive executor, so the bot
+    uses exactly one connection per database and the "pool" is that executor thread; the wait stats are how long a
+    unit of work queued for it before it could touch the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.connect_seconds = 0.0
+        self.stale_closes = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def observe_connect(self, seconds: float):
+        with self._lock:
+            self.connects += 1
+            self.connect_seconds += seconds
+
+    def observe_wait(self, seconds: float):
+        with self._lock:
+            self.waits += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'pool_size': 1,
+                'connects': self.connects,
+                'connect_seconds': self.connect_seconds,
+                'stale_closes': self.stale_closes,
+                'waits': self.waits,
+                'wait_seconds': self.wait_seconds,
+                'max_wait_seconds': self.max_wait_seconds,
+            }
+
+
+db_metrics = ConnectionMetrics()
+
+_last_used = {}
+
+
+def _prepare_connections(submitted_at: float):
+    started = time.monotonic()
+    db_metrics.observe_wait(started - submitted_at)
+
+    for connection in connections.all(initialized_only=True):
+        if connection.in_atomic_block:
+            # Never recycle a connection out from under an open transaction
+            continue
+        was_open = connection.connection is not None
+        # Same as Django does at the start of every request: drop connections that broke or are past CONN_MAX_AGE
+        connection.close_if_unusable_or_obsolete()
+        if was_open and connection.connection is None:
+            with db_metrics._lock:
+                db_metrics.stale_closes += 1
+
+        # That also re-arms the CONN_HEALTH_CHECKS ping for the next query. Only pay for it after an idle gap, which
+        # is when the server or a proxy may have dropped the connection on us. `health_check_done` is private to
+        # Django, checked against 4.1 (BaseDatabaseWrapper.close_if_health_check_failed), and pinned by
+        # PrepareConnectionsTestCase, re-check it when upgrading Django.
+        idle = started - _last_used.get(connection.alias, started)
+        if connection.connection is not None and idle < settings.DB_IDLE_HEALTH_CHECK_SECONDS:
+            connection.health_check_done = True
+
+    connection = connections['default']
+    if connection.connection is None:
+        connect_started = time.monotonic()
+        connection.ensure_connection()
+        db_metrics.observe_connect(time.monotonic() - connect_started)
+
+    for alias in connections:
+        _last_used[alias] = time.monotonic()
+
+
+async def prepare_connections():
+    """
+    Call at the start of each unit of work in the bot (an interaction, a scheduler tick, a photo upload). The bot has
+    no request cycle, so without this its connection is never recycled and goes stale between check-ins.
+    """
+    await sync_to_async(_prepare_connections, thread_sensitive=True)(time.monotonic())
@@ -17,3 +17,15 @@ class ContestantNotFound(AyWeighException):
 
 class ContestantAlreadyJoined(AyWeighException):
     pass
+
+
+class InvalidWeight(AyWeighException):
+    pass
+
+
+class ChartRendererBusy(AyWeighException):
+    pass
+
+
+class ChartRenderTimeout(AyWeighException):
+    pass
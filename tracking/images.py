@@ -0,0 +1,66 @@
+import asyncio
+import concurrent.futures
+import io
+import multiprocessing
+from typing import List, NamedTuple
+
+# Longest edge, in pixels, of each variant generated for a check-in photo
+VARIANT_SIZES = {
+    'thumbnail': 256,
+    'display': 1280,
+}
+
+_pool = None
+
+
+class RenderedVariant(NamedTuple):
+    kind: str
+    format: str
+    data: bytes
+    width: int
+    height: int
+
+
+def render_variants(path: str, image_format: str = 'webp', quality: int = 80) -> List[RenderedVariant]:
+    """
+    Generates the resized variants of a photo. Re-encoding drops all EXIF data (including location), after the
+    EXIF orientation has been applied to the pixels.
+
+    This is CPU heavy and is meant to run in the image process pool, see `render_variants_async`. Pillow is imported
+    here so the bot process itself never loads it.
+    """
+    from PIL import Image, ImageOps, features
+
+    if image_format == 'webp' and not features.check('webp'):
+        image_format = 'jpeg'
+
+    largest = max(VARIANT_SIZES.values())
+    variants = []
+    with Image.open(path) as original:
+        # Lets JPEG decode at a reduced scale rather than decoding the full-resolution image first
+        original.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(original).convert('RGB')
+
+    for kind, size in VARIANT_SIZES.items():
+        variant = image.copy()
+        variant.thumbnail((size, size), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        variant.save(buffer, format=image_format, quality=quality, optimize=True)
+        variants.append(RenderedVariant(kind, image_format, buffer.getvalue(), variant.width, variant.height))
+    return variants
+
+
+def get_image_pool(max_workers: int) -> concurrent.futures.ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Spawned rather than forked, forking the bot's process would copy its event loop and executor threads
+        _pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _pool
+
+
+async def render_variants_async(path: str, image_format: str, max_workers: int) -> List[RenderedVariant]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_image_pool(max_workers), render_variants, path, image_format)
@@ -0,0 +1,68 @@
+import contextlib
+import contextvars
+import time
+from typing import Iterable, Optional
+
+_query_counter = contextvars.ContextVar('query_counter', default=None)
+
+
+class QueryCounter:
+    def __init__(self, parent: 'QueryCounter' = None):
+        self.count = 0
+        self.seconds = 0.0
+        self.parent = parent
+
+
+def _count_query(execute, sql, params, many, context):
+    counter = _query_counter.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        # Nested counters (e.g. a command's metrics within a benchmark iteration) all see the query
+        while counter is not None:
+            counter.count += 1
+            counter.seconds += elapsed
+            counter = counter.parent
+
+
+def install_query_counter(sender, connection, **kwargs):
+    # Hooked up to `connection_created` so every connection (including the ones living in the sync_to_async
+    # executor threads) reports to whichever counter is active in the calling context.
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+@contextlib.contextmanager
+def count_queries():
+    """
+    Counts the DB round-trips made within the block and the time spent in them, including ORM calls that hop to a sync
+    thread through `sync_to_async` (asgiref copies the context over, so the counter follows the call).
+    """
+    counter = QueryCounter(_query_counter.get())
+    token = _query_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _query_counter.reset(token)
+
+
+def current_query_counter() -> Optional[QueryCounter]:
+    return _query_counter.get()
+
+
+def attribute_queries(counters: Iterable[Optional[QueryCounter]], count: int, seconds: float):
+    """
+    Adds round-trips made on behalf of several blocks at once (e.g. one write batching their work, see
+    `tracking.weighins`) to each of their counters. Counters they're nested in only count them once.
+    """
+    seen = set()
+    for counter in counters:
+        while counter is not None and id(counter) not in seen:
+            seen.add(id(counter))
+            counter.count += count
+            counter.seconds += seconds
+            counter = counter.parent
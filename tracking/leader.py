@@ -0,0 +1,112 @@
+import asyncio
+import datetime
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Awaitable, Callable
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from django.utils import timezone
+
+from tracking.db import prepare_connections
+from tracking.models import SchedulerLease
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElection:
+    """
+    Elects a single process, among all the bot processes, to run some work (i.e. the check-in scheduler).
+
+    The leader holds a lease row and renews it every `ttl / 3` seconds. If it dies, the lease runs out after `ttl`
+    and another process takes over. This is a lease rather than a Postgres advisory lock because advisory locks live
+    as long as the session, and the bot deliberately recycles its connection (see `tracking.db`).
+    """
+
+    def __init__(self, name: str, *, ttl: int, identity: str = None):
+        self.name = name
+        self.ttl = ttl
+        self.identity = identity or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+    def _acquire(self) -> bool:
+        now = timezone.now()
+        expires_at = now + datetime.timedelta(seconds=self.ttl)
+        # Renew our own lease, or take over one that ran out, in a single conditional update
+        updated = SchedulerLease.objects.filter(
+            Q(holder=self.identity) | Q(expires_at__lte=now), name=self.name
+        ).update(holder=self.identity, expires_at=expires_at)
+        if updated:
+            return True
+
+        _, created = SchedulerLease.objects.get_or_create(
+            name=self.name, defaults={'holder': self.identity, 'expires_at': expires_at}
+        )
+        return created
+
+    def _release(self):
+        SchedulerLease.objects.filter(name=self.name, holder=self.identity).update(expires_at=timezone.now())
+
+    async def acquire(self) -> bool:
+        await prepare_connections()
+        return await sync_to_async(self._acquire, thread_sensitive=True)()
+
+    async def release(self):
+        await sync_to_async(self._release, thread_sensitive=True)()
+
+    async def _hold(self, task: asyncio.Task):
+        # Keeps renewing while `task` runs. Returns once the task is done or the lease can't be kept.
+        interval = self.ttl / 3
+        renewed_at = time.monotonic()
+        while True:
+            await asyncio.wait({task}, timeout=interval)
+            if task.done():
+                return
+
+            try:
+                if not await self.acquire():
+                    logger.warning('Lost the %s lease to another process', self.name)
+                    return
+                renewed_at = time.monotonic()
+            except Exception:
+                logger.exception('Failure renewing the %s lease', self.name)
+                # Step down before the lease can run out, so two processes never both think they're the leader
+                if time.monotonic() - renewed_at + interval >= self.ttl:
+                    return
+
+    async def run(self, work: Callable[[], Awaitable]):
+        """
+        Runs `work` whenever this process is the leader, and cancels it as soon as it isn't.
+        """
+        while True:
+            try:
+                leader = await self.acquire()
+            except Exception:
+                logger.exception('Failure acquiring the %s lease', self.name)
+                leader = False
+
+            if not leader:
+                await asyncio.sleep(self.ttl / 3)
+                continue
+
+            logger.info('Acquired the %s lease as %s', self.name, self.identity)
+            task = asyncio.create_task(work(), name=self.name)
+            try:
+                await self._hold(task)
+            except BaseException:
+                task.cancel()
+                raise
+            if not task.done():
+                # Lost the lease, whoever has it now runs the work
+                task.cancel()
+                continue
+
+            # The work stopped on its own, let another process (or this one, on the next attempt) start it afresh
+            if not task.cancelled() and task.exception() is not None:
+                logger.error('%s failed, giving up the lease', self.name, exc_info=task.exception())
+            try:
+                await self.release()
+            except Exception:
+                logger.exception('Failure releasing the %s lease', self.name)
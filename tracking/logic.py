@@ -1,63 +1,98 @@
+import asyncio
 import datetime
 import logging
-from typing import Optional
+from typing import List, Optional
 
 import discord
 from discord.types import snowflake
 import django.db
 from asgiref.sync import sync_to_async
+from django.core.files import File
 from django.core.files.base import ContentFile
+from django.db.models import Count, Max
 from django.utils import timezone
 
-from tracking.constants import Units
-from tracking.errors import ChannelNotFound, ContestantNotFound, ContestantAlreadyJoined, NoContestRunning
+from tracking.constants import Units, CHECK_IN_DURATION, MAX_WEIGHT, MIN_WEIGHT, weight_in_grams
+from tracking.errors import (
+    ChannelNotFound, ContestantNotFound, ContestantAlreadyJoined, InvalidWeight, NoContestRunning
+)
 from tracking.models import *
+from tracking.routing import ActiveCheckIn, routing_cache
+from tracking.weighins import weigh_in_writer
 
 logger = logging.getLogger(__name__)
 
 
-async def initialize_contest(contest: Contest):
-    # Create all the needed check-ins
-    time_interval = datetime.timedelta(days=contest.check_in_period)
-    final_check_in = contest.final_check_in
-
-    # Contest starting date is the first check-in, then create a check-in every `time_interval` days, until
-    # the date is >= `final_check_in`
-    previous = await CheckIn.objects.acreate(
-        contest=contest,
-        starting=contest.starting
-    )
+def build_check_in_schedule(
+        starting: datetime.date,
+        final_check_in: datetime.date,
+        check_in_period: int
+) -> List[datetime.date]:
+    """
+    Dates of all the check-ins of a contest.
+
+    The contest starting date is the first check-in, then there's a check-in every `check_in_period` days until the
+    date is >= `final_check_in`. The final check-in is added on its own if it doesn't land on the period.
+    """
+    time_interval = datetime.timedelta(days=check_in_period)
+    dates = [starting]
 
-    # Create the intermediate check-ins
-    current_date = contest.starting + time_interval
+    # The intermediate check-ins
+    current_date = starting + time_interval
     while current_date < final_check_in:
-        check_in = await CheckIn.objects.acreate(
-            contest=contest,
-            starting=current_date,
-            previous=previous
-        )
-        previous = check_in
+        dates.append(current_date)
         current_date = current_date + time_interval
 
-    # Create the final check-in if the last date we were on is not the final date of the contest
+    # The final check-in, if the last date we were on is not the final date of the contest
     if current_date != final_check_in:
-        await CheckIn.objects.acreate(
-            contest=contest,
-            starting=final_check_in
-        )
+        dates.append(final_check_in)
+
+    return dates
+
+
+def create_check_ins(contest: Contest, dates: List[datetime.date]) -> List[CheckIn]:
+    # One insert for the whole schedule, then one update to chain each check-in to its predecessor
+    with django.db.transaction.atomic():
+        check_ins = CheckIn.objects.bulk_create([
+            CheckIn(contest=contest, starting=starting) for starting in dates
+        ])
+        for previous, check_in in zip(check_ins, check_ins[1:]):
+            check_in.previous = previous
+        CheckIn.objects.bulk_update(check_ins[1:], ['previous'])
+    return check_ins
+
+
+async def initialize_contest(contest: Contest):
+    # Create all the needed check-ins
+    dates = build_check_in_schedule(contest.starting, contest.final_check_in, contest.check_in_period)
+    await sync_to_async(create_check_ins, thread_sensitive=True)(contest, dates)
 
 
-async def initialize_check_in(check_in: CheckIn, bot: 'tracking.bot.WeighbotClient'):
-    channel_id = int(check_in.contest.channel_id)
-    channel: discord.TextChannel = bot.get_channel(channel_id)
+async def get_contest_channel(
+        check_in: CheckIn,
+        bot: 'tracking.bot.WeighbotClient'
+) -> Optional[discord.TextChannel]:
+    # Only ever called for channels of this process' shards (see `CheckInScheduler`), so they're in the cache
+    return bot.get_channel(int(check_in.contest.channel_id))
+
+
+async def start_check_in_thread(
+        check_in: CheckIn,
+        bot: 'tracking.bot.WeighbotClient'
+) -> Optional[discord.Thread]:
+    """
+    Announces the check-in in its contest channel and creates the thread weigh-ins are posted to. Doesn't touch the
+    DB, returns None if the thread couldn't be created.
+    """
+    channel: discord.TextChannel = await get_contest_channel(check_in, bot)
 
     # Sometimes this fails. There might be sync issues, so we'll attempt this again later.
     if channel is None:
-        return
+        return None
 
     try:
         start = await channel.send(f'Check-in {check_in.starting} is starting!')
-        thread = await channel.create_thread(
+        return await channel.create_thread(
             name=f'Check-in',
             message=start,
             type=discord.ChannelType.public_thread,
@@ -65,21 +100,81 @@ async def initialize_check_in(check_in: CheckIn, bot: 'tracking.bot.WeighbotClie
         )
     except discord.errors.DiscordException:
         logger.exception('Failure creating thread')
-        return
+        return None
+
 
-    check_in.started_at = timezone.now()
-    check_in.thread_id = thread.id
+async def post_check_in_instructions(thread: discord.Thread):
     try:
-        await sync_to_async(check_in.save, thread_sensitive=True)()
-    except django.db.Error:
-        logger.exception('Error saving check-in start, %s', check_in)
+        await thread.send(
+            'Send a message with your weight in pounds, and any images you want to share (all in the same message)'
+        )
+    except discord.errors.DiscordException:
+        logger.exception('Failure posting check-in instructions')
+
+
+async def announce_check_in_finished(check_in: CheckIn, bot: 'tracking.bot.WeighbotClient'):
+    channel = await get_contest_channel(check_in, bot)
+    if channel is None:
         return
 
-    await thread.send(
-        'Send a message with your weight in pounds, and any images you want to share (all in the same message)'
+    try:
+        await channel.send(f'💪 Check in for {check_in.starting} is over 💪')
+    except discord.errors.DiscordException:
+        logger.exception('Failure announcing check-in finish')
+
+
+async def transition_check_ins(
+        to_open: List[CheckIn],
+        to_close: List[CheckIn],
+        bot: 'tracking.bot.WeighbotClient',
+        limiter: 'tracking.ratelimit.RouteLimiter'
+):
+    """
+    Opens (creating their threads) and closes check-ins, for many contests at once.
+
+    Threads are created concurrently (within the limiter's per-channel caps), then every opened and closed check-in is
+    written in a single bulk update, and only then are the close announcements and thread instructions sent. Check-ins
+    whose thread couldn't be created are left with `started_at` unset.
+    """
+    async def start(check_in: CheckIn):
+        async with limiter.route(check_in.contest.channel_id):
+            return await start_check_in_thread(check_in, bot)
+
+    threads = await asyncio.gather(*(start(check_in) for check_in in to_open))
+
+    opened = []
+    now = timezone.now()
+    for check_in, thread in zip(to_open, threads):
+        if thread is not None:
+            check_in.started_at = now
+            check_in.thread_id = thread.id
+            opened.append((check_in, thread))
+    for check_in in to_close:
+        logger.info('Closing out check-in: %s', check_in)
+        check_in.finished = True
+
+    changed = [check_in for check_in, _ in opened] + to_close
+    if changed:
+        await sync_to_async(CheckIn.objects.bulk_update, thread_sensitive=True)(
+            changed, ['started_at', 'thread_id', 'finished']
+        )
+    for check_in, _ in opened:
+        routing_cache.check_in_opened(check_in)
+    for check_in in to_close:
+        routing_cache.check_in_closed(check_in)
+
+    async def instruct(check_in: CheckIn, thread: discord.Thread):
+        async with limiter.route(thread.id):
+            await post_check_in_instructions(thread)
+
+    async def announce(check_in: CheckIn):
+        async with limiter.route(check_in.contest.channel_id):
+            await announce_check_in_finished(check_in, bot)
+
+    await asyncio.gather(
+        *(instruct(check_in, thread) for check_in, thread in opened),
+        *(announce(check_in) for check_in in to_close),
     )
-    # Once initialized, the bot should route and handle messages using DB lookups on the thread ID.
-    # The check-in will be closed by the update polling.
 
 
 async def join_contestant_to_contest(
@@ -104,11 +199,12 @@ async def join_contestant_to_contest(
         raise NoContestRunning('There is no contest running in this channel')
 
     logger.info('Joining user: %s %s to %s', user_id, name, channel_id)
-    await Contestant.objects.acreate(
+    contestant = await Contestant.objects.acreate(
         name=name,
         discord_id=user_id,
         contest=contest
     )
+    routing_cache.contestant_joined(contestant)
 
 
 async def log_weight(
@@ -116,80 +212,119 @@ async def log_weight(
         user_id: snowflake,
         weight: float,
         units: Units,
-        attachment: Optional[discord.Attachment]
-):
-    try:
-        check_in = await CheckIn.objects.select_related('contest').aget(thread_id=channel_id)
-    except CheckIn.DoesNotExist:
+        active_check_in: Optional[ActiveCheckIn] = None
+) -> (ContestantCheckIn, float, Optional[float]):
+    # The command already limits the weight, but this is also what keeps it from failing the DB's constraints
+    if not MIN_WEIGHT <= weight <= MAX_WEIGHT:
+        raise InvalidWeight(f'Weight must be between {MIN_WEIGHT} and {MAX_WEIGHT}')
+
+    # The check-in is usually already resolved by the command check (see `origin_is_active_check_in`)
+    if active_check_in is None:
+        active_check_in = await routing_cache.get_active_check_in(channel_id)
+    if active_check_in is None:
         raise ChannelNotFound('No active check-in found for this channel')
 
+    contest_id = active_check_in.contest_id
+    contestant_id = routing_cache.get_contestant_id(user_id, contest_id)
+    if contestant_id is None:
+        contestant_id = await Contestant.objects.filter(
+            discord_id=str(user_id), contest_id=contest_id
+        ).values_list('id', flat=True).afirst()
+        if contestant_id is None:
+            raise ContestantNotFound('Current user is not a contestant')
+        routing_cache.set_contestant_id(user_id, contest_id, contestant_id)
+
+    # Not looked up again when cached, `save_weigh_ins` raises `ContestantNotFound` if it was deleted since
+    contestant_check_in = ContestantCheckIn(
+        check_in_id=active_check_in.check_in_id,
+        contestant_id=contestant_id,
+        weight=weight,
+        units=units,
+        weight_grams=weight_in_grams(weight, units),
+        discord_id=''
+    )
+    # Written (and the diffs worked out) along with whichever other weigh-ins are coming in at the same time
     try:
-        contestant = await Contestant.objects.aget(
-            discord_id=str(user_id),
-            contest__channel_id=check_in.contest.channel_id
-        )
-    except Contestant.DoesNotExist:
-        raise ContestantNotFound('Current user is not a contestant')
-
-    contestant_check_in, _ = await ContestantCheckIn.objects.aupdate_or_create(
-        check_in=check_in,
-        contestant=contestant,
-        defaults={
-            'weight': weight,
-            'units': units,
-            'discord_id': '',
-        }
+        overall, since_last = await weigh_in_writer.submit(contestant_check_in)
+    except ContestantNotFound:
+        routing_cache.contestant_not_found(user_id, contest_id)
+        raise
+    return contestant_check_in, overall, since_last
+
+
+async def _store_file(field_file: 'django.db.models.fields.files.FieldFile', content: File):
+    """
+    Uploads `content` to the storage backend under the name the field's `upload_to` gives it, and points
+    `field_file` at what was stored.
+
+    The name is worked out on the DB thread, as `upload_to` may read related rows. The transfer itself (a multipart
+    upload to S3 in production) runs in its own thread, so the single thread all the ORM calls share isn't held up
+    for its whole length.
+    """
+    instance, field = field_file.instance, field_file.field
+    name = await sync_to_async(field.generate_filename, thread_sensitive=True)(instance, content.name)
+    name = await sync_to_async(field.storage.save, thread_sensitive=False)(name, content, field.max_length)
+    setattr(instance, field.attname, name)
+
+
+async def store_check_in_photo(
+        contestant_check_in: ContestantCheckIn,
+        attachment_id: snowflake,
+        image: File
+) -> CheckInPhoto:
+    # The storage backend reads `image` in chunks, so this never holds the whole photo in memory
+    photo = CheckInPhoto(
+        discord_id=attachment_id,
+        kind='check-in',
+        contestant_check_in=contestant_check_in
     )
+    await _store_file(photo.image, image)
+    # Only the stored name is written with the row
+    await sync_to_async(photo.save)()
+    logger.info('Handled attachment %s: %s', attachment_id, photo)
+    return photo
+
+
+async def store_photo_variants(photo: CheckInPhoto, variants: List['tracking.images.RenderedVariant']):
+    for variant in variants:
+        photo_variant = CheckInPhotoVariant(
+            photo=photo,
+            kind=variant.kind,
+            width=variant.width,
+            height=variant.height
+        )
+        await _store_file(photo_variant.image, ContentFile(variant.data, name=f'{variant.kind}.{variant.format}'))
+        await sync_to_async(photo_variant.save)()
+    logger.info('Stored %d variants for %s', len(variants), photo)
 
-    overall, since_last = await get_weight_diffs(contestant)
-
-    if attachment is not None:
-        data = await attachment.read()
-        with ContentFile(data, name=attachment.filename) as file_attachment:
-            photo = await CheckInPhoto.objects.acreate(
-                discord_id=attachment.id,
-                kind='check-in',
-                contestant_check_in=contestant_check_in,
-                image=file_attachment
-            )
-            logger.info('Handled attachment %s: %s', attachment.id, photo)
-
-    return overall, since_last
-
-
-async def get_startable_check_in(contest: Contest) -> Optional[CheckIn]:
-    current_date = timezone.now().date()
 
+async def get_contestant_data_version(channel_id: snowflake, user_id: snowflake) -> (int, tuple):
+    """
+    Cheap fingerprint of everything a contestant's charts are rendered from, changes whenever a check-in of theirs is
+    added, edited or removed.
+    """
     try:
-        check_in = await contest.check_ins.filter(
-            finished=False,
-            thread_id__isnull=True,
-            starting__lte=current_date
-        ).aearliest('starting')
-        return check_in
-    except CheckIn.DoesNotExist:
-        return None
+        contestant = await Contestant.objects.filter(
+            discord_id=str(user_id),
+            contest__channel_id=str(channel_id)
+        ).annotate(
+            last_updated=Max('check_ins__updated_at'),
+            num_check_ins=Count('check_ins')
+        ).aget()
+    except Contestant.DoesNotExist:
+        raise ContestantNotFound('Current user is not a contestant')
+    return contestant.id, (contestant.updated_at, contestant.last_updated, contestant.num_check_ins)
 
 
-async def get_running_check_in(contest: Contest) -> Optional[CheckIn]:
+async def get_command_tree_hash(application_id: snowflake) -> Optional[str]:
     try:
-        check_in = await contest.check_ins.filter(
-            finished=False,
-            thread_id__isnull=False,
-            started_at__isnull=False
-        ).aearliest('starting')
-        return check_in
-    except CheckIn.DoesNotExist:
+        synced = await CommandTreeSync.objects.aget(application_id=str(application_id))
+        return synced.tree_hash
+    except CommandTreeSync.DoesNotExist:
         return None
 
 
-async def get_weight_diffs(contestant: Contestant) -> (float, float):
-    first: ContestantCheckIn = await contestant.check_ins.aearliest('check_in__starting')
-    last: ContestantCheckIn = await contestant.check_ins.select_related('check_in').alatest('check_in__starting')
-    try:
-        previous: ContestantCheckIn = await contestant.check_ins.filter(check_in__starting__lt=last.check_in.starting).alatest('check_in__starting')
-    except ContestantCheckIn.DoesNotExist:
-        return last.weight - first.weight, None
-    # TODO: Normalize weights, what if someone decides to mix units?
-    return last.weight - first.weight, last.weight - previous.weight
-
+async def save_command_tree_hash(application_id: snowflake, tree_hash: str):
+    await sync_to_async(CommandTreeSync.objects.update_or_create, thread_sensitive=True)(
+        application_id=str(application_id), defaults={'tree_hash': tree_hash}
+    )
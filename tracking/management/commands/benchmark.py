@@ -0,0 +1,79 @@
+import json
+import logging
+from pathlib import Path
+
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection
+
+from tracking.benchmarks.suite import SCALES, compare, run_scale
+
+BASELINE_PATH = Path(__file__).resolve().parents[2] / 'benchmarks' / 'baseline.json'
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds synthetic contests in a throwaway test database and times the weigh-in, report, scheduler and contest '
+        'setup paths against a stand-in Discord, compared to a stored baseline (failing on extra queries, warning on '
+        'slower timings)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', nargs='+', choices=list(SCALES), default=['10', '1k'])
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--batch', type=int, default=10, help='Contests stepped per scheduler tick')
+        parser.add_argument('--burst', type=int, default=100, help='Contestants weighing in at once')
+        parser.add_argument(
+            '--discord-latency', type=float, default=0.0, help='Seconds the stand-in Discord takes to answer a call'
+        )
+        parser.add_argument('--baseline', type=Path, default=BASELINE_PATH)
+        parser.add_argument('--save-baseline', action='store_true', help='Record the results as the new baseline')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25, help='How much slower (as a fraction) a p95 may get before warning'
+        )
+
+    def handle(self, *args, **options):
+        if options['verbosity'] < 2:
+            # The scheduler logs every check-in it opens and closes, which would drown out the results
+            logging.getLogger('tracking').setLevel(logging.WARNING)
+
+        # Timed in autocommit like the bot runs, so the data can't live in a rolled back transaction. Use a test
+        # database instead of touching the configured one.
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = {}
+            for scale in options['scale']:
+                call_command('flush', interactive=False, verbosity=0)
+                results[scale] = run_scale(
+                    scale,
+                    iterations=options['iterations'],
+                    batch=options['batch'],
+                    burst=options['burst'],
+                    latency=options['discord_latency']
+                )
+                for name, summary in results[scale].items():
+                    self.stdout.write(
+                        f'{scale:>4} {name:<20} p50 {summary["p50_ms"]:>9.2f}ms  p95 {summary["p95_ms"]:>9.2f}ms  '
+                        f'{summary["queries"]} queries'
+                    )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['save_baseline']:
+            baseline = json.loads(options['baseline'].read_text()) if options['baseline'].exists() else {}
+            baseline.update(results)
+            options['baseline'].write_text(json.dumps(baseline, indent=2, sort_keys=True) + '\n')
+            self.stdout.write(f'Saved baseline to {options["baseline"]}')
+            return
+
+        if not options['baseline'].exists():
+            self.stdout.write(f'No baseline at {options["baseline"]}, run with --save-baseline to record one')
+            return
+        regressions, slowdowns = compare(results, json.loads(options['baseline'].read_text()), options['tolerance'])
+        if slowdowns:
+            self.stderr.write(
+                'Slower than the baseline (only comparable when it was recorded on this machine):\n' +
+                '\n'.join(slowdowns)
+            )
+        if regressions:
+            raise CommandError('Regressed against the baseline:\n' + '\n'.join(regressions))
+        self.stdout.write('No query regressions against the baseline')
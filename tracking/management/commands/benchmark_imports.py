@@ -0,0 +1,53 @@
+import statistics
+import subprocess
+import sys
+
+from django.core.management import BaseCommand
+
+# Imports `module` in a fresh interpreter (after Django setup, like `run_bot` does) and reports the import time, the
+# peak RSS, and which parts of the analysis stack ended up loaded.
+IMPORT_PROBE = '''
+import os, resource, sys, time
+import django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'weighbot.settings')
+django.setup()
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+__import__(sys.argv[1])
+elapsed = time.perf_counter() - start
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+heavy = [name for name in sys.argv[2:] if name in sys.modules]
+print(elapsed, (after - before) / 1024, *heavy, sep='|')
+'''
+
+ANALYSIS_STACK = ('pandas', 'numpy', 'matplotlib', 'seaborn', 'PIL')
+
+
+def probe_import(module: str) -> (float, float, list):
+    output = subprocess.run(
+        [sys.executable, '-c', IMPORT_PROBE, module, *ANALYSIS_STACK],
+        check=True,
+        capture_output=True,
+        text=True
+    ).stdout.strip().splitlines()[-1]
+    elapsed, rss_mb, *heavy = output.split('|')
+    return float(elapsed), float(rss_mb), heavy
+
+
+class Command(BaseCommand):
+    help = 'Measures how long importing the bot takes, compared to importing the analysis stack'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('modules', nargs='*', default=['tracking.bot', 'tracking.analysis'])
+
+    def handle(self, *args, **options):
+        for module in options['modules']:
+            results = [probe_import(module) for _ in range(options['runs'])]
+            elapsed = statistics.median(result[0] for result in results)
+            rss = statistics.median(result[1] for result in results)
+            heavy = results[-1][2]
+            self.stdout.write(
+                f'{module}: {elapsed * 1000:.0f}ms, +{rss:.1f}MB RSS, '
+                f'analysis stack loaded: {", ".join(heavy) or "none"}'
+            )
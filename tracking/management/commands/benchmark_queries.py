@@ -0,0 +1,27 @@
+from django.core.management import BaseCommand
+from django.db import connection
+
+from tracking.benchmarks.queries import analyze, hot_queries, uses_index
+from tracking.benchmarks.seed import seed_contests
+
+
+class Command(BaseCommand):
+    help = 'Seeds realistic data in a throwaway test database and prints the query plan of every hot lookup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--contests', type=int, default=200)
+        parser.add_argument('--contestants', type=int, default=50)
+        parser.add_argument('--check-ins', type=int, default=52)
+
+    def handle(self, *args, **options):
+        # Hundreds of thousands of rows and an ANALYZE, so never in the configured database (see `benchmark`)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            contests = seed_contests(options['contests'], options['contestants'], options['check_ins'])
+            analyze()
+            for name, (queryset, indexes) in hot_queries(contests[len(contests) // 2]).items():
+                plan = queryset.explain()
+                status = 'ok' if uses_index(plan, indexes) else 'NOT USING INDEX'
+                self.stdout.write(f'== {name} (expects {indexes[0]}): {status}\n{plan}\n')
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
@@ -0,0 +1,49 @@
+from django.core.management import BaseCommand
+
+from tracking.models import Contestant, ContestantStats
+from tracking.stats import STATS_FIELDS, compute_contestant_stats, rebuild_contestant_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes the contestant stats from their weigh-ins, reporting any that drifted from what the incremental '
+        'updates in log_weight produced'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--contest', type=int, help='Only the contestants of this contest')
+        parser.add_argument('--dry-run', action='store_true', help='Only report the differences')
+
+    def handle(self, *args, **options):
+        contestant_ids = None
+        if options['contest'] is not None:
+            contestant_ids = list(
+                Contestant.objects.filter(contest_id=options['contest']).values_list('id', flat=True)
+            )
+
+        existing = ContestantStats.objects.all()
+        if contestant_ids is not None:
+            existing = existing.filter(contestant_id__in=contestant_ids)
+        existing = {stats.contestant_id: stats for stats in existing}
+
+        # Compared without `updated_at`
+        fields = [field for field in STATS_FIELDS if field != 'updated_at']
+        computed = compute_contestant_stats(contestant_ids)
+        mismatched = 0
+        for stats in computed:
+            current = existing.pop(stats.contestant_id, None)
+            differences = [
+                f'{field}: {getattr(current, field)} != {getattr(stats, field)}'
+                for field in fields if current is None or getattr(current, field) != getattr(stats, field)
+            ]
+            if differences:
+                mismatched += 1
+                self.stdout.write(f'Contestant {stats.contestant_id}: ' + ', '.join(differences))
+        for contestant_id in existing:
+            mismatched += 1
+            self.stdout.write(f'Contestant {contestant_id}: has stats but no weigh-ins')
+
+        self.stdout.write(f'{mismatched} of {len(computed)} contestant(s) differed')
+        if not options['dry_run']:
+            rebuild_contestant_stats(contestant_ids)
+            self.stdout.write('Rebuilt the stats')
@@ -1,79 +1,136 @@
 import asyncio
 import logging
+import signal
+from typing import Callable
 
-from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
-from django.core.management import BaseCommand
-from django.utils import timezone
+from django.core.management import BaseCommand, CommandError
 
 from tracking.bot import WeighbotClient, client
-from tracking.logic import initialize_contest, initialize_check_in, get_startable_check_in, get_running_check_in
-from tracking.models import Contest
+from tracking.db import db_metrics
+from tracking.leader import LeaderElection
+from tracking.metrics import serve_metrics
+from tracking.notify import listen_for_contest_changes
+from tracking.profiling import LoopLagMonitor, start_profiling
+from tracking.scheduler import CheckInScheduler
+from tracking.startup import startup_timer
+
+startup_timer.mark('imports')
 
 logger = logging.getLogger(__name__)
 
 
+async def hold_shard_lease(bot: 'tracking.bot.WeighbotClient', shard_id: int, on_acquired: Callable[[], None]):
+    # One lease per shard rather than per process, so processes whose shards overlap (e.g. `0 1` and `0 1 2 3` during
+    # a rolling deploy) still never both schedule the same shard's channels
+    async def hold():
+        bot.leased_shards.add(shard_id)
+        on_acquired()
+        try:
+            # Until the lease is lost, which cancels this
+            await asyncio.Event().wait()
+        finally:
+            bot.leased_shards.discard(shard_id)
+
+    election = LeaderElection(f'check-in-scheduler:{shard_id}', ttl=settings.CHECK_IN_SCHEDULER_LEASE_SECONDS)
+    await election.run(hold)
+
+
 async def poll_for_updates(bot: 'tracking.bot.WeighbotClient'):
+    # Sleeps until the next check-in open/close deadline rather than polling on a fixed interval. Each process only
+    # schedules the channels of the shards it holds the lease of (see `hold_shard_lease`).
+    scheduler = CheckInScheduler(bot)
+    # Contests edited elsewhere (e.g. in the admin) are re-stepped right away rather than on the next resync
+    listener = asyncio.create_task(
+        listen_for_contest_changes(scheduler.schedule, on_reconnect=scheduler.resync), name='contest-change-listener'
+    )
+    leases = []
+    try:
+        # Without --shard-ids the process runs every shard, and the shard count is only known once connected
+        await bot.gateway_ready.wait()
+        leases = [
+            asyncio.create_task(
+                hold_shard_lease(bot, shard_id, scheduler.resync), name=f'check-in-scheduler-lease:{shard_id}'
+            )
+            for shard_id in bot.shard_ids or range(bot.shard_count)
+        ]
+        await scheduler.run()
+    finally:
+        listener.cancel()
+        for lease in leases:
+            lease.cancel()
+
+
+async def log_db_metrics():
     while True:
-        logger.info('Polling contest updates')
-        current_datetime = timezone.now()
-        try:
-            # Update all our un-finished contests
-            contests = Contest.objects.filter(
-                finished=False
-            ).prefetch_related('check_ins')
-
-            async for contest in contests:
-                # Is this contest un-initialized?
-                check_in_count = await contest.check_ins.acount()
-                if check_in_count == 0:
-                    logger.info('Initializing contest %s', contest)
-                    await initialize_contest(contest)
-
-                # If we have a running check_in, then only update that.
-                # Otherwise, look for and initialize check_ins that are ready.
-                running_check_in = await get_running_check_in(contest)
-                if running_check_in:
-                    time_since_start = current_datetime - running_check_in.started_at
-                    if time_since_start.days >= 1:
-                        logger.info('Closing out check-in: %s', running_check_in)
-                        running_check_in.finished = True
-                        await sync_to_async(running_check_in.save, thread_sensitive=True)()
-                        channel = bot.get_channel(int(contest.channel_id))
-                        await channel.send(f'💪 Check in for {running_check_in.starting} is over 💪')
-                else:
-                    startable = await get_startable_check_in(contest)
-                    if startable is not None:
-                        logger.info('Found a startable check-in: %s', startable)
-                        await initialize_check_in(startable, bot)
-        except Exception:
-            logger.exception('Failure during update poll')
-
-        # We don't need to run this loop a lot, so keep this number (relatively) high
-        await asyncio.sleep(60)
+        await asyncio.sleep(settings.DB_METRICS_LOG_SECONDS)
+        stats = db_metrics.snapshot()
+        logger.info(
+            'DB connections: %d connect(s) taking %.3fs, %d stale closed, %d unit(s) of work waited %.3fs (max %.3fs)',
+            stats['connects'], stats['connect_seconds'], stats['stale_closes'], stats['waits'], stats['wait_seconds'],
+            stats['max_wait_seconds'],
+        )
+
+
+async def start_metrics_server():
+    try:
+        await serve_metrics(settings.BOT_METRICS_HOST, settings.BOT_METRICS_PORT)
+    except OSError:
+        # Not worth taking the bot down over
+        logger.exception('Failed to serve metrics on port %s', settings.BOT_METRICS_PORT)
+        return
+    logger.info('Serving metrics on port %s', settings.BOT_METRICS_PORT)
 
 
 async def monitor():
     logger.info('Client initializing')
     try:
-        asyncio.create_task(client.start(settings.BOT_TOKEN))
-        # TODO: This is a hack. Really we need to wait for the client to be ready.
-        await asyncio.sleep(10)
-        asyncio.create_task(poll_for_updates(client))
+        asyncio.create_task(client.start(settings.BOT_TOKEN), name='discord-client')
+        # The scheduler waits for `client.gateway_ready` itself, and pauses while the gateway is reconnecting
+        asyncio.create_task(poll_for_updates(client), name='check-in-scheduler')
+        asyncio.create_task(log_db_metrics(), name='db-metrics-log')
+        asyncio.create_task(
+            LoopLagMonitor(threshold=settings.EVENT_LOOP_LAG_THRESHOLD).run(), name='loop-lag-monitor'
+        )
+        if settings.BOT_METRICS_PORT:
+            asyncio.create_task(start_metrics_server(), name='metrics-server')
     except Exception:
         logger.exception('Failed to initialize')
     logger.info('Done initializing')
 
 
 class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sync-commands', action='store_true',
+            help='Upload the application commands to Discord even if they look unchanged since the last sync'
+        )
+        parser.add_argument(
+            '--shard-count', type=int, default=settings.BOT_SHARD_COUNT,
+            help='Total number of shards across all the bot processes'
+        )
+        parser.add_argument(
+            '--shard-ids', type=int, nargs='+', default=settings.BOT_SHARD_IDS,
+            help='Shards this process connects, requires --shard-count'
+        )
+
     def handle(self, *args, **options):
         logger.info('=====> Starting the bot')
 
         if settings.BOT_TOKEN is None:
             raise ImproperlyConfigured('Missing BOT_TOKEN setting')
+        client.force_command_sync = options['sync_commands']
+        if options['shard_ids']:
+            if options['shard_count'] is None:
+                raise CommandError('--shard-ids requires --shard-count')
+            client.shard_ids = options['shard_ids']
+        client.shard_count = options['shard_count']
 
         loop = asyncio.get_event_loop()
+        if hasattr(signal, 'SIGUSR1'):
+            # `kill -USR1 <pid>` profiles the running bot, see PROFILE_SECONDS
+            loop.add_signal_handler(signal.SIGUSR1, start_profiling, loop)
         t = loop.create_task(monitor())
         try:
             loop.run_forever()
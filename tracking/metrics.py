@@ -0,0 +1,255 @@
+import bisect
+import contextlib
+import threading
+import time
+from typing import Callable, Iterable, List, Sequence
+
+from tracking.db import db_metrics
+from tracking.instrumentation import count_queries
+
+# Prometheus' text exposition format, hand-rolled rather than pulling in a client library for a handful of metrics
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+BYTES_BUCKETS = tuple(2 ** power * 1024 for power in range(4, 16, 2))
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} takes labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self, labels: dict, value) -> List[str]:
+        return [f'{self.name}{_format_labels(labels)} {_format_value(value)}']
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, self._copy(value)) for key, value in self._values.items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for key, value in values:
+            lines.extend(self._samples(dict(zip(self.labelnames, key)), value))
+        return lines
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # Per-bucket counts (the last one is +Inf) followed by the sum, made cumulative when rendered
+            state = self._values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            state[bisect.bisect_left(self.buckets, value)] += 1
+            state[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def _copy(value):
+        return list(value)
+
+    def _samples(self, labels: dict, value) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), value[:-1]):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{_format_labels({**labels, "le": _format_value(bound)})} {cumulative}')
+        lines.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(value[-1])}')
+        lines.append(f'{self.name}_count{_format_labels(labels)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """
+    The metrics of this process. Besides the ones registered up front, collectors are called on every render for
+    values that already live elsewhere (e.g. `db_metrics`).
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), **kwargs) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, **kwargs))
+
+    def add_collector(self, collect: Callable[[], Iterable[Metric]]):
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        metrics = list(self._metrics)
+        for collect in self._collectors:
+            metrics.extend(collect())
+        return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+
+registry = Registry()
+
+# Bot
+COMMAND_SECONDS = registry.histogram('weighbot_command_seconds', 'Slash command handling time', ['command'])
+COMMAND_ERRORS = registry.counter('weighbot_command_errors_total', 'Slash commands that raised', ['command'])
+COMMAND_DB_QUERIES = registry.histogram(
+    'weighbot_command_db_queries', 'DB round-trips per slash command', ['command'], buckets=QUERY_BUCKETS
+)
+COMMAND_DB_SECONDS = registry.histogram('weighbot_command_db_seconds', 'DB time per slash command', ['command'])
+SCHEDULER_TICK_SECONDS = registry.histogram('weighbot_scheduler_tick_seconds', 'Check-in scheduler tick time')
+SCHEDULER_TICK_DB_QUERIES = registry.histogram(
+    'weighbot_scheduler_tick_db_queries', 'DB round-trips per scheduler tick', buckets=QUERY_BUCKETS
+)
+SCHEDULER_TICK_DB_SECONDS = registry.histogram('weighbot_scheduler_tick_db_seconds', 'DB time per scheduler tick')
+SCHEDULER_CONTESTS_STEPPED = registry.counter(
+    'weighbot_scheduler_contests_stepped_total', 'Contests stepped by the check-in scheduler'
+)
+DISCORD_REQUEST_SECONDS = registry.histogram(
+    'weighbot_discord_request_seconds', 'Discord HTTP API call time, rate limit waits included',
+    ['method', 'route', 'status']
+)
+ATTACHMENT_BYTES = registry.histogram(
+    'weighbot_attachment_bytes', 'Size of the check-in photos downloaded from Discord', buckets=BYTES_BUCKETS
+)
+CHART_RENDER_SECONDS = registry.histogram(
+    'weighbot_chart_render_seconds', 'Chart render time in the worker pool', ['chart', 'status']
+)
+WEIGH_IN_BATCH_SIZE = registry.histogram(
+    'weighbot_weigh_in_batch_size', 'Weigh-ins written together by the write-behind batcher',
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500)
+)
+EVENT_LOOP_LAG_SECONDS = registry.histogram(
+    'weighbot_event_loop_lag_seconds', 'How late the event loop ran a scheduled callback',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+)
+
+# Admin
+ADMIN_REQUEST_SECONDS = registry.histogram(
+    'weighbot_admin_request_seconds', 'Admin request handling time', ['view', 'method', 'status']
+)
+ADMIN_REQUEST_DB_QUERIES = registry.histogram(
+    'weighbot_admin_request_db_queries', 'DB round-trips per admin request', ['view'], buckets=QUERY_BUCKETS
+)
+ADMIN_REQUEST_DB_SECONDS = registry.histogram(
+    'weighbot_admin_request_db_seconds', 'DB time per admin request', ['view']
+)
+
+
+DB_COUNTERS = (
+    ('weighbot_db_connects_total', 'DB connections opened', 'connects'),
+    ('weighbot_db_connect_seconds_total', 'Time spent opening DB connections', 'connect_seconds'),
+    ('weighbot_db_stale_closes_total', 'Broken or expired DB connections closed', 'stale_closes'),
+    ('weighbot_db_waits_total', 'Units of work that queued for the DB thread', 'waits'),
+    ('weighbot_db_wait_seconds_total', 'Time units of work spent queued for the DB thread', 'wait_seconds'),
+)
+
+
+def _collect_db_metrics() -> List[Metric]:
+    stats = db_metrics.snapshot()
+    metrics = []
+    for name, documentation, key in DB_COUNTERS:
+        counter = Counter(name, documentation)
+        counter.inc(stats[key])
+        metrics.append(counter)
+    max_wait = Gauge('weighbot_db_max_wait_seconds', 'Longest a unit of work queued for the DB thread')
+    max_wait.set(stats['max_wait_seconds'])
+    metrics.append(max_wait)
+    return metrics
+
+
+registry.add_collector(_collect_db_metrics)
+
+
+@contextlib.contextmanager
+def measure(seconds: Histogram, queries: Histogram, db_seconds: Histogram, **labels):
+    """
+    Times the block, along with the DB round-trips it made and how long they took (see `count_queries`). Yields the
+    query counter.
+    """
+    start = time.perf_counter()
+    with count_queries() as counter:
+        try:
+            yield counter
+        finally:
+            seconds.observe(time.perf_counter() - start, **labels)
+            queries.observe(counter.count, **labels)
+            db_seconds.observe(counter.seconds, **labels)
+
+
+async def serve_metrics(host: str, port: int) -> 'aiohttp.web.AppRunner':
+    """Serves `registry` at /metrics on the running event loop, returns the runner to stop it with."""
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(body=registry.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,28 @@
+import time
+
+from tracking.instrumentation import count_queries
+from tracking.metrics import ADMIN_REQUEST_DB_QUERIES, ADMIN_REQUEST_DB_SECONDS, ADMIN_REQUEST_SECONDS
+
+
+class RequestTimingMiddleware:
+    """
+    Times every request with the DB round-trips it made, into the same metrics registry the bot uses (served at
+    /metrics). Also reported to the browser through a `Server-Timing` header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with count_queries() as queries:
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        # The URL pattern's name rather than the path, so there's a bounded number of series
+        view = request.resolver_match.view_name if request.resolver_match else 'unresolved'
+        ADMIN_REQUEST_SECONDS.observe(elapsed, view=view, method=request.method, status=response.status_code)
+        ADMIN_REQUEST_DB_QUERIES.observe(queries.count, view=view)
+        ADMIN_REQUEST_DB_SECONDS.observe(queries.seconds, view=view)
+        response['Server-Timing'] = f'app;dur={elapsed * 1000:.1f}, db;dur={queries.seconds * 1000:.1f}'
+        return response
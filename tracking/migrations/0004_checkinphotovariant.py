@@ -0,0 +1,31 @@
+# Generated by Django 4.1 on 2026-10-18 09:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+import tracking.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0003_checkin_previous'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckInPhotoVariant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('kind', models.CharField(max_length=32)),
+                ('image', models.ImageField(upload_to=tracking.models.check_in_photo_variant_upload_dest)),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='tracking.checkinphoto')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.1 on 2026-10-18 09:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0005_remove_duplicate_contestant_check_ins'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='checkin',
+            index=models.Index(condition=models.Q(('finished', False)), fields=['thread_id'], name='checkin_active_thread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='checkin',
+            index=models.Index(condition=models.Q(('finished', False)), fields=['contest', 'starting'], name='checkin_unfinished_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contest',
+            index=models.Index(fields=['channel_id'], name='contest_channel_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contestant',
+            index=models.Index(fields=['discord_id', 'contest'], name='contestant_discord_contest_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='contestantcheckin',
+            constraint=models.UniqueConstraint(fields=('contestant', 'check_in'), name='unique_contestant_check_in'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+def remove_duplicate_contestant_check_ins(apps, schema_editor):
+    # Keep the most recently updated weigh-in of each contestant per check-in, so the unique constraint can be added
+    ContestantCheckIn = apps.get_model('tracking', 'ContestantCheckIn')
+    duplicates = ContestantCheckIn.objects.values(
+        'contestant_id', 'check_in_id'
+    ).annotate(
+        count=models.Count('id')
+    ).filter(count__gt=1)
+    for duplicate in duplicates.iterator():
+        stale = ContestantCheckIn.objects.filter(
+            contestant_id=duplicate['contestant_id'],
+            check_in_id=duplicate['check_in_id']
+        ).order_by('-updated_at', '-id').values_list('id', flat=True)[1:]
+        ContestantCheckIn.objects.filter(id__in=list(stale)).delete()
+
+
+class Migration(migrations.Migration):
+    # On its own, and committed before 0005_hot_lookup_indexes alters the table: Postgres refuses to ALTER a table with
+    # deferred foreign key checks (from the photos of the deleted rows) still pending in the same transaction
+
+    dependencies = [
+        ('tracking', '0004_checkinphotovariant'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            remove_duplicate_contestant_check_ins,
+            migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 4.1 on 2026-10-18 09:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_contestant_stats(apps, schema_editor):
+    # Same as `tracking.stats.compute_contestant_stats`, against the models as they are at this migration
+    CheckIn = apps.get_model('tracking', 'CheckIn')
+    ContestantCheckIn = apps.get_model('tracking', 'ContestantCheckIn')
+    ContestantStats = apps.get_model('tracking', 'ContestantStats')
+
+    previous = {}
+    last = {}
+    for contest_id, check_in_id in CheckIn.objects.order_by('starting').values_list('contest_id', 'id'):
+        previous[check_in_id] = last.get(contest_id)
+        last[contest_id] = check_in_id
+
+    stats = {}
+    rows = ContestantCheckIn.objects.order_by('contestant_id', 'check_in__starting').values_list(
+        'contestant_id', 'check_in_id', 'check_in__starting', 'weight', 'units'
+    )
+    for contestant_id, check_in_id, starting, weight, units in rows.iterator():
+        weight = weight * 2.205 if units == 'kg' else weight
+        current = stats.get(contestant_id)
+        if current is None:
+            stats[contestant_id] = ContestantStats(
+                contestant_id=contestant_id, first_check_in_id=check_in_id, first_weight=weight,
+                latest_check_in_id=check_in_id, latest_weigh_in=starting, latest_weight=weight, previous_weight=None,
+                min_weight=weight, max_weight=weight, check_in_count=1, streak=1
+            )
+            continue
+        current.streak = current.streak + 1 if previous.get(check_in_id) == current.latest_check_in_id else 1
+        current.previous_weight = current.latest_weight
+        current.latest_check_in_id = check_in_id
+        current.latest_weigh_in = starting
+        current.latest_weight = weight
+        current.min_weight = min(current.min_weight, weight)
+        current.max_weight = max(current.max_weight, weight)
+        current.check_in_count += 1
+
+    ContestantStats.objects.bulk_create(stats.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0007_schedulerlease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContestantStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('first_weight', models.FloatField()),
+                ('latest_weigh_in', models.DateField()),
+                ('latest_weight', models.FloatField()),
+                ('previous_weight', models.FloatField(null=True)),
+                ('min_weight', models.FloatField()),
+                ('max_weight', models.FloatField()),
+                ('check_in_count', models.PositiveIntegerField()),
+                ('streak', models.PositiveIntegerField()),
+                ('contestant', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='tracking.contestant')),
+                ('first_check_in', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='tracking.checkin')),
+                ('latest_check_in', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='tracking.checkin')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(
+            populate_contestant_stats,
+            migrations.RunPython.noop
+        ),
+    ]
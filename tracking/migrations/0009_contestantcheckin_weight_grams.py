@@ -0,0 +1,17 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0008_contestantstats'),
+    ]
+
+    operations = [
+        # Nullable until 0010 backfills it, then made required in 0011
+        migrations.AddField(
+            model_name='contestantcheckin',
+            name='weight_grams',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations, transaction
+
+from tracking.constants import GRAMS_PER_KG, GRAMS_PER_LB
+
+BATCH_SIZE = 2000
+
+
+def backfill_weight_grams(apps, schema_editor):
+    # Each batch commits on its own and only rows still missing grams are picked up, so if this is interrupted
+    # (or times out on a big table) running `migrate` again carries on where it left off
+    ContestantCheckIn = apps.get_model('tracking', 'ContestantCheckIn')
+    while True:
+        with transaction.atomic():
+            batch = list(
+                ContestantCheckIn.objects.filter(weight_grams__isnull=True).order_by('id').only('weight', 'units')[
+                    :BATCH_SIZE
+                ]
+            )
+            if not batch:
+                return
+            for weigh_in in batch:
+                per_unit = GRAMS_PER_KG if weigh_in.units == 'kg' else GRAMS_PER_LB
+                weigh_in.weight_grams = round(weigh_in.weight * per_unit)
+            ContestantCheckIn.objects.bulk_update(batch, ['weight_grams'])
+
+
+class Migration(migrations.Migration):
+    # Not wrapped in a single transaction, see `backfill_weight_grams`
+    atomic = False
+
+    dependencies = [
+        ('tracking', '0009_contestantcheckin_weight_grams'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            backfill_weight_grams,
+            migrations.RunPython.noop
+        ),
+    ]
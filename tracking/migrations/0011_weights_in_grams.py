@@ -0,0 +1,56 @@
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Round
+
+from tracking.constants import GRAMS_PER_LB
+
+STATS_WEIGHTS = ['first_weight', 'latest_weight', 'previous_weight', 'min_weight', 'max_weight']
+
+
+def convert_stats_to_grams(apps, schema_editor):
+    ContestantStats = apps.get_model('tracking', 'ContestantStats')
+    ContestantStats.objects.update(**{field: Round(F(field) * GRAMS_PER_LB) for field in STATS_WEIGHTS})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracking', '0010_backfill_weight_grams'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='contestantcheckin',
+            name='weight_grams',
+            field=models.PositiveIntegerField(editable=False),
+        ),
+        migrations.RunPython(
+            convert_stats_to_grams,
+            migrations.RunPython.noop
+        ),
+        migrations.AlterField(
+            model_name='contestantstats',
+            name='first_weight',
+            field=models.PositiveIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='contestantstats',
+            name='latest_weight',
+            field=models.PositiveIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='contestantstats',
+            name='max_weight',
+            field=models.PositiveIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='contestantstats',
+            name='min_weight',
+            field=models.PositiveIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='contestantstats',
+            name='previous_weight',
+            field=models.PositiveIntegerField(null=True),
+        ),
+    ]
@@ -2,6 +2,8 @@ import uuid
 
 from django.db import models
 
+from tracking.constants import weight_in_grams
+
 
 # Utility Base Models
 
@@ -39,6 +41,12 @@ class Contest(TimeAuditable, ExternallyIdentifiable):
     channel_id = models.CharField(max_length=64, null=True, blank=False)
     finished = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # Contests are looked up by the channel they're running in
+            models.Index(fields=['channel_id'], name='contest_channel_idx'),
+        ]
+
     def __str__(self):
         return f'Contest({self.id}, {self.name}, {self.starting} - {self.final_check_in}, finished: {self.finished})'
 
@@ -47,6 +55,12 @@ class Contestant(DiscordIdentifiable, TimeAuditable, ExternallyIdentifiable):
     contest = models.ForeignKey('tracking.Contest', null=True, related_name='contestants', on_delete=models.CASCADE)
     name = models.CharField(max_length=128, blank=False)
 
+    class Meta:
+        indexes = [
+            # Contestants are looked up by their discord user within a contest
+            models.Index(fields=['discord_id', 'contest'], name='contestant_discord_contest_idx'),
+        ]
+
     def __str__(self):
         return f'Contestant({self.id}, {self.name})'
 
@@ -59,6 +73,18 @@ class CheckIn(ExternallyIdentifiable):
     finished = models.BooleanField(default=False)
     previous = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL)
 
+    class Meta:
+        indexes = [
+            # Weigh-ins are routed by thread, but only ever to check-ins that are still running
+            models.Index(fields=['thread_id'], condition=models.Q(finished=False), name='checkin_active_thread_idx'),
+            # The scheduler only looks for the next startable/running check-in of each contest
+            models.Index(
+                fields=['contest', 'starting'],
+                condition=models.Q(finished=False),
+                name='checkin_unfinished_idx'
+            ),
+        ]
+
     def __str__(self):
         return f'CheckIn({self.id}, {self.starting}, started: {self.started_at is not None})'
 
@@ -68,12 +94,48 @@ class ContestantCheckIn(DiscordIdentifiable, TimeAuditable, ExternallyIdentifiab
     contestant = models.ForeignKey('tracking.Contestant', related_name='check_ins', on_delete=models.CASCADE)
     weight = models.FloatField()
     units = models.CharField(max_length=16)
+    # `weight` as entered, normalized to grams so it can be compared, sorted and aggregated in SQL
+    weight_grams = models.PositiveIntegerField(editable=False)
     message_text = models.TextField(blank=True, null=False)
 
+    class Meta:
+        constraints = [
+            # One weigh-in per contestant per check-in, re-submitting updates it. Also indexes weigh-in lookups.
+            models.UniqueConstraint(fields=['contestant', 'check_in'], name='unique_contestant_check_in'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Also covers edits in the admin. Bulk writes have to set it themselves.
+        self.weight_grams = weight_in_grams(self.weight, self.units)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'weight', 'units'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'weight_grams'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f'ContestantCheckIn({self.id}, {self.weight}{self.units}, contestant_id: {self.contestant_id})'
 
 
+class ContestantStats(TimeAuditable):
+    # Denormalized from the contestant's weigh-ins and kept up to date by `log_weight` (and `tracking.signals` for
+    # edits elsewhere), so diffs and leaderboards don't scan every weigh-in. Weights are in grams. See `tracking.stats`,
+    # and `rebuild_contestant_stats` to recompute them.
+    contestant = models.OneToOneField('tracking.Contestant', related_name='stats', on_delete=models.CASCADE)
+    first_check_in = models.ForeignKey('tracking.CheckIn', null=True, related_name='+', on_delete=models.SET_NULL)
+    first_weight = models.PositiveIntegerField()
+    latest_check_in = models.ForeignKey('tracking.CheckIn', null=True, related_name='+', on_delete=models.SET_NULL)
+    latest_weigh_in = models.DateField()
+    latest_weight = models.PositiveIntegerField()
+    previous_weight = models.PositiveIntegerField(null=True)
+    min_weight = models.PositiveIntegerField()
+    max_weight = models.PositiveIntegerField()
+    check_in_count = models.PositiveIntegerField()
+    streak = models.PositiveIntegerField()  # Consecutive check-ins weighed in, up to the latest one
+
+    def __str__(self):
+        return f'ContestantStats({self.contestant_id}, {self.first_weight} -> {self.latest_weight})'
+
+
 def check_in_photo_upload_dest(instance: 'CheckInPhoto', filename: str):
     contest_id = instance.contestant_check_in.check_in.contest.external_id
     check_in_date = instance.contestant_check_in.check_in.starting
@@ -89,3 +151,44 @@ class CheckInPhoto(DiscordIdentifiable, TimeAuditable, ExternallyIdentifiable):
     def __str__(self):
         cci = self.contestant_check_in
         return f'CheckInPhoto({self.id}, {self.kind})'
+
+
+def check_in_photo_variant_upload_dest(instance: 'CheckInPhotoVariant', filename: str):
+    # Stored next to the original, e.g. `<original>_thumbnail.webp`
+    original = instance.photo.image.name.rsplit('.', 1)[0]
+    ext = filename.split('.')[-1]
+    return f'{original}_{instance.kind}.{ext}'
+
+
+class CheckInPhotoVariant(TimeAuditable):
+    photo = models.ForeignKey('tracking.CheckInPhoto', related_name='variants', on_delete=models.CASCADE)
+    kind = models.CharField(max_length=32)  # See `tracking.images.VARIANT_SIZES`
+    image = models.ImageField(upload_to=check_in_photo_variant_upload_dest)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f'CheckInPhotoVariant({self.id}, {self.kind}, {self.width}x{self.height})'
+
+
+# Bot state
+
+
+class CommandTreeSync(TimeAuditable):
+    # Hash of the application commands last uploaded to Discord, so restarts can skip `CommandTree.sync` if nothing
+    # changed. Delete the row to force a sync.
+    application_id = models.CharField(max_length=64, unique=True)
+    tree_hash = models.CharField(max_length=64)
+
+    def __str__(self):
+        return f'CommandTreeSync({self.application_id}, {self.tree_hash[:12]})'
+
+
+class SchedulerLease(models.Model):
+    # Held by the bot process allowed to run the check-in scheduler for a shard, see `tracking.leader`
+    name = models.CharField(max_length=64, unique=True)
+    holder = models.CharField(max_length=128)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f'SchedulerLease({self.name}, {self.holder}, expires: {self.expires_at})'
@@ -0,0 +1,140 @@
+import asyncio
+import functools
+import json
+import logging
+from typing import Callable, Optional
+
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# Postgres channel contest changes are announced on
+CHANNEL = 'tracking_contest_changed'
+
+# How long to wait before reconnecting a dropped LISTEN connection, doubling up to the max
+RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 60
+
+
+class LocalChangeBus:
+    """
+    In-process stand-in for LISTEN/NOTIFY, used when the database isn't Postgres (i.e. SQLite in development and
+    tests). Only reaches listeners in the same process, and like NOTIFY only delivers once the transaction commits.
+    """
+
+    def __init__(self):
+        self._subscribers = []
+
+    def subscribe(self, callback: Callable[[str], None]):
+        subscriber = (asyncio.get_running_loop(), callback)
+        self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self._subscribers.remove(subscriber)
+
+    def publish(self, payload: str):
+        # Saves happen on the ORM's sync threads, hand the payload over to each listener's event loop
+        for loop, callback in list(self._subscribers):
+            loop.call_soon_threadsafe(callback, payload)
+
+
+local_bus = LocalChangeBus()
+
+
+def notify_contest_changed(contest_id: int, using: str = 'default'):
+    """
+    Tells the bot's scheduler a contest or one of its check-ins changed, so it re-steps just that contest instead of
+    waiting for its next periodic resync.
+    """
+    payload = json.dumps({'contest_id': contest_id})
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        # Delivered by Postgres when (and only if) the surrounding transaction commits
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, payload])
+    else:
+        transaction.on_commit(functools.partial(local_bus.publish, payload), using=using)
+
+
+def _dispatch(payload: str, callback: Callable[[int], None]):
+    try:
+        contest_id = json.loads(payload)['contest_id']
+    except (ValueError, KeyError, TypeError):
+        logger.warning('Ignoring malformed change notification: %r', payload)
+        return
+    callback(contest_id)
+
+
+async def _listen_locally(callback: Callable[[int], None]):
+    subscriber = local_bus.subscribe(functools.partial(_dispatch, callback=callback))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        local_bus.unsubscribe(subscriber)
+
+
+async def _listen_postgres(callback: Callable[[int], None], on_reconnect: Optional[Callable[[], None]]):
+    import psycopg2
+
+    loop = asyncio.get_running_loop()
+    params = connections['default'].get_connection_params()
+    delay = RECONNECT_DELAY
+    connected_before = False
+    while True:
+        conn = None
+        try:
+            # A dedicated connection, Django's is recycled between units of work and would drop the LISTEN
+            conn = await loop.run_in_executor(None, functools.partial(psycopg2.connect, **params))
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN {CHANNEL}')
+        except psycopg2.Error:
+            logger.exception('Failure listening for contest changes, retrying in %ds', delay)
+            if conn is not None:
+                conn.close()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+            continue
+
+        logger.info('Listening for contest changes on %s', CHANNEL)
+        delay = RECONNECT_DELAY
+        if connected_before and on_reconnect is not None:
+            # Anything announced while we were disconnected is lost
+            on_reconnect()
+        connected_before = True
+
+        lost = loop.create_future()
+
+        def readable():
+            try:
+                conn.poll()
+            except psycopg2.Error as e:
+                if not lost.done():
+                    lost.set_exception(e)
+                return
+            while conn.notifies:
+                _dispatch(conn.notifies.pop(0).payload, callback)
+
+        loop.add_reader(conn.fileno(), readable)
+        try:
+            await lost
+        except psycopg2.Error:
+            logger.exception('Lost the connection listening for contest changes')
+        finally:
+            loop.remove_reader(conn.fileno())
+            conn.close()
+
+
+async def listen_for_contest_changes(
+        callback: Callable[[int], None],
+        on_reconnect: Optional[Callable[[], None]] = None
+):
+    """
+    Calls `callback(contest_id)` for every `notify_contest_changed`, until cancelled. `on_reconnect` is called if the
+    listening connection dropped, since notifications sent in the meantime were missed.
+    """
+    if connections['default'].vendor == 'postgresql':
+        await _listen_postgres(callback, on_reconnect)
+    else:
+        await _listen_locally(callback)
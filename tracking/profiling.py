@@ -0,0 +1,163 @@
+import asyncio
+import collections
+import datetime
+import functools
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from typing import Optional
+
+from django.conf import settings
+
+from tracking.metrics import EVENT_LOOP_LAG_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=4096)
+def _frame_label(filename: str, name: str, firstlineno: int) -> str:
+    # Relative to the longest matching import root, so frames read like modules rather than absolute paths. Cached
+    # per code object, every sample walks mostly the same frames and scanning sys.path for each one adds up
+    roots = [root for root in sys.path if root and filename.startswith(root.rstrip(os.sep) + os.sep)]
+    path = os.path.relpath(filename, max(roots, key=len)) if roots else filename
+    return f'{name} ({path}:{firstlineno})'
+
+
+def collapse_stack(frame) -> list:
+    """The frames from the outermost call down to `frame`, as flamegraph labels."""
+    labels = []
+    while frame is not None:
+        code = frame.f_code
+        labels.append(_frame_label(code.co_filename, code.co_name, code.co_firstlineno))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+def _task_name(loop: asyncio.AbstractEventLoop) -> str:
+    task = asyncio.current_task(loop)
+    return task.get_name() if task is not None else 'no task'
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of every thread (the event loop's, and the executors' the ORM and image work run in) every
+    `interval` seconds for `duration` seconds, from a background thread so the loop doesn't have to cooperate.
+
+    The result is written as collapsed stacks, one "root;frame;...;frame count" line per distinct stack, which
+    flamegraph.pl, inferno and speedscope all read. Every stack is rooted at its thread's name, and the event loop's
+    also at the asyncio task that was running (e.g. "command:weigh_in" or "check-in-scheduler").
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, *, interval: float, duration: float, path: str):
+        self.loop = loop
+        self.interval = interval
+        self.duration = duration
+        self.path = path
+        # Created from the loop's thread (e.g. in a signal handler added with `loop.add_signal_handler`)
+        self._loop_thread_id = threading.get_ident()
+        self._thread = None
+        self.samples = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def join(self, timeout: float = None):
+        self._thread.join(timeout)
+
+    def sample(self, stacks: collections.Counter):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            root = [names.get(thread_id, str(thread_id))]
+            if thread_id == self._loop_thread_id:
+                root.append(_task_name(self.loop))
+            stacks[';'.join(root + collapse_stack(frame))] += 1
+        self.samples += 1
+
+    def _run(self):
+        stacks = collections.Counter()
+        deadline = time.monotonic() + self.duration
+        try:
+            while time.monotonic() < deadline:
+                self.sample(stacks)
+                time.sleep(self.interval)
+            with open(self.path, 'w') as output:
+                for stack, count in sorted(stacks.items()):
+                    output.write(f'{stack} {count}\n')
+        except Exception:
+            logger.exception('Profiling failed')
+            return
+        logger.info('Wrote %d samples of %d stacks to %s', self.samples, len(stacks), self.path)
+
+
+_profiler: Optional[SamplingProfiler] = None
+
+
+def start_profiling(loop: asyncio.AbstractEventLoop, duration: float = None) -> Optional[SamplingProfiler]:
+    """Starts a `SamplingProfiler` with the PROFILE_* settings, unless one is already running."""
+    global _profiler
+    if _profiler is not None and _profiler.is_running():
+        logger.warning('Already profiling into %s', _profiler.path)
+        return None
+
+    duration = duration or settings.PROFILE_SECONDS
+    timestamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(settings.PROFILE_DIR or tempfile.gettempdir(), f'weighbot-{os.getpid()}-{timestamp}.collapsed')
+    _profiler = SamplingProfiler(loop, interval=settings.PROFILE_SAMPLE_INTERVAL, duration=duration, path=path)
+    _profiler.start()
+    logger.info('Profiling for %ss into %s', duration, path)
+    return _profiler
+
+
+class LoopLagMonitor:
+    """
+    Watches for callbacks that hog the event loop. A heartbeat task records how late its sleeps wake up (the loop lag)
+    and a watchdog thread, noticing the heartbeat has stopped for longer than `threshold` seconds, logs what the loop
+    is stuck on while it's still stuck.
+    """
+
+    def __init__(self, *, threshold: float, interval: float = None):
+        self.threshold = threshold
+        self.interval = interval or threshold / 2
+        self._beat = time.monotonic()
+        self._loop = None
+        self._loop_thread_id = None
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        stop = threading.Event()
+        threading.Thread(target=self._watch, args=(stop,), name='loop-lag-watchdog', daemon=True).start()
+        try:
+            while True:
+                self._beat = time.monotonic()
+                await asyncio.sleep(self.interval)
+                EVENT_LOOP_LAG_SECONDS.observe(max(time.monotonic() - self._beat - self.interval, 0))
+        finally:
+            stop.set()
+
+    def _watch(self, stop: threading.Event):
+        reported = None
+        while not stop.wait(self.interval):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked <= self.threshold or beat == reported:
+                continue
+            # Only once per stall, the heartbeat moves on as soon as the loop gets control back
+            reported = beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            logger.warning(
+                'Event loop blocked for %.3fs in %s:\n%s',
+                blocked, _task_name(self._loop), ''.join(traceback.format_stack(frame)) if frame else '(no stack)'
+            )
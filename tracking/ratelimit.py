@@ -0,0 +1,35 @@
+import asyncio
+import contextlib
+
+
+class RouteLimiter:
+    """
+    Caps concurrent Discord calls, both overall and per route key.
+
+    Discord rate limits message sends and thread creation per channel, plus a global limit across all routes. Fanning
+    out without a cap means a burst of 429s that discord.py then has to back off from one by one, so keep at most
+    `per_route` calls in flight for each channel and `total` overall.
+    """
+
+    def __init__(self, *, total: int, per_route: int):
+        self._total = asyncio.Semaphore(total)
+        self._per_route = per_route
+        # Route key -> (semaphore, callers holding or waiting on it). A route is dropped as soon as it goes idle so a
+        # long running bot doesn't keep a semaphore for every channel it ever posted to
+        self._routes = {}
+
+    @contextlib.asynccontextmanager
+    async def route(self, key):
+        semaphore, users = self._routes.get(key, (None, 0))
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self._per_route)
+        self._routes[key] = (semaphore, users + 1)
+        try:
+            async with semaphore, self._total:
+                yield
+        finally:
+            semaphore, users = self._routes[key]
+            if users == 1:
+                del self._routes[key]
+            else:
+                self._routes[key] = (semaphore, users - 1)
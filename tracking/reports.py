@@ -0,0 +1,85 @@
+"""
+DB loaders for the progress reports. These only touch the ORM, so the bot process can load report data without
+importing the analysis stack; the rendering in `tracking.analysis` runs in the chart process pool.
+"""
+from django.db.models import F, FloatField, ExpressionWrapper
+from django.db.models.functions import NullIf
+
+from tracking.constants import GRAMS_PER_LB
+from tracking.models import Contest, Contestant, ContestantCheckIn, ContestantStats
+
+LEADERBOARD_SIZE = 10
+
+
+def in_lbs(field: str) -> ExpressionWrapper:
+    # Weights are stored in grams, the reports are in lbs
+    return ExpressionWrapper(F(field) / GRAMS_PER_LB, output_field=FloatField())
+
+
+# Columns of the personal progress query, in `values_list` order. Weights are in lbs.
+PERSONAL_PROGRESS_COLUMNS = ('name', 'weigh_in', 'weight')
+
+
+def get_personal_progress_data(contestant_id, channel_id) -> (str, dict):
+    """
+    Loads all of a contestant's weigh-ins in a single query, as columns rather than rows.
+    """
+    rows = ContestantCheckIn.objects.filter(
+        contestant__discord_id=contestant_id,
+        contestant__contest__channel_id=channel_id
+    ).values_list(
+        'contestant__name', 'check_in__starting', in_lbs('weight_grams')
+    ).order_by('check_in__starting')
+
+    columns = dict(zip(PERSONAL_PROGRESS_COLUMNS, zip(*rows)))
+    if not columns:
+        # Only needed to tell a contestant without weigh-ins from someone who isn't a contestant at all
+        contestant = Contestant.objects.get(discord_id=contestant_id, contest__channel_id=channel_id)
+        return contestant.name, {column: () for column in PERSONAL_PROGRESS_COLUMNS}
+
+    return columns['name'][0], columns
+
+
+# Columns of the bulk contest query, in `values_list` order. Weights are in lbs.
+CONTEST_PROGRESS_COLUMNS = ('contestant_id', 'name', 'weigh_in', 'weight')
+
+
+def get_contest_progress_data(channel_id) -> (str, dict):
+    """
+    Loads every weigh-in of the channel's contest in a single query, as columns rather than rows.
+    """
+    contest = Contest.objects.get(channel_id=channel_id)
+    rows = ContestantCheckIn.objects.filter(
+        contestant__contest=contest
+    ).values_list(
+        'contestant_id', 'contestant__name', 'check_in__starting', in_lbs('weight_grams')
+    ).order_by('check_in__starting')
+
+    columns = dict(zip(CONTEST_PROGRESS_COLUMNS, zip(*rows)))
+    if not columns:
+        columns = {column: () for column in CONTEST_PROGRESS_COLUMNS}
+    return contest.name, columns
+
+
+def get_contest_leaderboard(channel_id, size: int = LEADERBOARD_SIZE) -> list:
+    """
+    The top of the channel's contest, ranked by percentage change (biggest loss first), straight from the
+    contestants' stats. Ties share a rank. Contestants who started at 0 have no percentage change and rank last.
+    """
+    change = F('latest_weight') - F('first_weight')
+    rows = ContestantStats.objects.filter(
+        contestant__contest__channel_id=channel_id
+    ).annotate(
+        name=F('contestant__name'),
+        change=ExpressionWrapper(change / GRAMS_PER_LB, output_field=FloatField()),
+        percent_change=ExpressionWrapper(change * 100.0 / NullIf(F('first_weight'), 0), output_field=FloatField()),
+    ).order_by(
+        F('percent_change').asc(nulls_last=True), 'name'
+    ).values('name', 'change', 'percent_change', 'check_in_count', 'streak')
+
+    leaderboard = []
+    for position, row in enumerate(rows[:size], start=1):
+        tied = leaderboard and leaderboard[-1]['percent_change'] == row['percent_change']
+        row['rank'] = leaderboard[-1]['rank'] if tied else position
+        leaderboard.append(row)
+    return leaderboard
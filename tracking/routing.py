@@ -0,0 +1,108 @@
+import asyncio
+import datetime
+import logging
+from typing import NamedTuple, Optional
+
+from discord.types import snowflake
+from django.utils import timezone
+
+from tracking.constants import CHECK_IN_DURATION
+from tracking.models import CheckIn, Contestant
+
+logger = logging.getLogger(__name__)
+
+
+class ActiveCheckIn(NamedTuple):
+    check_in_id: int
+    contest_id: int
+    channel_id: str
+    starting: datetime.date
+    closes_at: datetime.datetime
+
+
+class RoutingCache:
+    """
+    In-process cache of the lookups every weigh-in makes: active check-in thread -> check-in (and its contest), and
+    (user, contest) -> contestant.
+
+    Entries are only ever added for things that exist, and are dropped when check-ins close or contestants join, so a
+    miss just falls through to the DB. Concurrent misses for the same key share a single query.
+    """
+
+    def __init__(self):
+        self._check_ins = {}
+        self._contestants = {}
+        self._pending = {}
+
+    async def _load(self, key, loader):
+        # Single-flight, so a burst of weigh-ins right as a check-in opens makes one query rather than hundreds
+        pending = self._pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            result = await loader()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody else may be waiting on this, don't let asyncio complain about an unretrieved exception
+            future.exception()
+            raise
+        finally:
+            del self._pending[key]
+
+    async def get_active_check_in(self, thread_id: snowflake) -> Optional[ActiveCheckIn]:
+        thread_id = str(thread_id)
+        active = self._check_ins.get(thread_id)
+        if active is not None and active.closes_at > timezone.now():
+            return active
+        # Past its close, the scheduler (which may be running in another bot process) is closing it. Check the DB.
+        self._check_ins.pop(thread_id, None)
+
+        async def load():
+            values = await CheckIn.objects.filter(
+                thread_id=thread_id,
+                finished=False,
+                started_at__isnull=False
+            ).values_list('id', 'contest_id', 'contest__channel_id', 'starting', 'started_at').afirst()
+            if values is None:
+                return None
+            *values, started_at = values
+            return ActiveCheckIn(*values, started_at + CHECK_IN_DURATION)
+
+        active = await self._load(('check_in', thread_id), load)
+        if active is not None:
+            self._check_ins[thread_id] = active
+        return active
+
+    def get_contestant_id(self, user_id: snowflake, contest_id: int) -> Optional[int]:
+        return self._contestants.get((str(user_id), contest_id))
+
+    def set_contestant_id(self, user_id: snowflake, contest_id: int, contestant_id: int):
+        self._contestants[(str(user_id), contest_id)] = contestant_id
+
+    def contestant_not_found(self, user_id: snowflake, contest_id: int):
+        # Deleted (e.g. from the admin) after it was cached
+        self._contestants.pop((str(user_id), contest_id), None)
+
+    def check_in_opened(self, check_in: CheckIn):
+        self._check_ins[str(check_in.thread_id)] = ActiveCheckIn(
+            check_in.id, check_in.contest_id, check_in.contest.channel_id, check_in.starting,
+            check_in.started_at + CHECK_IN_DURATION
+        )
+
+    def check_in_closed(self, check_in: CheckIn):
+        self._check_ins.pop(str(check_in.thread_id), None)
+
+    def contestant_joined(self, contestant: Contestant):
+        self.set_contestant_id(contestant.discord_id, contestant.contest_id, contestant.id)
+
+    def clear(self):
+        self._check_ins.clear()
+        self._contestants.clear()
+
+
+routing_cache = RoutingCache()
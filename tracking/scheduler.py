@@ -0,0 +1,266 @@
+import asyncio
+import datetime
+import heapq
+import logging
+from collections import defaultdict
+from typing import Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from tracking.constants import CHECK_IN_DURATION
+from tracking.db import prepare_connections
+from tracking.logic import initialize_contest, transition_check_ins
+from tracking.metrics import (
+    SCHEDULER_CONTESTS_STEPPED, SCHEDULER_TICK_DB_QUERIES, SCHEDULER_TICK_DB_SECONDS, SCHEDULER_TICK_SECONDS, measure
+)
+from tracking.models import Contest, CheckIn
+from tracking.ratelimit import RouteLimiter
+from tracking.routing import routing_cache
+
+logger = logging.getLogger(__name__)
+
+# If a check-in was due but couldn't be opened (e.g. the channel isn't visible yet), try again after this long
+RETRY_DELAY = datetime.timedelta(seconds=60)
+
+
+def check_in_opens_at(check_in: CheckIn) -> datetime.datetime:
+    # Check-ins become startable at the beginning of their `starting` date
+    return datetime.datetime.combine(check_in.starting, datetime.time.min, tzinfo=datetime.timezone.utc)
+
+
+def check_in_closes_at(check_in: CheckIn) -> datetime.datetime:
+    return check_in.started_at + CHECK_IN_DURATION
+
+
+class CheckInScheduler:
+    """
+    Keeps a heap of the next open/close deadline for every unfinished contest and sleeps until the earliest one.
+
+    Each contest has at most one pending deadline: the close of its running check-in, or the open of its next
+    check-in. Call `schedule` when a contest or its check-ins change, or `resync` to rebuild everything from the DB.
+
+    Only the contests whose channel belongs to one of the bot's shards, and a shard it holds the lease of, are stepped.
+    Every bot process runs its own scheduler for its shards. Contests of a shard that is reconnecting wait for it, the
+    others carry on.
+    """
+
+    def __init__(self, bot: 'tracking.bot.WeighbotClient'):
+        self.bot = bot
+        self._heap = []
+        self._deadlines = {}
+        self._dirty = set()
+        self._needs_resync = True
+        self._wakeup = asyncio.Event()
+        self._last_resync = None
+        self.limiter = RouteLimiter(
+            total=settings.CHECK_IN_FANOUT_CONCURRENCY, per_route=settings.CHECK_IN_FANOUT_PER_CHANNEL
+        )
+
+    def schedule(self, contest_id: int):
+        self._dirty.add(contest_id)
+        self._wakeup.set()
+
+    def resync(self):
+        self._needs_resync = True
+        self._wakeup.set()
+
+    def owns(self, channel_id: str) -> Optional[bool]:
+        """True if the contest channel is ours and its shard is up, False while its shard is down, None if not ours."""
+        shard_id = self.bot.owning_shard(channel_id)
+        if shard_id is None or shard_id not in self.bot.leased_shards:
+            return None
+        return shard_id in self.bot.ready_shards
+
+    def next_deadline(self) -> Optional[datetime.datetime]:
+        while self._heap:
+            deadline, contest_id = self._heap[0]
+            if self._deadlines.get(contest_id) == deadline:
+                return deadline
+            # Stale entry, the contest has since been re-armed or dropped
+            heapq.heappop(self._heap)
+        return None
+
+    def _arm(self, contest_id: int, deadline: Optional[datetime.datetime]):
+        if deadline is None:
+            self._deadlines.pop(contest_id, None)
+            return
+        self._deadlines[contest_id] = deadline
+        heapq.heappush(self._heap, (deadline, contest_id))
+
+    def _pop_due(self, now: datetime.datetime) -> set:
+        due = set()
+        while (deadline := self.next_deadline()) is not None and deadline <= now:
+            _, contest_id = heapq.heappop(self._heap)
+            del self._deadlines[contest_id]
+            due.add(contest_id)
+        return due
+
+    async def rebuild(self):
+        now = timezone.now()
+        self._heap = []
+        self._deadlines = {}
+        # Check-ins or contestants may have been edited outside the bot, start routing from a clean slate too
+        routing_cache.clear()
+
+        # New contests need their check-ins created, so handle them right away
+        uninitialized = Contest.objects.filter(finished=False, check_ins__isnull=True).values_list('id', 'channel_id')
+        async for contest_id, channel_id in uninitialized:
+            if self.owns(channel_id) is not None:
+                self._arm(contest_id, now)
+
+        # Ordered by `starting`, so the first check-in we see for a contest is the one the queries in `logic` would
+        # pick. A running check-in always takes precedence over an unstarted one.
+        check_ins = CheckIn.objects.filter(
+            contest__finished=False, finished=False
+        ).select_related('contest').order_by('starting')
+        running = {}
+        upcoming = {}
+        async for check_in in check_ins:
+            if self.owns(check_in.contest.channel_id) is None:
+                continue
+            if check_in.thread_id is not None and check_in.started_at is not None:
+                running.setdefault(check_in.contest_id, check_in)
+            elif check_in.thread_id is None:
+                upcoming.setdefault(check_in.contest_id, check_in)
+
+        for contest_id, check_in in upcoming.items():
+            if contest_id not in running:
+                self._arm(contest_id, check_in_opens_at(check_in))
+        for contest_id, check_in in running.items():
+            self._arm(contest_id, check_in_closes_at(check_in))
+
+        self._needs_resync = False
+        self._last_resync = now
+
+    async def step_contests(self, contest_ids: set):
+        """
+        Opens or closes whatever is due for the given contests, then re-arms their next deadlines.
+
+        The DB reads are batched across all the contests, the Discord calls fan out concurrently, and the resulting
+        state changes are written in one bulk update (see `transition_check_ins`).
+        """
+        uninitialized = Contest.objects.filter(id__in=contest_ids, finished=False, check_ins__isnull=True)
+        async for contest in uninitialized:
+            # Created by the process owning the channel, so no two processes create the same schedule
+            if self.owns(contest.channel_id) is None:
+                continue
+            logger.info('Initializing contest %s', contest)
+            await initialize_contest(contest)
+
+        check_ins = defaultdict(list)
+        unfinished = CheckIn.objects.filter(
+            contest_id__in=contest_ids, contest__finished=False, finished=False
+        ).select_related('contest').order_by('starting')
+        async for check_in in unfinished:
+            check_ins[check_in.contest_id].append(check_in)
+
+        now = timezone.now()
+        to_open = []
+        to_close = []
+        for contest_id in contest_ids:
+            if check_ins[contest_id]:
+                owned = self.owns(check_ins[contest_id][0].contest.channel_id)
+                if owned is None:
+                    # Another process' (e.g. scheduled through a contest change notification), leave it be
+                    continue
+                if not owned:
+                    # The channel's shard is reconnecting, `run` resyncs once it's back
+                    self._arm(contest_id, now + RETRY_DELAY)
+                    continue
+
+            # The (earliest) running check-in, and the earliest one that hasn't been opened yet
+            running = next((c for c in check_ins[contest_id] if c.thread_id and c.started_at), None)
+            upcoming = next((c for c in check_ins[contest_id] if c.thread_id is None), None)
+
+            if running is not None and check_in_closes_at(running) > now:
+                self._arm(contest_id, check_in_closes_at(running))
+            elif running is not None:
+                to_close.append(running)
+                # The next check-in may already be due, in which case it's opened on the next tick
+                self._arm(contest_id, None if upcoming is None else max(check_in_opens_at(upcoming), now))
+            elif upcoming is not None and upcoming.starting <= now.date():
+                logger.info('Found a startable check-in: %s', upcoming)
+                to_open.append(upcoming)
+            else:
+                self._arm(contest_id, None if upcoming is None else check_in_opens_at(upcoming))
+
+        if not to_open and not to_close:
+            return
+
+        await transition_check_ins(to_open, to_close, self.bot, self.limiter)
+        for check_in in to_open:
+            if check_in.started_at is not None:
+                self._arm(check_in.contest_id, check_in_closes_at(check_in))
+            else:
+                # Opening it failed (e.g. the channel isn't visible yet), back off before trying again
+                self._arm(check_in.contest_id, now + RETRY_DELAY)
+
+    async def tick(self):
+        now = timezone.now()
+        due = self._pop_due(now) | self._dirty
+        self._dirty = set()
+        if due or self._needs_resync:
+            await prepare_connections()
+
+        if self._needs_resync:
+            await self.rebuild()
+            due |= self._pop_due(now)
+
+        if due:
+            try:
+                await self.step_contests(due)
+            except Exception:
+                logger.exception('Failure stepping contests %s', sorted(due))
+                for contest_id in due:
+                    self._arm(contest_id, timezone.now() + RETRY_DELAY)
+        return due
+
+    def _resync_due(self, now: datetime.datetime) -> bool:
+        if self._last_resync is None:
+            return True
+        return now - self._last_resync >= datetime.timedelta(seconds=settings.CHECK_IN_SCHEDULER_RESYNC_SECONDS)
+
+    def _seconds_until_next_wake(self) -> float:
+        now = timezone.now()
+        resync_at = self._last_resync + datetime.timedelta(seconds=settings.CHECK_IN_SCHEDULER_RESYNC_SECONDS)
+        deadline = self.next_deadline()
+        wake_at = resync_at if deadline is None else min(deadline, resync_at)
+        return max((wake_at - now).total_seconds(), 0)
+
+    async def run(self):
+        # A shard coming (back) up may have check-ins that were due while it was down
+        self.bot.shard_ready_listeners.add(self.resync)
+        try:
+            await self._run()
+        finally:
+            self.bot.shard_ready_listeners.discard(self.resync)
+
+    async def _run(self):
+        while True:
+            if not self.bot.gateway_ready.is_set():
+                # Channels can't be resolved until a shard is (re)connected, so opening check-ins would just fail
+                logger.info('Waiting for the gateway before stepping check-ins')
+                await self.bot.gateway_ready.wait()
+
+            # Periodic full resync, catches changes made outside of this process (e.g. in the admin)
+            if self._resync_due(timezone.now()):
+                self._needs_resync = True
+
+            try:
+                with measure(SCHEDULER_TICK_SECONDS, SCHEDULER_TICK_DB_QUERIES, SCHEDULER_TICK_DB_SECONDS) as queries:
+                    due = await self.tick()
+                SCHEDULER_CONTESTS_STEPPED.inc(len(due))
+                if due:
+                    logger.info('Scheduler tick stepped %d contest(s) in %d queries', len(due), queries.count)
+                timeout = self._seconds_until_next_wake()
+            except Exception:
+                logger.exception('Failure during scheduler tick')
+                self._needs_resync = True
+                timeout = RETRY_DELAY.total_seconds()
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
@@ -0,0 +1,45 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from tracking.models import CheckIn, Contest, Contestant, ContestantCheckIn
+from tracking.notify import notify_contest_changed
+from tracking.stats import rebuild_contestant_stats
+
+
+# Both fire for admin edits. The bot itself writes check-ins in bulk (no signals), so it doesn't wake itself up.
+
+@receiver([post_save, post_delete], sender=Contest, dispatch_uid='tracking_contest_changed')
+def contest_changed(sender, instance: Contest, using: str, **kwargs):
+    notify_contest_changed(instance.id, using)
+
+
+@receiver([post_save, post_delete], sender=CheckIn, dispatch_uid='tracking_check_in_changed')
+def check_in_changed(sender, instance: CheckIn, using: str, **kwargs):
+    notify_contest_changed(instance.contest_id, using)
+
+
+# The stats are only updated incrementally by the bot's weigh-ins (bulk writes, no signals). Anything else touching
+# weigh-ins or the order of check-ins (i.e. the admin) has them rebuilt once it commits.
+
+def rebuild_stats_on_commit(contestant_ids: list, using: str):
+    if contestant_ids:
+        transaction.on_commit(partial(rebuild_contestant_stats, contestant_ids), using=using)
+
+
+@receiver([post_save, post_delete], sender=ContestantCheckIn, dispatch_uid='tracking_weigh_in_stats')
+def weigh_in_changed(sender, instance: ContestantCheckIn, using: str, **kwargs):
+    # Deleting a check-in (or contestant) cascades to its weigh-ins, which end up here too
+    rebuild_stats_on_commit([instance.contestant_id], using)
+
+
+@receiver([post_save, post_delete], sender=CheckIn, dispatch_uid='tracking_check_in_stats')
+def check_in_stats_changed(sender, instance: CheckIn, using: str, created=False, update_fields=None, **kwargs):
+    # Moving or removing a check-in changes which weigh-ins follow each other, i.e. the streaks of the whole contest.
+    # The bot's own saves (opening and closing check-ins) don't.
+    if created or (update_fields is not None and 'starting' not in update_fields):
+        return
+    contestant_ids = Contestant.objects.using(using).filter(contest_id=instance.contest_id).values_list('id', flat=True)
+    rebuild_stats_on_commit(list(contestant_ids), using)
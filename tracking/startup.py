@@ -0,0 +1,25 @@
+import time
+
+
+class StartupTimer:
+    """
+    Breaks down how long the bot took to come up. Each `mark` records the time since the previous one, starting from
+    when this module was first imported (early in Django's app loading, see `tracking.apps`).
+    """
+
+    def __init__(self):
+        self._last = time.perf_counter()
+        self.phases = []
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def summary(self) -> str:
+        total = sum(seconds for _, seconds in self.phases)
+        breakdown = ', '.join(f'{phase} {seconds:.2f}s' for phase, seconds in self.phases)
+        return f'{total:.2f}s ({breakdown})'
+
+
+startup_timer = StartupTimer()
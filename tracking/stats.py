@@ -0,0 +1,160 @@
+"""
+Per-contestant stats (`ContestantStats`), updated incrementally as weigh-ins come in so the diffs and leaderboards
+are single row reads. `rebuild_contestant_stats` recomputes them from the weigh-ins, and is what the incremental
+updates are checked against.
+"""
+import datetime
+from typing import Iterable, List, Optional
+
+from django.db import transaction
+from django.utils import timezone
+
+from tracking.constants import grams_in_lbs
+from tracking.models import CheckIn, Contestant, ContestantCheckIn, ContestantStats
+
+# Everything but the contestant, for upserts (as column names, see `save_contestant_stats`)
+STATS_FIELDS = [
+    'first_check_in_id', 'first_weight', 'latest_check_in_id', 'latest_weigh_in', 'latest_weight', 'previous_weight',
+    'min_weight', 'max_weight', 'check_in_count', 'streak', 'updated_at'
+]
+
+
+def get_weight_diffs(
+        latest: float,
+        first: Optional[float],
+        previous: Optional[float]
+) -> (float, Optional[float]):
+    """
+    Overall and since-last diffs for a weigh-in, in the units of the weights given. `first` and `previous` come from
+    the contestant's earlier check-ins and are None when there aren't any.
+    """
+    if first is None:
+        return 0.0, None
+    return latest - first, latest - previous
+
+
+def get_stats(contestant: Contestant) -> Optional[ContestantStats]:
+    # Usually loaded along with the contestant through `select_related('stats')`
+    try:
+        return contestant.stats
+    except ContestantStats.DoesNotExist:
+        return None
+
+
+def apply_weigh_in(
+        stats: Optional[ContestantStats],
+        contestant_id: int,
+        check_in_id: int,
+        previous_check_in_id: Optional[int],
+        starting: datetime.date,
+        weight: int
+) -> Optional[ContestantStats]:
+    """
+    Updates `stats` (in place, when there are any) for a weigh-in of `weight` grams at a check-in.
+
+    Returns None when that can't be worked out from the stats alone: a re-submission replacing the contestant's min
+    or max weight, or a weigh-in before their latest one. Those need `compute_contestant_stats`.
+    """
+    if stats is None:
+        return ContestantStats(
+            contestant_id=contestant_id,
+            first_check_in_id=check_in_id,
+            first_weight=weight,
+            latest_check_in_id=check_in_id,
+            latest_weigh_in=starting,
+            latest_weight=weight,
+            previous_weight=None,
+            min_weight=weight,
+            max_weight=weight,
+            check_in_count=1,
+            streak=1
+        )
+
+    if check_in_id == stats.latest_check_in_id:
+        # Re-submitted the latest weigh-in
+        if stats.check_in_count == 1:
+            stats.first_weight = stats.min_weight = stats.max_weight = weight
+        elif stats.latest_weight in (stats.min_weight, stats.max_weight):
+            return None
+        else:
+            stats.min_weight = min(stats.min_weight, weight)
+            stats.max_weight = max(stats.max_weight, weight)
+        stats.latest_weight = weight
+        return stats
+
+    if starting <= stats.latest_weigh_in:
+        return None
+
+    stats.streak = stats.streak + 1 if previous_check_in_id == stats.latest_check_in_id else 1
+    stats.previous_weight = stats.latest_weight
+    stats.latest_check_in_id = check_in_id
+    stats.latest_weigh_in = starting
+    stats.latest_weight = weight
+    stats.min_weight = min(stats.min_weight, weight)
+    stats.max_weight = max(stats.max_weight, weight)
+    stats.check_in_count += 1
+    return stats
+
+
+def weigh_in_diffs(stats: Optional[ContestantStats], check_in_id: int, weight: int) -> (float, Optional[float]):
+    """
+    Overall and since-last diffs in lbs (see `get_weight_diffs`) of a weigh-in of `weight` grams at the contestant's
+    latest check-in, from the stats as they were before it.
+    """
+    if stats is None or stats.first_check_in_id == check_in_id:
+        return get_weight_diffs(grams_in_lbs(weight), None, None)
+    # Re-submitting keeps diffing against the check-in before, a new check-in diffs against the last one
+    previous = stats.previous_weight if stats.latest_check_in_id == check_in_id else stats.latest_weight
+    return get_weight_diffs(grams_in_lbs(weight), grams_in_lbs(stats.first_weight), grams_in_lbs(previous))
+
+
+def compute_contestant_stats(contestant_ids: Optional[Iterable[int]] = None) -> List[ContestantStats]:
+    """
+    Stats of the given contestants (all of them by default) computed from scratch, in two queries. Contestants
+    without weigh-ins don't get any.
+    """
+    weigh_ins = ContestantCheckIn.objects.order_by('contestant_id', 'check_in__starting')
+    check_ins = CheckIn.objects.order_by('starting')
+    if contestant_ids is not None:
+        contestant_ids = list(contestant_ids)
+        weigh_ins = weigh_ins.filter(contestant_id__in=contestant_ids)
+        check_ins = check_ins.filter(contest__contestants__in=contestant_ids).distinct()
+
+    # The check-in before each check-in of the contest, like `CheckIn.previous`
+    previous = {}
+    last = {}
+    for contest_id, check_in_id in check_ins.values_list('contest_id', 'id'):
+        previous[check_in_id] = last.get(contest_id)
+        last[contest_id] = check_in_id
+
+    stats = {}
+    rows = weigh_ins.values_list('contestant_id', 'check_in_id', 'check_in__starting', 'weight_grams')
+    for contestant_id, check_in_id, starting, weight in rows:
+        stats[contestant_id] = apply_weigh_in(
+            stats.get(contestant_id), contestant_id, check_in_id, previous.get(check_in_id), starting, weight
+        )
+    return list(stats.values())
+
+
+def save_contestant_stats(stats: List[ContestantStats]):
+    # A single upsert, so there's no need to know whether the rows exist yet. Django 4.1 puts the field names in the
+    # ON CONFLICT clause as they're given, so these need to be the column names.
+    now = timezone.now()
+    for row in stats:
+        row.updated_at = now
+    ContestantStats.objects.bulk_create(
+        stats, update_conflicts=True, unique_fields=['contestant_id'], update_fields=STATS_FIELDS
+    )
+
+
+def rebuild_contestant_stats(contestant_ids: Optional[Iterable[int]] = None) -> List[ContestantStats]:
+    if contestant_ids is not None:
+        contestant_ids = list(contestant_ids)
+    with transaction.atomic():
+        stats = compute_contestant_stats(contestant_ids)
+        existing = ContestantStats.objects.all()
+        if contestant_ids is not None:
+            existing = existing.filter(contestant_id__in=contestant_ids)
+        existing.exclude(contestant_id__in=[row.contestant_id for row in stats]).delete()
+        save_contestant_stats(stats)
+    return stats
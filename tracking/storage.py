@@ -0,0 +1,19 @@
+from boto3.s3.transfer import TransferConfig
+from django.conf import settings
+from storages.backends.s3boto3 import S3Boto3Storage
+
+
+class MultipartS3Storage(S3Boto3Storage):
+    """
+    S3 storage that uploads in fixed-size multipart chunks with a capped number of parts in flight, so peak memory per
+    upload is roughly `AWS_S3_MULTIPART_CHUNK_SIZE * AWS_S3_MULTIPART_CONCURRENCY` no matter how large the file is.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._transfer_config = TransferConfig(
+            multipart_threshold=settings.AWS_S3_MULTIPART_CHUNK_SIZE,
+            multipart_chunksize=settings.AWS_S3_MULTIPART_CHUNK_SIZE,
+            max_concurrency=settings.AWS_S3_MULTIPART_CONCURRENCY,
+            use_threads=self.use_threads
+        )
@@ -1,12 +1,58 @@
+import asyncio
 import datetime
+import io
+import os
 import random
-from unittest.mock import Mock, AsyncMock
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest.mock import Mock, AsyncMock, patch
 
-from django.test import TestCase
+import aiohttp
+import discord
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.utils import timezone
+from PIL import Image
 
-from tracking.logic import initialize_contest, get_startable_check_in, initialize_check_in
-from tracking.models import Contest, CheckIn
+from tracking.analysis import generate_personal_progress_report, contest_standings, render_contest_progress_report
+from tracking.bot import WeighbotClient, command_tree_hash, format_percent_change, instrument_http
+from tracking.bot import weigh_in as weigh_in_command
+from tracking.benchmarks.queries import analyze, hot_queries, uses_index
+from tracking.benchmarks.seed import seed_contests
+from tracking.benchmarks.standin import StandInInteraction
+from tracking.benchmarks.suite import compare, run_benchmarks
+from tracking.charts import ChartCache, ChartRenderer
+from tracking.constants import CHECK_IN_DURATION, MAX_WEIGHT, MIN_WEIGHT, Units, weight_in_grams
+from tracking.db import db_metrics, prepare_connections, _prepare_connections
+from tracking.instrumentation import count_queries, current_query_counter
+from tracking.leader import LeaderElection
+from tracking.metrics import Registry, registry, serve_metrics
+from tracking.notify import listen_for_contest_changes
+from tracking.ratelimit import RouteLimiter
+from tracking.profiling import LoopLagMonitor, SamplingProfiler, _frame_label, collapse_stack, start_profiling
+from tracking.errors import ChannelNotFound, ContestantNotFound, ChartRendererBusy, ChartRenderTimeout, InvalidWeight
+from tracking.logic import (
+    initialize_contest, log_weight, get_contestant_data_version, build_check_in_schedule, transition_check_ins
+)
+from tracking.management.commands.benchmark_imports import probe_import
+from tracking.management.commands.run_bot import hold_shard_lease
+from tracking.models import (
+    Contest, CheckIn, Contestant, ContestantCheckIn, CheckInPhoto, CheckInPhotoVariant, CommandTreeSync,
+    ContestantStats, SchedulerLease
+)
+from tracking.routing import routing_cache
+from tracking.reports import get_personal_progress_data, get_contest_progress_data, get_contest_leaderboard
+from tracking.stats import STATS_FIELDS, compute_contestant_stats, rebuild_contestant_stats
+from tracking.scheduler import CheckInScheduler, check_in_opens_at
+from tracking.uploads import PhotoUpload, PhotoUploadQueue, download_attachment
+from tracking.weighins import WeighInWriter, save_weigh_ins
 
 
 def init_happy_path_contest(period: int, num_check_ins: int):
@@ -28,7 +74,10 @@ class ContestTestCase(TestCase):
         self.contest = init_happy_path_contest(period=7, num_check_ins=self.num_check_ins)
 
     async def test_contest_initialization(self):
-        await initialize_contest(self.contest)
+        with count_queries() as queries:
+            await initialize_contest(self.contest)
+        # Insert + previous-link update, and the savepoint around them, no matter how many check-ins there are
+        self.assertLessEqual(queries.count, 4)
         self.assertEqual(await self.contest.check_ins.acount(), self.num_check_ins)
         all_check_ins = [check_in async for check_in in self.contest.check_ins.select_related('previous').order_by('starting')]
         previous = all_check_ins[0]
@@ -37,38 +86,51 @@ class ContestTestCase(TestCase):
             self.assertLess(previous.starting, check_in.starting)
             previous = check_in
 
+    def test_schedule_with_unaligned_final_check_in(self):
+        start = datetime.date(2022, 9, 1)
+        self.assertEqual(
+            build_check_in_schedule(start, datetime.date(2022, 9, 20), 7),
+            [start, datetime.date(2022, 9, 8), datetime.date(2022, 9, 15), datetime.date(2022, 9, 20)]
+        )
+        # A final check-in landing on the period isn't added separately
+        self.assertEqual(
+            build_check_in_schedule(start, datetime.date(2022, 9, 15), 7),
+            [start, datetime.date(2022, 9, 8)]
+        )
 
-class CheckInQueryTestCase(TestCase):
-    def setUp(self) -> None:
-        self.num_check_ins = 3
-        self.contest = init_happy_path_contest(period=7, num_check_ins=self.num_check_ins)
 
-    async def test_check_in_startable_query(self):
-        await initialize_contest(self.contest)
-        check_in: CheckIn = await get_startable_check_in(self.contest)
-        self.assertIsNotNone(check_in)
-        today = timezone.now().date()
-        self.assertEqual(check_in.starting, today)
+def mock_bot():
+    bot = Mock()
+    channel = AsyncMock()
+    thread = AsyncMock()
+    channel.send = AsyncMock(return_value=AsyncMock())
+    channel.create_thread = AsyncMock(return_value=thread)
+    thread.id = 1000 + random.random() * 1000
+    bot.get_channel = Mock(return_value=channel)
+    bot.owning_shard = Mock(return_value=0)
+    bot.ready_shards = {0}
+    bot.leased_shards = {0}
+    bot.shard_ready_listeners = set()
+    return bot, channel, thread
+
+
+async def open_first_check_in(contest: Contest, bot) -> CheckIn:
+    # What the scheduler does once the contest's first check-in is due
+    check_in = await contest.check_ins.select_related('contest').aearliest('starting')
+    await transition_check_ins([check_in], [], bot, RouteLimiter(total=1, per_route=1))
+    return check_in
 
 
 class CheckInInitializeTestCase(TestCase):
     def setUp(self) -> None:
+        routing_cache.clear()
         self.num_check_ins = 3
         self.contest = init_happy_path_contest(period=7, num_check_ins=self.num_check_ins)
 
     async def test_check_in_init(self):
         await initialize_contest(self.contest)
-        check_in: CheckIn = await get_startable_check_in(self.contest)
-        self.assertIsNotNone(check_in)
-        bot = Mock()
-        channel = AsyncMock()
-        thread = AsyncMock()
-        message = AsyncMock()
-        channel.send = AsyncMock(return_value=message)
-        channel.create_thread = AsyncMock(return_value=thread)
-        thread.id = 1000 + random.random() * 1000
-        bot.get_channel = Mock(return_value=channel)
-        await initialize_check_in(check_in, bot)
+        bot, channel, thread = mock_bot()
+        check_in = await open_first_check_in(self.contest, bot)
         self.assertEqual(
             channel.create_thread.call_args[1]['name'],
             f'Check-in'
@@ -81,3 +143,1195 @@ class CheckInInitializeTestCase(TestCase):
             check_in.thread_id,
             thread.id
         )
+
+        await transition_check_ins([], [check_in], bot, RouteLimiter(total=1, per_route=1))
+        self.assertTrue((await CheckIn.objects.aget(id=check_in.id)).finished)
+        self.assertIn('is over', channel.send.call_args[0][0])
+
+
+class CheckInSchedulerTestCase(TestCase):
+    def setUp(self) -> None:
+        routing_cache.clear()
+        self.num_check_ins = 3
+        self.contest = init_happy_path_contest(period=7, num_check_ins=self.num_check_ins)
+
+    async def test_scheduler_opens_and_rearms(self):
+        bot, channel, thread = mock_bot()
+        scheduler = CheckInScheduler(bot)
+
+        # The uninitialized contest is due immediately
+        await scheduler.rebuild()
+        self.assertLessEqual(scheduler.next_deadline(), timezone.now())
+
+        await scheduler.tick()
+        check_in = await self.contest.check_ins.aearliest('starting')
+        self.assertIsNotNone(check_in.started_at)
+        self.assertEqual(scheduler.next_deadline(), check_in.started_at + CHECK_IN_DURATION)
+
+        # Nothing is due, so a tick shouldn't touch the DB
+        with count_queries() as queries:
+            due = await scheduler.tick()
+        self.assertEqual(due, set())
+        self.assertEqual(queries.count, 0)
+
+    async def test_scheduler_only_steps_leased_shards(self):
+        bot, channel, thread = mock_bot()
+        bot.leased_shards = set()
+        scheduler = CheckInScheduler(bot)
+
+        # Another process holds the shard's lease
+        await scheduler.rebuild()
+        self.assertIsNone(scheduler.next_deadline())
+        await scheduler.step_contests({self.contest.id})
+        self.assertFalse(await CheckIn.objects.aexists())
+
+        bot.leased_shards.add(0)
+        await scheduler.rebuild()
+        await scheduler.tick()
+        self.assertTrue(await CheckIn.objects.filter(started_at__isnull=False).aexists())
+
+    async def test_scheduler_rebuild_from_existing_check_ins(self):
+        await initialize_contest(self.contest)
+        bot, channel, thread = mock_bot()
+        scheduler = CheckInScheduler(bot)
+
+        with count_queries() as queries:
+            await scheduler.rebuild()
+        self.assertEqual(queries.count, 2)
+
+        first = await self.contest.check_ins.aearliest('starting')
+        self.assertEqual(scheduler.next_deadline(), check_in_opens_at(first))
+
+    async def test_scheduler_waits_for_gateway(self):
+        bot, channel, thread = mock_bot()
+        bot.gateway_ready = asyncio.Event()
+        task = asyncio.create_task(CheckInScheduler(bot).run())
+        try:
+            await asyncio.sleep(0.05)
+            self.assertFalse(await CheckIn.objects.filter(started_at__isnull=False).aexists())
+
+            bot.gateway_ready.set()
+            for _ in range(50):
+                if await CheckIn.objects.filter(started_at__isnull=False).aexists():
+                    break
+                await asyncio.sleep(0.01)
+            self.assertTrue(await CheckIn.objects.filter(started_at__isnull=False).aexists())
+        finally:
+            task.cancel()
+
+    async def test_scheduler_steps_owned_shards_while_one_reconnects(self):
+        # This process runs shards 0 and 1 of 4, the contest from `setUp` is in a guild of another process
+        bot = WeighbotClient(intents=discord.Intents.default(), shard_ids=[0, 1], shard_count=4)
+        channels = {}
+        contests = {}
+        for shard_id in (0, 1):
+            _, channel, _ = mock_bot()
+            channel.guild = Mock(shard_id=shard_id)
+            channels[1000 + shard_id] = channel
+            contests[shard_id] = await Contest.objects.acreate(
+                name=f'shard {shard_id}', starting=self.contest.starting, check_in_period=7,
+                final_check_in=self.contest.final_check_in, channel_id=str(1000 + shard_id)
+            )
+        bot.get_channel = channels.get
+        # Holding both shards' leases, see `test_overlapping_shards_are_leased_once`
+        bot.leased_shards = {0, 1}
+
+        async def wait_until_open(contest: Contest):
+            for _ in range(100):
+                if await contest.check_ins.filter(started_at__isnull=False).aexists():
+                    return True
+                await asyncio.sleep(0.01)
+            return False
+
+        # Shard 1 re-identifies rather than resuming, so discord.py never dispatches `on_ready` again
+        await bot.on_shard_ready(0)
+        await bot.on_shard_ready(1)
+        await bot.on_shard_disconnect(1)
+        self.assertTrue(bot.gateway_ready.is_set())
+
+        task = asyncio.create_task(CheckInScheduler(bot).run())
+        try:
+            self.assertTrue(await wait_until_open(contests[0]))
+            # Shard 1's contest waits for it, the other process' contest is left to that process
+            self.assertFalse(await contests[1].check_ins.filter(started_at__isnull=False).aexists())
+            self.assertFalse(await self.contest.check_ins.aexists())
+
+            await bot.on_shard_ready(1)
+            self.assertTrue(await wait_until_open(contests[1]))
+            self.assertFalse(await self.contest.check_ins.aexists())
+        finally:
+            task.cancel()
+
+        # Paused only once every shard is down
+        await bot.on_shard_disconnect(0)
+        self.assertTrue(bot.gateway_ready.is_set())
+        await bot.on_shard_disconnect(1)
+        self.assertFalse(bot.gateway_ready.is_set())
+        await bot.on_shard_resumed(0)
+        self.assertTrue(bot.gateway_ready.is_set())
+
+    async def test_scheduler_batches_contests(self):
+        for i in range(4):
+            await Contest.objects.acreate(
+                name=f'contest {i}', starting=self.contest.starting, check_in_period=7,
+                final_check_in=self.contest.final_check_in, channel_id=str(i)
+            )
+        async for contest in Contest.objects.all():
+            await initialize_contest(contest)
+
+        in_flight = 0
+        max_in_flight = 0
+
+        async def create_thread(**kwargs):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            thread = AsyncMock()
+            thread.id = random.randint(1, 2 ** 32)
+            return thread
+
+        bot, channel, _ = mock_bot()
+        channel.create_thread = create_thread
+        scheduler = CheckInScheduler(bot)
+        await scheduler.rebuild()
+
+        # Every contest opens in the same tick, concurrently, and in a fixed number of queries
+        with count_queries() as queries:
+            due = await scheduler.tick()
+        self.assertEqual(len(due), 5)
+        self.assertEqual(await CheckIn.objects.filter(started_at__isnull=False).acount(), 5)
+        self.assertEqual(queries.count, 3)
+        self.assertGreater(max_in_flight, 1)
+
+        await CheckIn.objects.filter(started_at__isnull=False).aupdate(started_at=timezone.now() - CHECK_IN_DURATION)
+        scheduler.resync()
+        with count_queries() as queries:
+            await scheduler.tick()
+        self.assertEqual(await CheckIn.objects.filter(finished=True).acount(), 5)
+        # The rebuild, then the same batched step
+        self.assertEqual(queries.count, 5)
+
+
+class RouteLimiterTestCase(TestCase):
+    async def test_idle_routes_are_dropped(self):
+        limiter = RouteLimiter(total=2, per_route=1)
+        running = []
+
+        async def call(key):
+            async with limiter.route(key):
+                running.append(key)
+                await asyncio.sleep(0.01)
+                running.remove(key)
+                self.assertNotIn(key, running)
+
+        await asyncio.gather(call(1), call(1), call(2), call(3))
+        self.assertEqual(limiter._routes, {})
+
+        with self.assertRaises(RuntimeError):
+            async with limiter.route(1):
+                raise RuntimeError()
+        self.assertEqual(limiter._routes, {})
+
+
+class ContestChangeNotificationTestCase(TransactionTestCase):
+    # Notifications go out on commit, so no wrapping transaction here. SQLite uses the in-process stand-in.
+    def setUp(self) -> None:
+        routing_cache.clear()
+
+    async def test_contest_edit_wakes_the_scheduler(self):
+        bot, channel, thread = mock_bot()
+        scheduler = CheckInScheduler(bot)
+        await scheduler.rebuild()
+        listener = asyncio.create_task(listen_for_contest_changes(scheduler.schedule))
+        try:
+            await asyncio.sleep(0)
+            # e.g. created in the admin
+            contest = await sync_to_async(init_happy_path_contest)(period=7, num_check_ins=3)
+            await asyncio.sleep(0.01)
+
+            # Just that contest is stepped, without a full resync
+            due = await scheduler.tick()
+            self.assertEqual(due, {contest.id})
+            self.assertFalse(scheduler._needs_resync)
+            self.assertTrue(await contest.check_ins.filter(started_at__isnull=False).aexists())
+        finally:
+            listener.cancel()
+
+
+class LogWeightTestCase(TransactionTestCase):
+    # Not wrapped in a transaction like `TestCase`, so round-trips are counted as they happen in the bot (autocommit)
+    def setUp(self) -> None:
+        routing_cache.clear()
+        self.contest = init_happy_path_contest(period=7, num_check_ins=3)
+        self.contestant = Contestant.objects.create(name='happy', discord_id='42', contest=self.contest)
+
+    async def start_check_in(self, thread_id: str) -> CheckIn:
+        check_in = await self.contest.check_ins.filter(thread_id__isnull=True).aearliest('starting')
+        await CheckIn.objects.filter(id=check_in.id).aupdate(thread_id=thread_id, started_at=timezone.now())
+        return check_in
+
+    async def test_log_weight_diffs(self):
+        await initialize_contest(self.contest)
+        await self.start_check_in('1')
+        _, overall, since_last = await log_weight('1', 42, 200.0, 'lbs')
+        self.assertEqual((overall, since_last), (0.0, None))
+
+        await self.start_check_in('2')
+        _, overall, since_last = await log_weight('2', 42, 195.0, 'lbs')
+        self.assertAlmostEqual(overall, -5.0, places=2)
+        self.assertAlmostEqual(since_last, -5.0, places=2)
+
+        # Mixed units are normalized to lbs before diffing
+        await self.start_check_in('3')
+        _, overall, since_last = await log_weight('3', 42, 88.0, 'kg')
+        # Stored as whole grams, so accurate to a few thousandths of a pound
+        self.assertAlmostEqual(overall, 88.0 * 2.205 - 200.0, places=2)
+        self.assertAlmostEqual(since_last, 88.0 * 2.205 - 195.0, places=2)
+
+    async def weigh_in(self, thread_id: str, weight: float):
+        # What the `weigh_in` command does: the check resolves the check-in, and hands it to `log_weight`
+        active_check_in = await routing_cache.get_active_check_in(thread_id)
+        return await log_weight(thread_id, 42, weight, 'lbs', active_check_in)
+
+    async def test_log_weight_round_trips(self):
+        # Resolving the contestant, then the batch: the weigh-in upserted, read back with the stats, and the stats
+        # upserted, in one transaction (which SQLite opens with an explicit BEGIN, one more statement than on Postgres)
+        await initialize_contest(self.contest)
+        await self.start_check_in('1')
+        with count_queries() as queries:
+            await self.weigh_in('1', 200.0)
+        self.assertLessEqual(queries.count, 6)
+
+        # Re-submitting updates the existing entry instead of creating a new one, with the routing cache warm nothing
+        # but the batch
+        with count_queries() as queries:
+            await self.weigh_in('1', 201.0)
+        self.assertLessEqual(queries.count, 4)
+        self.assertEqual(await ContestantCheckIn.objects.acount(), 1)
+        self.assertEqual((await ContestantCheckIn.objects.aget()).weight, 201.0)
+
+    async def test_cached_contestant_deleted(self):
+        await initialize_contest(self.contest)
+        await self.start_check_in('1')
+        await self.weigh_in('1', 200.0)
+
+        await sync_to_async(self.contestant.delete)()
+        with self.assertRaises(ContestantNotFound):
+            await self.weigh_in('1', 201.0)
+        self.assertEqual(await ContestantCheckIn.objects.acount(), 0)
+
+        # Rejoining isn't answered with the deleted contestant's cached id
+        rejoined = await Contestant.objects.acreate(name='happy', discord_id='42', contest=self.contest)
+        contestant_check_in, _, _ = await self.weigh_in('1', 202.0)
+        self.assertEqual(contestant_check_in.contestant_id, rejoined.id)
+
+    async def test_concurrent_weigh_ins_are_batched(self):
+        await initialize_contest(self.contest)
+        await self.start_check_in('1')
+        others = await sync_to_async(Contestant.objects.bulk_create)([
+            Contestant(name=f'other-{i}', discord_id=str(100 + i), contest=self.contest) for i in range(19)
+        ])
+        user_ids = [42] + [int(contestant.discord_id) for contestant in others]
+
+        async def weigh_in(user_id: int, weight: float):
+            with count_queries() as queries:
+                result = await log_weight('1', user_id, weight, 'lbs')
+            return result, queries.count
+
+        with patch('tracking.weighins.save_weigh_ins', wraps=save_weigh_ins) as save, count_queries() as queries:
+            counted = await asyncio.gather(
+                *(weigh_in(user_id, 200.0 + i) for i, user_id in enumerate(user_ids)),
+                # Re-submitted while the others are still being written
+                weigh_in(42, 150.0)
+            )
+        results = [result for result, _ in counted]
+        # The first weigh-in is written right away, the others pile up behind it and are written together
+        self.assertLessEqual(save.call_count, 3)
+        # At most two lookups per weigh-in (the check-in, until it's cached, and the contestant), then the batches
+        self.assertLessEqual(queries.count, 2 * len(results) + 4 * save.call_count)
+        # Every weigh-in counts the batch it was written in (like the command metrics do), while the block around
+        # them all counts each batch once
+        for _, count in counted:
+            self.assertGreaterEqual(count, 1 + 3)
+        self.assertLess(queries.count, sum(count for _, count in counted))
+
+        ids = [contestant_check_in.id for contestant_check_in, _, _ in results]
+        self.assertEqual(len(set(ids)), 20)
+        self.assertEqual(ids[0], ids[-1])
+        self.assertEqual(await ContestantCheckIn.objects.acount(), 20)
+        self.assertEqual((await ContestantCheckIn.objects.aget(id=ids[0])).weight, 150.0)
+        stats = await ContestantStats.objects.aget(contestant=self.contestant)
+        grams = weight_in_grams(150.0, 'lbs')
+        self.assertEqual((stats.latest_weight, stats.min_weight, stats.max_weight), (grams, grams, grams))
+        self.assertEqual(await ContestantStats.objects.acount(), 20)
+
+    async def test_failed_weigh_in_does_not_fail_its_batch(self):
+        await initialize_contest(self.contest)
+        check_in = await self.start_check_in('1')
+        writer = WeighInWriter()
+
+        def weigh_in(contestant_id: int) -> ContestantCheckIn:
+            return ContestantCheckIn(
+                contestant_id=contestant_id, check_in=check_in, weight=200.0, units='lbs',
+                weight_grams=weight_in_grams(200.0, 'lbs'), discord_id=''
+            )
+
+        with self.assertLogs('tracking.weighins', 'WARNING'):
+            saved, missing = await asyncio.gather(
+                writer.submit(weigh_in(self.contestant.id)), writer.submit(weigh_in(self.contestant.id + 1000)),
+                return_exceptions=True
+            )
+        self.assertEqual(saved, (0.0, None))
+        self.assertIsInstance(missing, ContestantNotFound)
+        self.assertTrue(await ContestantCheckIn.objects.filter(contestant=self.contestant).aexists())
+
+    async def test_writer_runs_outside_the_callers_context(self):
+        await initialize_contest(self.contest)
+        check_in = await self.start_check_in('1')
+        writer = WeighInWriter()
+        parents = []
+
+        def save(weigh_ins):
+            parents.append(current_query_counter().parent)
+            return save_weigh_ins(weigh_ins)
+
+        with count_queries() as queries, patch('tracking.weighins.save_weigh_ins', side_effect=save):
+            await writer.submit(ContestantCheckIn(
+                contestant=self.contestant, check_in=check_in, weight=200.0, units='lbs',
+                weight_grams=weight_in_grams(200.0, 'lbs'), discord_id=''
+            ))
+        # The write only counts towards the caller's counter through `attribute_queries`, not by inheriting it
+        self.assertEqual(parents, [None])
+        self.assertGreater(queries.count, 0)
+
+    async def test_stats_match_rebuild(self):
+        await initialize_contest(self.contest)
+        # Includes re-submissions that replace the min/max, and a check-in in kg
+        for thread_id, weight, units in [
+            ('1', 200.0, 'lbs'), ('1', 190.0, 'lbs'), ('2', 195.0, 'lbs'), ('2', 185.0, 'lbs'), ('3', 85.0, 'kg')
+        ]:
+            if not await CheckIn.objects.filter(thread_id=thread_id).aexists():
+                await self.start_check_in(thread_id)
+            await log_weight(thread_id, 42, weight, units)
+
+        stats = await ContestantStats.objects.aget(contestant=self.contestant)
+        self.assertEqual(
+            (stats.first_weight, stats.previous_weight, stats.latest_weight),
+            (weight_in_grams(190.0, 'lbs'), weight_in_grams(185.0, 'lbs'), 85000)
+        )
+        self.assertEqual((stats.min_weight, stats.max_weight), (weight_in_grams(185.0, 'lbs'), stats.first_weight))
+        self.assertEqual((stats.check_in_count, stats.streak), (3, 3))
+
+        rebuilt, = await sync_to_async(compute_contestant_stats)([self.contestant.id])
+        for field in STATS_FIELDS[:-1]:
+            self.assertEqual(getattr(rebuilt, field), getattr(stats, field), field)
+
+        out = io.StringIO()
+        await sync_to_async(call_command)('rebuild_contestant_stats', '--dry-run', stdout=out)
+        self.assertIn('0 of 1 contestant(s) differed', out.getvalue())
+
+        # The leaderboard comes straight from the stats
+        leaderboard = await sync_to_async(get_contest_leaderboard)(self.contest.channel_id)
+        self.assertEqual([row['name'] for row in leaderboard], ['happy'])
+        self.assertAlmostEqual(leaderboard[0]['change'], 85.0 * 2.205 - 190.0, places=2)
+
+    def test_weight_grams_follows_edits(self):
+        # e.g. corrected in the admin
+        check_in = CheckIn.objects.create(contest=self.contest, starting=self.contest.starting)
+        weigh_in = ContestantCheckIn.objects.create(contestant=self.contestant, check_in=check_in, weight=90, units='kg')
+        self.assertEqual(weigh_in.weight_grams, 90000)
+
+        weigh_in.units = 'lbs'
+        weigh_in.save(update_fields=['units'])
+        weigh_in.refresh_from_db()
+        self.assertEqual(weigh_in.weight_grams, weight_in_grams(90, 'lbs'))
+
+    def test_stats_follow_admin_edits(self):
+        async_to_sync(initialize_contest)(self.contest)
+        first, second = self.contest.check_ins.order_by('starting')[:2]
+        get_stats = lambda: ContestantStats.objects.get(contestant=self.contestant)
+
+        # Written through the models rather than `log_weight`, like the admin does
+        ContestantCheckIn.objects.create(contestant=self.contestant, check_in=first, weight=200, units='lbs')
+        corrected = ContestantCheckIn.objects.create(
+            contestant=self.contestant, check_in=second, weight=190, units='lbs'
+        )
+        self.assertEqual((get_stats().latest_weight, get_stats().streak), (weight_in_grams(190, 'lbs'), 2))
+
+        corrected.weight = 180
+        corrected.save()
+        self.assertEqual(get_stats().latest_weight, weight_in_grams(180, 'lbs'))
+
+        # Moving a check-in reorders the weigh-ins
+        second.starting = first.starting - datetime.timedelta(days=1)
+        second.save()
+        stats = get_stats()
+        self.assertEqual(
+            (stats.first_weight, stats.latest_weight), (weight_in_grams(180, 'lbs'), weight_in_grams(200, 'lbs'))
+        )
+
+        corrected.delete()
+        stats = get_stats()
+        self.assertEqual((stats.first_weight, stats.latest_weight), (weight_in_grams(200, 'lbs'),) * 2)
+        self.assertEqual(stats.check_in_count, 1)
+
+        # Its weigh-ins go with it
+        first.delete()
+        self.assertFalse(ContestantStats.objects.filter(contestant=self.contestant).exists())
+
+    async def test_log_weight_not_found(self):
+        await initialize_contest(self.contest)
+        await self.start_check_in('1')
+        with self.assertRaises(ContestantNotFound):
+            await log_weight('1', 7, 200.0, 'lbs')
+        with self.assertRaises(ChannelNotFound):
+            await log_weight('99', 42, 200.0, 'lbs')
+
+
+    async def test_out_of_range_weights_are_rejected(self):
+        await initialize_contest(self.contest)
+        await self.start_check_in('1')
+        for weight in (-5.0, 0.0, MAX_WEIGHT + 1):
+            with self.subTest(weight), self.assertRaises(InvalidWeight):
+                await log_weight('1', 42, weight, 'lbs')
+        self.assertFalse(await ContestantCheckIn.objects.aexists())
+
+        # Discord validates the command's input already, but the user still gets an answer if it gets through
+        self.assertEqual(weigh_in_command.get_parameter('weight').min_value, MIN_WEIGHT)
+        interaction = StandInInteraction(1, 42)
+        await weigh_in_command.callback(interaction, weight=-5.0, units=Units.lbs, image=None)
+        self.assertIn(f'between {MIN_WEIGHT} and {MAX_WEIGHT}', interaction.followup.sent[-1].content)
+
+        with patch('tracking.bot.log_weight', AsyncMock(side_effect=IntegrityError())):
+            await weigh_in_command.callback(interaction, weight=200.0, units=Units.lbs, image=None)
+        self.assertIn('could not be saved', interaction.followup.sent[-1].content)
+
+
+class PrepareConnectionsTestCase(TransactionTestCase):
+    # Outside of a transaction, like the bot. Called directly so we look at this thread's connection.
+    @override_settings(DB_IDLE_HEALTH_CHECK_SECONDS=60)
+    def test_health_check_only_after_idle(self):
+        Contest.objects.count()
+        _prepare_connections(time.monotonic())
+        # Used a moment ago, so the next query skips the ping
+        _prepare_connections(time.monotonic())
+        self.assertTrue(connection.health_check_done)
+
+        with override_settings(DB_IDLE_HEALTH_CHECK_SECONDS=0):
+            _prepare_connections(time.monotonic())
+        self.assertFalse(connection.health_check_done)
+
+    @override_settings(DB_IDLE_HEALTH_CHECK_SECONDS=60)
+    def test_django_skips_the_ping_when_health_check_done(self):
+        # Pins our use of Django's private `health_check_done`: if a Django upgrade renames it or stops consulting it
+        # before a query, this fails instead of the bot silently pinging (or never pinging) the database
+        Contest.objects.count()
+        with patch.object(connection, 'health_check_enabled', True), \
+                patch.object(connection, 'is_usable', return_value=True) as is_usable:
+            _prepare_connections(time.monotonic())
+            Contest.objects.count()
+            is_usable.assert_not_called()
+
+            with override_settings(DB_IDLE_HEALTH_CHECK_SECONDS=0):
+                _prepare_connections(time.monotonic())
+            Contest.objects.count()
+            is_usable.assert_called_once()
+
+    def test_open_transaction_is_left_alone(self):
+        with transaction.atomic():
+            Contest.objects.count()
+            with patch.object(connection, 'close_if_unusable_or_obsolete') as close:
+                _prepare_connections(time.monotonic())
+            close.assert_not_called()
+
+    async def test_wait_is_recorded(self):
+        waits = db_metrics.snapshot()['waits']
+        await prepare_connections()
+        self.assertEqual(db_metrics.snapshot()['waits'], waits + 1)
+
+
+class FakeCDNResponse:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.content = self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    async def iter_chunked(self, size: int):
+        for i in range(0, len(self.data), size):
+            yield self.data[i:i + size]
+
+
+def spooled(data: bytes):
+    spool = tempfile.NamedTemporaryFile(suffix='.png')
+    spool.write(data)
+    spool.flush()
+    spool.seek(0)
+    return spool
+
+
+def png_bytes(width: int, height: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), color='red').save(buffer, format='png')
+    return buffer.getvalue()
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class PhotoUploadQueueTestCase(TestCase):
+    def setUp(self) -> None:
+        routing_cache.clear()
+        self.contest = init_happy_path_contest(period=7, num_check_ins=3)
+        self.contestant = Contestant.objects.create(name='happy', discord_id='42', contest=self.contest)
+
+    async def log_check_in(self) -> ContestantCheckIn:
+        await initialize_contest(self.contest)
+        check_in = await self.contest.check_ins.aearliest('starting')
+        await CheckIn.objects.filter(id=check_in.id).aupdate(thread_id='1', started_at=timezone.now())
+        contestant_check_in, _, _ = await log_weight('1', 42, 200.0, 'lbs')
+        return contestant_check_in
+
+    def mock_attachment(self):
+        attachment = Mock()
+        attachment.id = 555
+        attachment.filename = 'scale.png'
+        attachment.url = 'https://cdn.example.com/scale.png'
+        return attachment
+
+    async def test_download_is_chunked(self):
+        data = bytes(range(256)) * 4
+        session = Mock()
+        session.get = Mock(return_value=FakeCDNResponse(data))
+        with await download_attachment(session, self.mock_attachment(), chunk_size=64) as spool:
+            self.assertTrue(spool.name.endswith('.png'))
+            self.assertEqual(spool.read(), data)
+
+    async def test_upload_retries(self):
+        contestant_check_in = await self.log_check_in()
+        bot, channel, thread = mock_bot()
+        queue = PhotoUploadQueue(bot, concurrency=1, max_pending=1, max_attempts=2, retry_delay=0)
+        download = AsyncMock(side_effect=[ConnectionError(), spooled(png_bytes(2000, 1000))])
+
+        with patch('tracking.uploads.download_attachment', download):
+            self.assertTrue(queue.submit(PhotoUpload(contestant_check_in, self.mock_attachment(), 1, 42)))
+            await queue.join()
+        await queue.stop()
+
+        self.assertEqual(await CheckInPhoto.objects.acount(), 1)
+        channel.send.assert_not_called()
+
+        variants = {variant.kind: variant async for variant in CheckInPhotoVariant.objects.all()}
+        self.assertEqual((variants['thumbnail'].width, variants['thumbnail'].height), (256, 128))
+        self.assertEqual((variants['display'].width, variants['display'].height), (1280, 640))
+        self.assertTrue(variants['thumbnail'].image.name.endswith('_thumbnail.webp'))
+
+    async def test_upload_failure_reported(self):
+        contestant_check_in = await self.log_check_in()
+        bot, channel, thread = mock_bot()
+        queue = PhotoUploadQueue(bot, concurrency=1, max_pending=1, max_attempts=2, retry_delay=0)
+        download = AsyncMock(side_effect=ConnectionError())
+
+        with patch('tracking.uploads.download_attachment', download):
+            queue.submit(PhotoUpload(contestant_check_in, self.mock_attachment(), 1, 42))
+            await queue.join()
+        await queue.stop()
+
+        self.assertEqual(await CheckInPhoto.objects.acount(), 0)
+        self.assertEqual(download.await_count, 2)
+        self.assertIn('could not be saved', channel.send.call_args[0][0])
+
+    async def test_upload_is_off_the_db_thread(self):
+        contestant_check_in = await self.log_check_in()
+        bot, channel, thread = mock_bot()
+        queue = PhotoUploadQueue(bot, concurrency=1, max_pending=1, max_attempts=1, retry_delay=0)
+        db_thread = await sync_to_async(threading.get_ident)()
+        save = FileSystemStorage.save
+        threads = []
+
+        def record(storage, *args, **kwargs):
+            threads.append(threading.get_ident())
+            return save(storage, *args, **kwargs)
+
+        with patch('tracking.uploads.download_attachment', AsyncMock(return_value=spooled(png_bytes(200, 100)))), \
+                patch.object(FileSystemStorage, 'save', autospec=True, side_effect=record):
+            queue.submit(PhotoUpload(contestant_check_in, self.mock_attachment(), 1, 42))
+            await queue.join()
+        await queue.stop()
+
+        # The original and both variants, none of them holding up the ORM calls while they transfer
+        self.assertEqual(len(threads), 3)
+        self.assertNotIn(db_thread, threads)
+        photo = await CheckInPhoto.objects.aget()
+        self.assertTrue(photo.image.storage.exists(photo.image.name))
+
+
+class ChartRendererTestCase(TestCase):
+    columns = {
+        'name': ('happy', 'happy'),
+        'weigh_in': (datetime.date(2022, 9, 1), datetime.date(2022, 9, 8)),
+        'weight': (200.0, 90.0),
+        'units': ('lbs', 'kg'),
+    }
+
+    async def test_render_in_pool(self):
+        renderer = ChartRenderer(max_workers=1, max_pending=0, timeout=60)
+        try:
+            image = await renderer.render('tracking.analysis.render_personal_progress_report', 'happy', self.columns)
+        finally:
+            renderer.stop()
+        self.assertTrue(image.startswith(b'\x89PNG'))
+
+    async def test_render_limits(self):
+        renderer = ChartRenderer(max_workers=1, max_pending=0, timeout=0.5)
+        try:
+            slow = asyncio.create_task(renderer.render('time.sleep', 2))
+            await asyncio.sleep(0)
+            # The only worker is taken and nothing is allowed to queue behind it
+            with self.assertRaises(ChartRendererBusy):
+                await renderer.render('time.sleep', 0)
+            with self.assertRaises(ChartRenderTimeout):
+                await slow
+            # The timed out render is still running, and still holds the worker
+            with self.assertRaises(ChartRendererBusy):
+                await renderer.render('time.sleep', 0)
+
+            for _ in range(50):
+                if not renderer._slots.locked():
+                    break
+                await asyncio.sleep(0.1)
+            self.assertIsNone(await renderer.render('time.sleep', 0))
+        finally:
+            renderer.stop()
+
+
+class ChartCacheTestCase(TestCase):
+    async def test_lru_eviction(self):
+        cache = ChartCache(max_bytes=10)
+        await cache.put('1-a', b'12345')
+        await cache.put('2-a', b'12345')
+        await cache.get('1-a')
+        await cache.put('3-a', b'12345')
+        # `2-a` was the least recently used
+        self.assertIsNone(await cache.get('2-a'))
+        self.assertEqual(await cache.get('1-a'), b'12345')
+        self.assertEqual(await cache.get('3-a'), b'12345')
+
+    async def test_disk_tier_and_invalidation(self):
+        directory = tempfile.mkdtemp()
+        cache = ChartCache(max_bytes=1024, directory=directory)
+        key = ChartCache.key('personal_progress', 1, ('v1',))
+        await cache.put(key, b'chart')
+
+        # A fresh cache (e.g. after a restart) still finds the chart on disk
+        self.assertEqual(await ChartCache(max_bytes=1024, directory=directory).get(key), b'chart')
+
+        await cache.invalidate(1)
+        self.assertIsNone(await cache.get(key))
+        self.assertIsNone(await ChartCache(max_bytes=1024, directory=directory).get(key))
+
+    async def test_disk_tier_is_off_the_loop(self):
+        directory = tempfile.mkdtemp()
+        cache = ChartCache(max_bytes=1024, directory=directory, max_disk_bytes=10)
+        loop_thread = threading.get_ident()
+        threads = set()
+        glob = Path.glob
+
+        def record(path, pattern):
+            threads.add(threading.get_ident())
+            return glob(path, pattern)
+
+        with patch.object(Path, 'glob', autospec=True, side_effect=record):
+            for i in range(3):
+                await cache.put(f'{i}-a', b'12345')
+            await cache.invalidate(2)
+        self.assertTrue(threads)
+        self.assertNotIn(loop_thread, threads)
+        # Pruned down to `max_disk_bytes`, then the invalidated one removed
+        remaining = [path.name for path in Path(directory).iterdir()]
+        self.assertEqual(len(remaining), 1)
+        self.assertNotIn('2-a.png', remaining)
+
+
+class ContestantDataVersionTestCase(TestCase):
+    def setUp(self) -> None:
+        routing_cache.clear()
+        self.contest = init_happy_path_contest(period=7, num_check_ins=3)
+        self.contestant = Contestant.objects.create(name='happy', discord_id='42', contest=self.contest)
+
+    async def test_version_changes_on_weigh_in(self):
+        await initialize_contest(self.contest)
+        check_in = await self.contest.check_ins.aearliest('starting')
+        await CheckIn.objects.filter(id=check_in.id).aupdate(thread_id='1', started_at=timezone.now())
+
+        contestant_id, before = await get_contestant_data_version(self.contest.channel_id, 42)
+        self.assertEqual(contestant_id, self.contestant.id)
+        await log_weight('1', 42, 200.0, 'lbs')
+        _, after = await get_contestant_data_version(self.contest.channel_id, 42)
+        self.assertNotEqual(before, after)
+
+        with self.assertRaises(ContestantNotFound):
+            await get_contestant_data_version(self.contest.channel_id, 7)
+
+
+class ContestProgressTestCase(TestCase):
+    def setUp(self) -> None:
+        self.contest = init_happy_path_contest(period=7, num_check_ins=3)
+        self.contestants = [
+            Contestant.objects.create(name=name, discord_id=str(i), contest=self.contest)
+            for i, name in enumerate(['ann', 'bob', 'cat'])
+        ]
+
+    async def test_contest_standings(self):
+        await initialize_contest(self.contest)
+        check_ins = [check_in async for check_in in self.contest.check_ins.order_by('starting')]
+        weigh_ins = [
+            # ann loses 10%, bob (in kg) loses 5%, cat misses the middle check-in and gains 1%
+            (0, 0, 200.0, 'lbs'), (0, 1, 190.0, 'lbs'), (0, 2, 180.0, 'lbs'),
+            (1, 0, 100.0, 'kg'), (1, 1, 95.0, 'kg'),
+            (2, 0, 150.0, 'lbs'), (2, 2, 151.5, 'lbs'),
+        ]
+        await ContestantCheckIn.objects.abulk_create([
+            ContestantCheckIn(
+                contestant=self.contestants[c], check_in=check_ins[i], weight=weight, units=units,
+                weight_grams=weight_in_grams(weight, units)
+            )
+            for c, i, weight, units in weigh_ins
+        ])
+
+        with count_queries() as queries:
+            name, columns = await sync_to_async(get_contest_progress_data)(self.contest.channel_id)
+        self.assertEqual(queries.count, 2)
+
+        standings, progress = contest_standings(columns)
+        self.assertEqual(list(standings['name']), ['ann', 'bob', 'cat'])
+        self.assertEqual(list(standings['rank']), [1, 2, 3])
+        self.assertAlmostEqual(standings.iloc[0]['percent_change'], -10.0, places=2)
+        self.assertAlmostEqual(standings.iloc[1]['percent_change'], -5.0, places=2)
+        self.assertAlmostEqual(standings.iloc[1]['change'], -5.0 * 2.205, places=2)
+        self.assertAlmostEqual(standings.iloc[2]['percent_change'], 1.0, places=2)
+        self.assertEqual(list(standings['check_ins']), [3, 2, 2])
+        self.assertTrue(progress.isna().to_numpy().any())
+
+        image, leaderboard = render_contest_progress_report(name, columns)
+        self.assertTrue(image.startswith(b'\x89PNG'))
+        self.assertEqual([row['name'] for row in leaderboard], ['ann', 'bob', 'cat'])
+
+
+    def test_zero_starting_weight(self):
+        # e.g. weighed in as 0 before the command only took positive weights
+        check_in = CheckIn.objects.create(contest=self.contest, starting=self.contest.starting)
+        ContestantCheckIn.objects.bulk_create([
+            ContestantCheckIn(
+                contestant=contestant, check_in=check_in, weight=weight, units='lbs',
+                weight_grams=weight_in_grams(weight, 'lbs')
+            )
+            for contestant, weight in zip(self.contestants, [0.0, 200.0, 150.0])
+        ])
+        rebuild_contestant_stats()
+
+        leaderboard = get_contest_leaderboard(self.contest.channel_id)
+        self.assertEqual([(row['name'], row['rank']) for row in leaderboard], [('bob', 1), ('cat', 1), ('ann', 3)])
+        self.assertIsNone(leaderboard[-1]['percent_change'])
+        self.assertEqual(format_percent_change(leaderboard[-1]['percent_change']), 'n/a')
+
+        standings, _ = contest_standings(get_contest_progress_data(self.contest.channel_id)[1])
+        self.assertEqual(list(standings['name']), ['bob', 'cat', 'ann'])
+
+
+class PersonalProgressTestCase(TestCase):
+    def setUp(self) -> None:
+        self.contest = init_happy_path_contest(period=7, num_check_ins=6)
+        self.contestant = Contestant.objects.create(name='happy', discord_id='42', contest=self.contest)
+
+    def log_check_ins(self, count: int):
+        check_ins = list(self.contest.check_ins.order_by('starting')[:count])
+        ContestantCheckIn.objects.bulk_create([
+            ContestantCheckIn(
+                contestant=self.contestant, check_in=check_in, weight=200.0 - i, units='lbs',
+                weight_grams=weight_in_grams(200.0 - i, 'lbs')
+            )
+            for i, check_in in enumerate(check_ins)
+        ])
+
+    async def test_query_count_is_constant(self):
+        await initialize_contest(self.contest)
+        await sync_to_async(self.log_check_ins)(2)
+        with count_queries() as few:
+            await sync_to_async(get_personal_progress_data)('42', self.contest.channel_id)
+
+        await ContestantCheckIn.objects.all().adelete()
+        await sync_to_async(self.log_check_ins)(6)
+        with count_queries() as many:
+            name, columns = await sync_to_async(get_personal_progress_data)('42', self.contest.channel_id)
+
+        # No per-row queries, regardless of how many weigh-ins there are
+        self.assertEqual(few.count, 1)
+        self.assertEqual(many.count, 1)
+        self.assertEqual(name, 'happy')
+        # Converted back to lbs from the stored grams
+        self.assertEqual([round(weight, 2) for weight in columns['weight']], [200.0, 199.0, 198.0, 197.0, 196.0, 195.0])
+
+    async def test_generate_report(self):
+        await initialize_contest(self.contest)
+        await sync_to_async(self.log_check_ins)(3)
+        image = await sync_to_async(generate_personal_progress_report)('42', self.contest.channel_id)
+        self.assertTrue(image.getvalue().startswith(b'\x89PNG'))
+
+
+class LazyImportTestCase(TestCase):
+    def test_bot_does_not_load_analysis_stack(self):
+        _, _, loaded = probe_import('tracking.bot')
+        self.assertEqual(loaded, [])
+
+
+class RoutingCacheTestCase(TestCase):
+    def setUp(self) -> None:
+        routing_cache.clear()
+        self.contest = init_happy_path_contest(period=7, num_check_ins=3)
+
+    async def test_check_in_lifecycle(self):
+        await initialize_contest(self.contest)
+        bot, channel, thread = mock_bot()
+        check_in = await open_first_check_in(self.contest, bot)
+
+        # Opening the check-in primes the cache, so routing weigh-ins to it doesn't need the DB
+        with count_queries() as queries:
+            active = await routing_cache.get_active_check_in(thread.id)
+        self.assertEqual(queries.count, 0)
+        self.assertEqual(active.check_in_id, check_in.id)
+
+        await transition_check_ins([], [check_in], bot, RouteLimiter(total=1, per_route=1))
+        self.assertIsNone(await routing_cache.get_active_check_in(thread.id))
+
+    async def test_concurrent_misses_share_a_query(self):
+        await initialize_contest(self.contest)
+        check_in = await self.contest.check_ins.aearliest('starting')
+        await CheckIn.objects.filter(id=check_in.id).aupdate(thread_id='1', started_at=timezone.now())
+
+        with count_queries() as queries:
+            results = await asyncio.gather(*[routing_cache.get_active_check_in('1') for _ in range(5)])
+        self.assertEqual(queries.count, 1)
+        self.assertEqual({active.check_in_id for active in results}, {check_in.id})
+
+    async def test_expired_entry_goes_back_to_the_db(self):
+        # Another bot process (the scheduler leader) closed the check-in, this one never heard about it
+        await initialize_contest(self.contest)
+        bot, channel, thread = mock_bot()
+        check_in = await open_first_check_in(self.contest, bot)
+        await CheckIn.objects.filter(id=check_in.id).aupdate(
+            started_at=timezone.now() - CHECK_IN_DURATION, finished=True
+        )
+
+        self.assertIsNotNone(await routing_cache.get_active_check_in(thread.id))
+        with patch('tracking.routing.timezone.now', return_value=timezone.now() + CHECK_IN_DURATION):
+            self.assertIsNone(await routing_cache.get_active_check_in(thread.id))
+
+
+class LeaderElectionTestCase(TestCase):
+    async def test_single_leader_with_failover(self):
+        first = LeaderElection('scheduler', ttl=30)
+        second = LeaderElection('scheduler', ttl=30)
+        self.assertTrue(await first.acquire())
+        self.assertFalse(await second.acquire())
+        # Renewing our own lease
+        self.assertTrue(await first.acquire())
+
+        # The leader died without releasing, the lease runs out
+        await SchedulerLease.objects.filter(name='scheduler').aupdate(expires_at=timezone.now())
+        self.assertTrue(await second.acquire())
+        self.assertFalse(await first.acquire())
+
+    async def test_overlapping_shards_are_leased_once(self):
+        # e.g. a rolling deploy from `--shard-ids 0 1` to `--shard-ids 0 1 2 3`
+        old, new = Mock(leased_shards=set()), Mock(leased_shards=set())
+        resynced = Mock()
+        old_leases = [asyncio.create_task(hold_shard_lease(old, shard_id, resynced)) for shard_id in [0, 1]]
+        await asyncio.sleep(0.05)
+        new_leases = [asyncio.create_task(hold_shard_lease(new, shard_id, resynced)) for shard_id in [0, 1, 2, 3]]
+        try:
+            await asyncio.sleep(0.05)
+            self.assertEqual(old.leased_shards, {0, 1})
+            self.assertEqual(new.leased_shards, {2, 3})
+            self.assertEqual(resynced.call_count, 4)
+        finally:
+            for lease in old_leases:
+                lease.cancel()
+            await asyncio.gather(*old_leases, return_exceptions=True)
+        self.assertEqual(old.leased_shards, set())
+
+        for lease in new_leases:
+            lease.cancel()
+        await asyncio.gather(*new_leases, return_exceptions=True)
+
+    async def test_work_cancelled_when_lease_lost(self):
+        election = LeaderElection('scheduler', ttl=0.03)
+        working = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def work():
+            working.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        task = asyncio.create_task(election.run(work))
+        try:
+            await asyncio.wait_for(working.wait(), 1)
+            await SchedulerLease.objects.filter(name='scheduler').aupdate(
+                holder='someone else', expires_at=timezone.now() + datetime.timedelta(minutes=1)
+            )
+            await asyncio.wait_for(cancelled.wait(), 1)
+        finally:
+            task.cancel()
+
+
+class HotQueryIndexTestCase(TestCase):
+    def test_hot_queries_use_indexes(self):
+        contests = seed_contests(num_contests=20, contestants_per_contest=10, num_check_ins=12)
+        analyze()
+        for name, (queryset, indexes) in hot_queries(contests[10]).items():
+            with self.subTest(name):
+                self.assertTrue(uses_index(queryset.explain(), indexes), queryset.explain())
+
+    async def test_duplicate_weigh_in_is_rejected(self):
+        contest = await sync_to_async(init_happy_path_contest)(period=7, num_check_ins=3)
+        contestant = await Contestant.objects.acreate(name='happy', discord_id='42', contest=contest)
+        await initialize_contest(contest)
+        check_in = await contest.check_ins.aearliest('starting')
+        await ContestantCheckIn.objects.acreate(contestant=contestant, check_in=check_in, weight=200.0, units='lbs')
+        with self.assertRaises(IntegrityError):
+            await ContestantCheckIn.objects.acreate(contestant=contestant, check_in=check_in, weight=201.0, units='lbs')
+
+
+class BenchmarkSuiteTestCase(TestCase):
+    def test_suite_runs_every_benchmark(self):
+        contests = seed_contests(num_contests=2, contestants_per_contest=5, num_check_ins=6)
+        results = run_benchmarks(contests, iterations=3, batch=2, burst=5)
+        self.assertEqual(set(results), {
+            'weigh_in', 'weigh_in_burst', 'personal_progress', 'scheduler_close', 'scheduler_open',
+            'scheduler_resync', 'initialize_contest'
+        })
+        for name, summary in results.items():
+            with self.subTest(name):
+                self.assertEqual(summary['iterations'], 3)
+                self.assertLessEqual(summary['p50_ms'], summary['p95_ms'])
+        # Seen through the commands' own metrics. The burst's lookups go one by one but its writes (after the first)
+        # together, so five weigh-ins at once cost well under five one at a time.
+        self.assertGreater(results['weigh_in']['queries'], 0)
+        self.assertLess(results['weigh_in_burst']['queries'], 4 * results['weigh_in']['queries'])
+        # Both contests get a check-in closed then opened in every iteration, batched like the scheduler tests expect
+        self.assertLessEqual(results['scheduler_close']['queries'], 4)
+        self.assertLessEqual(results['scheduler_open']['queries'], 4)
+        running = CheckIn.objects.filter(contest__in=contests, finished=False, thread_id__isnull=False)
+        self.assertEqual(running.count(), 2)
+
+    def test_compare_against_baseline(self):
+        baseline = {'1k': {'weigh_in': {'p50_ms': 5.0, 'p95_ms': 10.0, 'queries': 4}}}
+        noisy = {'1k': {'weigh_in': {'p50_ms': 6.0, 'p95_ms': 12.0, 'queries': 4}}, '50k': {}}
+        self.assertEqual(compare(noisy, baseline, tolerance=0.25), ([], []))
+
+        # A slower machine only warns, an extra query fails
+        slower = {'1k': {'weigh_in': {'p50_ms': 9.0, 'p95_ms': 13.0, 'queries': 4}}}
+        self.assertEqual(compare(slower, baseline, tolerance=0.25), ([], ['1k/weigh_in: p95 13.0ms, baseline 10.0ms']))
+        regressed = {'1k': {'weigh_in': {'p50_ms': 5.0, 'p95_ms': 10.0, 'queries': 5}}}
+        self.assertEqual(compare(regressed, baseline, tolerance=0.25), (['1k/weigh_in: 5 queries, baseline 4'], []))
+
+
+class CommandTreeSyncTestCase(TestCase):
+    def setUp(self) -> None:
+        self.bot = WeighbotClient(intents=discord.Intents.default())
+        self.bot._connection.application_id = 1234
+        self.bot.tree.sync = AsyncMock()
+
+        @self.bot.tree.command(description='Says hi.')
+        async def hello(interaction: discord.Interaction):
+            pass
+
+    async def test_sync_skipped_when_unchanged(self):
+        await self.bot.sync_commands()
+        self.assertEqual(self.bot.tree.sync.await_count, 1)
+        self.assertEqual((await CommandTreeSync.objects.aget()).tree_hash, command_tree_hash(self.bot.tree))
+
+        # Restart with the same commands
+        await self.bot.sync_commands()
+        self.assertEqual(self.bot.tree.sync.await_count, 1)
+
+        self.bot.force_command_sync = True
+        await self.bot.sync_commands()
+        self.assertEqual(self.bot.tree.sync.await_count, 2)
+
+    async def test_sync_when_commands_change(self):
+        await self.bot.sync_commands()
+
+        @self.bot.tree.command(description='Says bye.')
+        async def bye(interaction: discord.Interaction):
+            pass
+
+        await self.bot.sync_commands()
+        self.assertEqual(self.bot.tree.sync.await_count, 2)
+        self.assertEqual(await CommandTreeSync.objects.acount(), 1)
+
+
+class MetricsTestCase(TestCase):
+    def test_histogram_exposition(self):
+        metrics = Registry()
+        latency = metrics.histogram('test_seconds', 'Test latency', ['route'], buckets=(0.1, 1.0))
+        latency.observe(0.05, route='a "quoted" route')
+        latency.observe(0.1, route='a "quoted" route')
+        latency.observe(3.0, route='a "quoted" route')
+        metrics.counter('test_total', 'Test count').inc(2)
+        self.assertIn('\n'.join([
+            '# HELP test_seconds Test latency',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{route="a \\"quoted\\" route",le="0.1"} 2',
+            'test_seconds_bucket{route="a \\"quoted\\" route",le="1.0"} 2',
+            'test_seconds_bucket{route="a \\"quoted\\" route",le="+Inf"} 3',
+            'test_seconds_sum{route="a \\"quoted\\" route"} 3.15',
+            'test_seconds_count{route="a \\"quoted\\" route"} 3',
+            '# HELP test_total Test count',
+            '# TYPE test_total counter',
+            'test_total 2.0',
+        ]), metrics.render())
+        with self.assertRaises(ValueError):
+            latency.observe(1.0)
+
+    async def test_commands_are_timed(self):
+        bot = WeighbotClient(intents=discord.Intents.default())
+
+        @bot.tree.command(description='Counts contests.')
+        async def count_contests_for_metrics(interaction: discord.Interaction):
+            await Contest.objects.acount()
+
+        @bot.tree.command(description='Fails.')
+        async def fail_for_metrics(interaction: discord.Interaction):
+            raise RuntimeError()
+
+        with count_queries() as queries:
+            await count_contests_for_metrics.callback(Mock())
+        # Still counted by whoever else is counting
+        self.assertEqual(queries.count, 1)
+        with self.assertRaises(RuntimeError):
+            await fail_for_metrics.callback(Mock())
+
+        rendered = registry.render()
+        self.assertIn('weighbot_command_seconds_count{command="count_contests_for_metrics"} 1', rendered)
+        self.assertIn('weighbot_command_db_queries_bucket{command="count_contests_for_metrics",le="1.0"} 1', rendered)
+        self.assertIn('weighbot_command_db_queries_bucket{command="count_contests_for_metrics",le="0.0"} 0', rendered)
+        self.assertIn('weighbot_command_errors_total{command="fail_for_metrics"} 1.0', rendered)
+        self.assertNotIn('weighbot_command_errors_total{command="count_contests_for_metrics"}', rendered)
+
+    async def test_discord_requests_are_timed(self):
+        http = Mock()
+        http.request = AsyncMock(side_effect=[{'id': 1}, discord.NotFound(Mock(status=404, reason='Not Found'), '')])
+        instrument_http(http)
+        route = discord.http.Route('GET', '/channels/{channel_id}/pins', channel_id=1)
+        await http.request(route)
+        with self.assertRaises(discord.NotFound):
+            await http.request(route)
+
+        rendered = registry.render()
+        for status in ('ok', '404'):
+            self.assertIn(
+                f'weighbot_discord_request_seconds_count{{method="GET",route="/channels/{{channel_id}}/pins",'
+                f'status="{status}"}} 1',
+                rendered
+            )
+
+    async def test_bot_serves_metrics(self):
+        runner = await serve_metrics('127.0.0.1', 0)
+        try:
+            port = runner.addresses[0][1]
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f'http://127.0.0.1:{port}/metrics') as response:
+                    self.assertEqual(response.status, 200)
+                    self.assertTrue(response.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+                    body = await response.text()
+        finally:
+            await runner.cleanup()
+        self.assertIn('# TYPE weighbot_scheduler_tick_seconds histogram', body)
+        self.assertIn('weighbot_db_connects_total', body)
+
+    def test_admin_requests_are_timed(self):
+        # Redirected to the login page
+        response = self.client.get('/admin/')
+        self.assertIn('db;dur=', response['Server-Timing'])
+        metrics = self.client.get('/metrics').content.decode()
+        self.assertIn('weighbot_admin_request_seconds_count{view="admin:index",method="GET",status="302"}', metrics)
+
+    def test_admin_metrics_are_restricted(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, 403)
+
+        staff = User.objects.create_user('staff', password='staff', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, 200)
+
+
+def spin_for_profile(seconds: float):
+    # Holds the event loop like a slow callback would
+    time.sleep(seconds)
+
+
+class ProfilingTestCase(TestCase):
+    async def test_profile_is_rooted_at_task_names(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/profile.collapsed'
+            profiler = SamplingProfiler(asyncio.get_running_loop(), interval=0.005, duration=0.3, path=path)
+            profiler.start()
+
+            async def spin():
+                spin_for_profile(0.2)
+            await asyncio.create_task(spin(), name='spin')
+            await asyncio.to_thread(profiler.join)
+
+            with open(path) as profile:
+                lines = profile.read().splitlines()
+
+        self.assertGreater(profiler.samples, 10)
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            self.assertGreater(int(count), 0)
+        spinning = [line for line in lines if ';spin;' in line and 'spin_for_profile (' in line]
+        self.assertTrue(spinning, lines)
+        # Other threads (e.g. the test runner's) are sampled too, just without a task
+        self.assertTrue(any(';spin;' not in line for line in lines))
+
+    def test_frame_labels_are_cached(self):
+        _frame_label.cache_clear()
+        for _ in range(3):
+            labels = collapse_stack(sys._getframe())
+        line = self.test_frame_labels_are_cached.__code__.co_firstlineno
+        self.assertEqual(labels[-1], f'test_frame_labels_are_cached (tracking/tests.py:{line})')
+        # Only the first walk labelled anything, the others were all cache hits
+        self.assertEqual(_frame_label.cache_info().misses, len(labels))
+
+    async def test_only_one_profile_at_a_time(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(PROFILE_DIR=directory, PROFILE_SECONDS=0.05):
+                profiler = start_profiling(asyncio.get_running_loop())
+                self.assertIsNone(start_profiling(asyncio.get_running_loop()))
+                await asyncio.to_thread(profiler.join)
+                self.assertTrue(profiler.path.startswith(directory))
+                self.assertTrue(os.path.exists(profiler.path))
+
+    async def test_lag_monitor_reports_what_blocks_the_loop(self):
+        monitor = asyncio.create_task(LoopLagMonitor(threshold=0.05).run(), name='monitor')
+        await asyncio.sleep(0.05)
+        try:
+            with self.assertLogs('tracking.profiling', 'WARNING') as logs:
+                spin_for_profile(0.3)
+                await asyncio.sleep(0)
+        finally:
+            monitor.cancel()
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('Event loop blocked for', logs.output[0])
+        self.assertIn('spin_for_profile', logs.output[0])
@@ -0,0 +1,162 @@
+import asyncio
+import dataclasses
+import logging
+import os
+import tempfile
+
+import aiohttp
+import discord
+from django.conf import settings
+from django.core.files import File
+
+from tracking.db import prepare_connections
+from tracking.images import render_variants_async
+from tracking.logic import store_check_in_photo, store_photo_variants
+from tracking.metrics import ATTACHMENT_BYTES
+from tracking.models import ContestantCheckIn
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class PhotoUpload:
+    contestant_check_in: ContestantCheckIn
+    attachment: discord.Attachment
+    thread_id: int
+    user_id: int
+
+
+async def download_attachment(
+        session: aiohttp.ClientSession,
+        attachment: discord.Attachment,
+        chunk_size: int = None
+) -> tempfile.NamedTemporaryFile:
+    """
+    Streams an attachment from Discord's CDN into a temp file, one chunk at a time, so memory use is bounded
+    regardless of the image size. The file is deleted once closed.
+    """
+    chunk_size = chunk_size or settings.PHOTO_UPLOAD_CHUNK_SIZE
+    spool = tempfile.NamedTemporaryFile(prefix='ayweigh-', suffix=os.path.splitext(attachment.filename)[1])
+    try:
+        async with session.get(attachment.url) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(chunk_size):
+                spool.write(chunk)
+        spool.flush()
+    except BaseException:
+        spool.close()
+        raise
+    ATTACHMENT_BYTES.observe(spool.tell())
+    spool.seek(0)
+    return spool
+
+
+class PhotoUploadQueue:
+    """
+    Bounded queue that downloads and stores check-in photos in the background, so weigh-ins can be acknowledged
+    without waiting on Discord's CDN or the storage backend. Failed uploads are retried with backoff and reported
+    back to the check-in thread once they run out of attempts.
+    """
+
+    def __init__(
+            self,
+            bot: 'tracking.bot.WeighbotClient',
+            *,
+            concurrency: int = None,
+            max_pending: int = None,
+            max_attempts: int = None,
+            retry_delay: float = None
+    ):
+        self.bot = bot
+        self.concurrency = concurrency or settings.PHOTO_UPLOAD_CONCURRENCY
+        self.max_pending = max_pending or settings.PHOTO_UPLOAD_QUEUE_SIZE
+        self.max_attempts = max_attempts or settings.PHOTO_UPLOAD_MAX_ATTEMPTS
+        self.retry_delay = settings.PHOTO_UPLOAD_RETRY_DELAY if retry_delay is None else retry_delay
+        self._queue = None
+        self._workers = []
+        self._session = None
+
+    def start(self):
+        if self._workers:
+            return
+        self._session = aiohttp.ClientSession()
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._workers = [
+            asyncio.create_task(self._work(), name=f'photo-upload-{i}') for i in range(self.concurrency)
+        ]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def submit(self, upload: PhotoUpload) -> bool:
+        """
+        Queues an upload, returns False if the queue is full and the upload was dropped.
+        """
+        self.start()
+        try:
+            self._queue.put_nowait(upload)
+        except asyncio.QueueFull:
+            logger.warning('Photo upload queue is full, dropping attachment %s', upload.attachment.id)
+            return False
+        return True
+
+    async def join(self):
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def _work(self):
+        while True:
+            upload = await self._queue.get()
+            try:
+                await self._process(upload)
+            except Exception:
+                logger.exception('Unexpected failure handling attachment %s', upload.attachment.id)
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, upload: PhotoUpload):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await self._store(upload)
+                return
+            except Exception:
+                logger.exception(
+                    'Failed storing attachment %s (attempt %d/%d)', upload.attachment.id, attempt, self.max_attempts
+                )
+            if attempt < self.max_attempts:
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+        await self._report_failure(upload)
+
+    async def _store(self, upload: PhotoUpload):
+        with await download_attachment(self._session, upload.attachment) as spool:
+            image = File(spool, name=upload.attachment.filename)
+            await prepare_connections()
+            photo = await store_check_in_photo(upload.contestant_check_in, upload.attachment.id, image)
+
+            # The original is safely stored at this point, so don't retry the upload if only the variants fail
+            try:
+                variants = await render_variants_async(
+                    spool.name, settings.PHOTO_VARIANT_FORMAT, settings.IMAGE_PROCESSING_WORKERS
+                )
+                await store_photo_variants(photo, variants)
+            except Exception:
+                logger.exception('Failed generating variants for attachment %s', upload.attachment.id)
+
+    async def _report_failure(self, upload: PhotoUpload):
+        thread = self.bot.get_channel(int(upload.thread_id))
+        if thread is None:
+            return
+        try:
+            await thread.send(
+                f'<@{upload.user_id}>, sorry, your photo {upload.attachment.filename} could not be saved. '
+                f'Your weight was still recorded.'
+            )
+        except discord.errors.DiscordException:
+            logger.exception('Failure reporting upload error for attachment %s', upload.attachment.id)
@@ -1,3 +1,12 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
 
-# Create your views here.
+from tracking.metrics import CONTENT_TYPE, registry
+
+
+def metrics(request):
+    # Served on the admin's public host, so only to staff and the scraper's address
+    if not (request.user.is_staff or request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS):
+        raise PermissionDenied
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
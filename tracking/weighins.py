@@ -0,0 +1,140 @@
+"""
+Write-behind batching for weigh-ins. When a check-in opens, most of a contest weighs in within minutes, and writing each
+weigh-in in its own transaction queues them all up behind each other on the single DB thread. `WeighInWriter` instead
+gathers the weigh-ins arriving together and writes them with one upsert, each caller still getting its own diffs.
+"""
+import asyncio
+import contextvars
+import logging
+from typing import List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from tracking.errors import ContestantNotFound
+from tracking.instrumentation import attribute_queries, count_queries, current_query_counter
+from tracking.metrics import WEIGH_IN_BATCH_SIZE
+from tracking.models import ContestantCheckIn
+from tracking.stats import apply_weigh_in, get_stats, rebuild_contestant_stats, save_contestant_stats, weigh_in_diffs
+
+logger = logging.getLogger(__name__)
+
+# Column names, see `save_contestant_stats`
+WEIGH_IN_UPDATE_FIELDS = ['weight', 'units', 'weight_grams', 'discord_id', 'updated_at']
+
+
+def save_weigh_ins(weigh_ins: List[ContestantCheckIn]) -> List[tuple]:
+    """
+    Upserts the weigh-ins (setting their ids) and updates their contestants' stats, in one transaction and a fixed
+    number of queries however many there are. A contestant who already weighed in to the check-in has their weigh-in
+    replaced.
+
+    Returns the diffs of each weigh-in (see `weigh_in_diffs`), as of the weigh-ins before it in the list.
+    """
+    with transaction.atomic():
+        # Only the last weigh-in of a contestant for a check-in survives, and an upsert can't touch a row twice
+        latest = {(weigh_in.contestant_id, weigh_in.check_in_id): weigh_in for weigh_in in weigh_ins}
+        ContestantCheckIn.objects.bulk_create(
+            list(latest.values()),
+            update_conflicts=True,
+            unique_fields=['contestant_id', 'check_in_id'],
+            update_fields=WEIGH_IN_UPDATE_FIELDS
+        )
+
+        # Django 4.1 doesn't return ids from upserts. Read them back along with what the stats need, which the upsert
+        # didn't touch.
+        saved = ContestantCheckIn.objects.filter(
+            contestant_id__in={contestant_id for contestant_id, _ in latest},
+            check_in_id__in={check_in_id for _, check_in_id in latest}
+        ).select_related('contestant__stats', 'check_in')
+        saved = {(row.contestant_id, row.check_in_id): row for row in saved}
+
+        diffs = []
+        updated = {}
+        rebuild = set()
+        for weigh_in in weigh_ins:
+            row = saved.get((weigh_in.contestant_id, weigh_in.check_in_id))
+            if row is None:
+                # Foreign keys are only checked on commit, but the join above already came up empty
+                raise ContestantNotFound(f'Contestant {weigh_in.contestant_id} no longer exists')
+            weigh_in.id = row.id
+            contestant_id = weigh_in.contestant_id
+            stats = updated[contestant_id] if contestant_id in updated else get_stats(row.contestant)
+            diffs.append(weigh_in_diffs(stats, weigh_in.check_in_id, weigh_in.weight_grams))
+            if contestant_id in rebuild:
+                continue
+
+            stats = apply_weigh_in(
+                stats, contestant_id, weigh_in.check_in_id, row.check_in.previous_id, row.check_in.starting,
+                weigh_in.weight_grams
+            )
+            if stats is None:
+                rebuild.add(contestant_id)
+                updated.pop(contestant_id, None)
+            else:
+                updated[contestant_id] = stats
+
+        if updated:
+            save_contestant_stats(list(updated.values()))
+        if rebuild:
+            rebuild_contestant_stats(rebuild)
+    return diffs
+
+
+class WeighInWriter:
+    """
+    Coalesces concurrent weigh-ins into `save_weigh_ins` batches. A weigh-in arriving while nothing is being written
+    is written right away, whatever arrives while a batch is being written goes in the next one, up to `max_batch` at
+    a time. `submit` returns once the weigh-in is committed, so it can still be acknowledged as saved.
+    """
+
+    def __init__(self, *, max_batch: int = None):
+        self.max_batch = max_batch or settings.WEIGH_IN_BATCH_SIZE
+        self._pending = []
+        self._flusher = None
+
+    async def submit(self, weigh_in: ContestantCheckIn) -> (float, Optional[float]):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # The batch's queries are counted for every weigh-in in it (see `_write`), rather than for whoever happened
+        # to start the flusher
+        self._pending.append((weigh_in, future, current_query_counter()))
+        if self._flusher is None or self._flusher.done() or self._flusher.get_loop() is not loop:
+            # A fresh context, see above. `create_task(context=)` is 3.11+ only, the images are on 3.10.
+            self._flusher = contextvars.Context().run(loop.create_task, self._flush(), name='weigh-in-writer')
+        return await future
+
+    async def _flush(self):
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            await self._write(batch)
+
+    async def _write(self, batch: list):
+        WEIGH_IN_BATCH_SIZE.observe(len(batch))
+        try:
+            with count_queries() as queries:
+                try:
+                    results = await sync_to_async(save_weigh_ins, thread_sensitive=True)(
+                        [weigh_in for weigh_in, _, _ in batch]
+                    )
+                finally:
+                    attribute_queries((counter for _, _, counter in batch), queries.count, queries.seconds)
+        except Exception as e:
+            if len(batch) == 1:
+                _, future, _ = batch[0]
+                if not future.done():
+                    future.set_exception(e)
+                return
+            # Don't let one bad weigh-in (e.g. from a contestant deleted in the meantime) fail everyone else's
+            logger.warning('Failure writing %d weigh-ins together, retrying one at a time', len(batch), exc_info=True)
+            for entry in batch:
+                await self._write([entry])
+            return
+
+        for (_, future, _), diffs in zip(batch, results):
+            if not future.done():
+                future.set_result(diffs)
+
+
+weigh_in_writer = WeighInWriter()
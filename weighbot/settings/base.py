@@ -40,6 +40,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'tracking.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     "whitenoise.middleware.WhiteNoiseMiddleware",
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -145,3 +146,102 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Optional because there are multiple run modes for the application
 
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
+
+# Bot sharding
+# To split the bot across processes, give every process the same BOT_SHARD_COUNT and its own comma separated
+# BOT_SHARD_IDS (e.g. "0,1"). Unset, a single process connects all the shards Discord recommends.
+
+BOT_SHARD_COUNT = int(os.environ['BOT_SHARD_COUNT']) if os.environ.get('BOT_SHARD_COUNT') else None
+BOT_SHARD_IDS = [int(shard_id) for shard_id in os.environ.get('BOT_SHARD_IDS', '').split(',') if shard_id]
+
+# Metrics
+# The bot serves Prometheus metrics at http://BOT_METRICS_HOST:BOT_METRICS_PORT/metrics, set the port to 0 to turn it
+# off. Only on the loopback interface by default, set the host to 0.0.0.0 to let a scraper on another host (or outside
+# the container) in, on a private network only. Give each process its own port when running several shards on one
+# host. The admin serves its own at /metrics, to staff and to the comma separated METRICS_ALLOWED_IPS.
+
+BOT_METRICS_HOST = os.environ.get('BOT_METRICS_HOST', '127.0.0.1')
+BOT_METRICS_PORT = int(os.environ.get('BOT_METRICS_PORT', '9100'))
+METRICS_ALLOWED_IPS = [ip for ip in os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip]
+
+# Profiling
+# `kill -USR1 <bot pid>` samples the stacks of every thread in the bot, every PROFILE_SAMPLE_INTERVAL seconds for
+# PROFILE_SECONDS, and writes them as collapsed stacks (for flamegraph.pl, speedscope, ...) to PROFILE_DIR (defaults to
+# the temp directory). Separately, the event loop is reported as blocked whenever it can't run for
+# EVENT_LOOP_LAG_THRESHOLD seconds.
+
+PROFILE_SECONDS = float(os.environ.get('PROFILE_SECONDS', '30'))
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', '0.01'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+EVENT_LOOP_LAG_THRESHOLD = float(os.environ.get('EVENT_LOOP_LAG_THRESHOLD', '0.25'))
+
+# Check-in scheduler
+# The scheduler sleeps until the next check-in deadline, but rebuilds its schedule from the DB at least this often
+# to pick up contests created or edited outside the bot process (e.g. through the admin).
+
+CHECK_IN_SCHEDULER_RESYNC_SECONDS = int(os.environ.get('CHECK_IN_SCHEDULER_RESYNC_SECONDS', '300'))
+
+# Every bot process schedules the check-ins of its own shards, holding a lease for each of them so two processes
+# running the same shard (e.g. during a rolling deploy) don't both do it. If the holder dies, the other one takes over
+# within this many seconds.
+
+CHECK_IN_SCHEDULER_LEASE_SECONDS = int(os.environ.get('CHECK_IN_SCHEDULER_LEASE_SECONDS', '30'))
+
+# When many contests share a check-in date, their threads are opened (and closed) concurrently. Discord rate limits
+# sends per channel and globally, so cap the calls in flight overall and per channel.
+
+CHECK_IN_FANOUT_CONCURRENCY = int(os.environ.get('CHECK_IN_FANOUT_CONCURRENCY', '10'))
+CHECK_IN_FANOUT_PER_CHANNEL = int(os.environ.get('CHECK_IN_FANOUT_PER_CHANNEL', '1'))
+
+# Bot database connections
+# The bot keeps one persistent connection (see `tracking.db`). It's only health checked before use if it sat idle for
+# at least this long, so bursts of weigh-ins don't pay an extra round-trip each. Connection stats are logged every
+# DB_METRICS_LOG_SECONDS.
+
+DB_IDLE_HEALTH_CHECK_SECONDS = int(os.environ.get('DB_IDLE_HEALTH_CHECK_SECONDS', '60'))
+DB_METRICS_LOG_SECONDS = int(os.environ.get('DB_METRICS_LOG_SECONDS', '300'))
+
+# Weigh-in writes
+# Weigh-ins arriving while others are being written (e.g. right as a check-in opens) are written together after them,
+# in batches of up to WEIGH_IN_BATCH_SIZE.
+
+WEIGH_IN_BATCH_SIZE = int(os.environ.get('WEIGH_IN_BATCH_SIZE', '500'))
+
+# Check-in photo uploads
+# Photos are downloaded and stored in the background after the weigh-in has been acknowledged.
+
+PHOTO_UPLOAD_CONCURRENCY = int(os.environ.get('PHOTO_UPLOAD_CONCURRENCY', '4'))
+
+PHOTO_UPLOAD_QUEUE_SIZE = int(os.environ.get('PHOTO_UPLOAD_QUEUE_SIZE', '100'))
+
+PHOTO_UPLOAD_MAX_ATTEMPTS = int(os.environ.get('PHOTO_UPLOAD_MAX_ATTEMPTS', '3'))
+
+PHOTO_UPLOAD_RETRY_DELAY = float(os.environ.get('PHOTO_UPLOAD_RETRY_DELAY', '2'))
+
+# Attachments are streamed from Discord to a temp file in chunks of this size
+
+PHOTO_UPLOAD_CHUNK_SIZE = int(os.environ.get('PHOTO_UPLOAD_CHUNK_SIZE', str(256 * 1024)))
+
+# Thumbnail and display-size variants are rendered in a process pool, in this format ('webp' or 'jpeg')
+
+PHOTO_VARIANT_FORMAT = os.environ.get('PHOTO_VARIANT_FORMAT', 'webp')
+
+IMAGE_PROCESSING_WORKERS = int(os.environ.get('IMAGE_PROCESSING_WORKERS', '2'))
+
+# Progress charts
+# Charts render in a dedicated process pool. At most `CHART_RENDER_WORKERS` render at once, with up to
+# `CHART_RENDER_QUEUE_SIZE` more waiting, and any render taking longer than `CHART_RENDER_TIMEOUT` seconds is abandoned.
+
+CHART_RENDER_WORKERS = int(os.environ.get('CHART_RENDER_WORKERS', '1'))
+
+CHART_RENDER_QUEUE_SIZE = int(os.environ.get('CHART_RENDER_QUEUE_SIZE', '8'))
+
+CHART_RENDER_TIMEOUT = float(os.environ.get('CHART_RENDER_TIMEOUT', '30'))
+
+# Rendered charts are cached in memory up to `CHART_CACHE_MAX_BYTES`. Set `CHART_CACHE_DIR` to also keep them on disk.
+
+CHART_CACHE_MAX_BYTES = int(os.environ.get('CHART_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+
+CHART_CACHE_DIR = os.environ.get('CHART_CACHE_DIR')
+
+CHART_CACHE_DISK_MAX_BYTES = int(os.environ.get('CHART_CACHE_DISK_MAX_BYTES', str(256 * 1024 * 1024)))
@@ -16,11 +16,19 @@ DATABASES = {
         'PASSWORD': os.environ['DB_PASS'],
         'HOST': os.environ['DB_HOST'],
         'PORT': os.environ.get('DB_PORT', '5432'),
+        # Keep connections open between requests (and in the bot, between units of work), re-pinging them before
+        # reuse so a connection dropped by the server or a proxy is replaced instead of failing the next query
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '3600')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'keepalives': 1,
+            'keepalives_idle': int(os.environ.get('DB_KEEPALIVES_IDLE', '60')),
+        },
     }
 }
 
 # Media storage settings
-DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+DEFAULT_FILE_STORAGE = 'tracking.storage.MultipartS3Storage'
 
 AWS_ACCESS_KEY_ID = os.environ['AWS_ACCESS_KEY_ID']
 
@@ -30,4 +38,9 @@ AWS_S3_REGION_NAME = os.environ['AWS_S3_REGION_NAME']
 
 AWS_S3_ENDPOINT_URL = os.environ['AWS_S3_ENDPOINT_URL']
 
-AWS_STORAGE_BUCKET_NAME = os.environ['AWS_STORAGE_BUCKET_NAME']
\ No newline at end of file
+AWS_STORAGE_BUCKET_NAME = os.environ['AWS_STORAGE_BUCKET_NAME']
+
+# S3 only accepts multipart chunks of 5MB or more (except for the last one)
+AWS_S3_MULTIPART_CHUNK_SIZE = int(os.environ.get('AWS_S3_MULTIPART_CHUNK_SIZE', str(8 * 1024 * 1024)))
+
+AWS_S3_MULTIPART_CONCURRENCY = int(os.environ.get('AWS_S3_MULTIPART_CONCURRENCY', '2'))
@@ -18,8 +18,11 @@ from django.contrib import admin
 from django.urls import path
 from django.conf.urls.static import static
 
+from tracking import views
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', views.metrics, name='metrics'),
 ]
 
 # For simplicity, just serve these always for now